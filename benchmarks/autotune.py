@@ -0,0 +1,143 @@
+"""
+Tunes the CPU execution profile of the training sessions of the models on this host.
+
+Every combination of a grid of intra op thread pool sizes, inter op thread pool sizes, thread pinning and batch sizes
+is measured with benchmarks/train_throughput.py on synthetic data. Every combination runs in its own process, since
+the thread pools and the pinning are fixed when the first session of a process is created. The combination with the
+highest images/sec is stored as the profile of the model for this host (see utils/session.py), which the training and
+evaluation entry points then use automatically. Example:
+
+    python benchmarks/autotune.py --models=wgancls,pggan --intra_op_threads=4,8,16 --inter_op_threads=1,2
+"""
+import datetime
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+
+import tensorflow as tf
+
+from utils.benchmark import write_results
+from utils.session import PROFILE_DIR, get_profile_path, pinning_env, save_profile
+
+flags = tf.app.flags
+flags.DEFINE_string('models', 'gancls,wgancls,stagei,stageii,pggan',
+                    'Comma separated list of the models to tune [gancls,wgancls,stagei,stageii,pggan]')
+flags.DEFINE_string('dataset', 'flowers', 'The dataset whose configs are used [flowers]')
+flags.DEFINE_string('intra_op_threads', '', 'Comma separated list of the intra op thread pool sizes. Empty tries the '
+                                            'powers of two up to the number of cores []')
+flags.DEFINE_string('inter_op_threads', '1,2', 'Comma separated list of the inter op thread pool sizes [1,2]')
+flags.DEFINE_string('pin_threads', 'false,true', 'Comma separated list of the thread pinning modes [false,true]')
+flags.DEFINE_string('batch_sizes', '', 'Comma separated list of batch sizes. Empty uses the batch size of the '
+                                       'configs []')
+flags.DEFINE_integer('warmup_steps', 3, 'Number of steps which are not timed [3]')
+flags.DEFINE_integer('steps', 10, 'Number of timed steps [10]')
+flags.DEFINE_string('profile_dir', PROFILE_DIR, 'Directory of the profiles [%s]' % PROFILE_DIR)
+flags.DEFINE_boolean('save', True, 'Store the best combination as the profile of the model [True]')
+flags.DEFINE_string('output_json', '', 'Path of the JSON results of all the combinations')
+flags.DEFINE_string('output_csv', '', 'Path of the CSV results of all the combinations')
+FLAGS = flags.FLAGS
+
+
+def parse_list(value, cast):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def parse_bool(value):
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def default_intra_op_threads():
+    cores = os.cpu_count() or 1
+    threads = [2 ** i for i in range(cores.bit_length()) if 2 ** i < cores]
+    return threads + [cores]
+
+
+def measure(model_name, intra_op_threads, inter_op_threads, pin_threads, batch_size):
+    """Benchmarks one combination in a fresh process and returns its result"""
+    env = dict(os.environ)
+    if pin_threads:
+        env.update(pinning_env(intra_op_threads))
+
+    fd, output_json = tempfile.mkstemp(suffix='.json', prefix='autotune_')
+    os.close(fd)
+    try:
+        subprocess.check_call([
+            sys.executable, '-m', 'benchmarks.train_throughput',
+            '--models=%s' % model_name,
+            '--dataset=%s' % FLAGS.dataset,
+            '--device=cpu',
+            '--warmup_steps=%d' % FLAGS.warmup_steps,
+            '--steps=%d' % FLAGS.steps,
+            '--batch_size=%d' % batch_size,
+            '--summary_period=0',
+            '--checkpoint_period=-1',
+            '--intra_op_threads=%d' % intra_op_threads,
+            '--inter_op_threads=%d' % inter_op_threads,
+            '--output_json=%s' % output_json,
+        ], env=env, stdout=subprocess.DEVNULL)
+        with open(output_json, 'r') as f:
+            result = json.load(f)[0]
+    except (subprocess.CalledProcessError, ValueError, IndexError) as e:
+        result = {'error': '%s: %s' % (type(e).__name__, e)}
+    finally:
+        os.remove(output_json)
+
+    return OrderedDict([
+        ('model', model_name),
+        ('intra_op_threads', intra_op_threads),
+        ('inter_op_threads', inter_op_threads),
+        ('pin_threads', pin_threads),
+        ('batch_size', result.get('batch_size', batch_size)),
+        ('steps_per_sec', result.get('steps_per_sec')),
+        ('images_per_sec', result.get('images_per_sec')),
+        ('error', result.get('error')),
+    ])
+
+
+def main(_):
+    intra_grid = parse_list(FLAGS.intra_op_threads, int) or default_intra_op_threads()
+    inter_grid = parse_list(FLAGS.inter_op_threads, int)
+    pin_grid = parse_list(FLAGS.pin_threads, parse_bool)
+    # A batch size of 0 lets the benchmark use the one of the config
+    batch_grid = parse_list(FLAGS.batch_sizes, int) or [0]
+
+    results = []
+    for model_name in parse_list(FLAGS.models, str):
+        best = None
+        for intra, inter, pin, batch_size in itertools.product(intra_grid, inter_grid, pin_grid, batch_grid):
+            result = measure(model_name, intra, inter, pin, batch_size)
+            results.append(result)
+            if result['error']:
+                print('%-8s intra %3d inter %2d pinned %-5s batch %3d: failed, %s' % (
+                    model_name, intra, inter, pin, batch_size, result['error']))
+                continue
+            print('%-8s intra %3d inter %2d pinned %-5s batch %3d: %8.2f images/sec' % (
+                model_name, intra, inter, pin, result['batch_size'], result['images_per_sec']))
+            sys.stdout.flush()
+            if best is None or result['images_per_sec'] > best['images_per_sec']:
+                best = result
+
+        if best is None:
+            print('%s: every combination failed, no profile is stored' % model_name)
+            continue
+        print('%s: best %.2f images/sec with %d intra op threads, %d inter op threads, pinned: %s, batch size %d' % (
+            model_name, best['images_per_sec'], best['intra_op_threads'], best['inter_op_threads'],
+            best['pin_threads'], best['batch_size']))
+        if FLAGS.save:
+            profile = OrderedDict((key, best[key]) for key in ['intra_op_threads', 'inter_op_threads', 'pin_threads',
+                                                               'batch_size', 'steps_per_sec', 'images_per_sec'])
+            profile['dataset'] = FLAGS.dataset
+            profile['tuned_at'] = datetime.datetime.now().isoformat(timespec='seconds')
+            save_profile(model_name, profile, profile_dir=FLAGS.profile_dir)
+            print('Stored the profile in %s' % get_profile_path(socket.gethostname(), FLAGS.profile_dir))
+
+    write_results(results, FLAGS.output_json, FLAGS.output_csv)
+
+
+if __name__ == '__main__':
+    tf.app.run()
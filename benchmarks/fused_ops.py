@@ -0,0 +1,100 @@
+"""
+Compares the fused upscale + conv and conv + downscale ops of utils/ops.py with the separate ops they replace.
+
+Both versions are built on the same variables, so the outputs are compared directly: the maximum absolute
+difference is only due to the different order of the floating point additions. The forward and backward time of
+every version is recorded. Example:
+
+    python benchmarks/fused_ops.py --size=256 --channels=64 --batch_size=8 --output_json=./bench/fused.json
+"""
+import time
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from utils.benchmark import write_results
+from utils.ops import conv2d, conv2d_downscale, pool, upscale, upscale_conv2d
+
+flags = tf.app.flags
+flags.DEFINE_integer('size', 256, 'The output size of the upscale and the input size of the downscale [256]')
+flags.DEFINE_integer('channels', 64, 'Number of input and output channels [64]')
+flags.DEFINE_integer('batch_size', 8, 'The batch size [8]')
+flags.DEFINE_string('device', 'cpu', 'The device to run on: cpu or gpu [cpu]')
+flags.DEFINE_integer('warmup_steps', 2, 'Number of runs which are not timed [2]')
+flags.DEFINE_integer('steps', 10, 'Number of timed runs [10]')
+flags.DEFINE_string('output_json', '', 'Path of the JSON results')
+flags.DEFINE_string('output_csv', '', 'Path of the CSV results')
+FLAGS = flags.FLAGS
+
+
+def session_config():
+    config = tf.ConfigProto()
+    if FLAGS.device == 'cpu':
+        config.device_count['GPU'] = 0
+    else:
+        config.gpu_options.allow_growth = True
+    return config
+
+
+def time_op(sess, op):
+    for _ in range(FLAGS.warmup_steps):
+        sess.run(op)
+    start = time.perf_counter()
+    for _ in range(FLAGS.steps):
+        sess.run(op)
+    return (time.perf_counter() - start) / FLAGS.steps * 1000
+
+
+def compare(name, x, separate_fn, fused_fn):
+    with tf.variable_scope(name):
+        separate = separate_fn(x)
+    # The fused op reuses the variables of the separate one
+    with tf.variable_scope(name, reuse=True):
+        fused = fused_fn(x)
+    return name, separate, fused
+
+
+def main(_):
+    size, channels = FLAGS.size, FLAGS.channels
+    rng = np.random.RandomState(0)
+    results = []
+    with tf.Graph().as_default(), tf.Session(config=session_config()) as sess:
+        low = tf.constant(rng.normal(size=(FLAGS.batch_size, size // 2, size // 2, channels)).astype(np.float32))
+        high = tf.constant(rng.normal(size=(FLAGS.batch_size, size, size, channels)).astype(np.float32))
+
+        ops = OrderedDict([
+            ('upscale_conv2d', compare('up', low,
+                                       lambda x: conv2d(upscale(x, 2), f=channels, ks=(3, 3), s=(1, 1)),
+                                       lambda x: upscale_conv2d(x, f=channels, ks=(3, 3)))),
+            ('conv2d_downscale', compare('down', high,
+                                         lambda x: pool(conv2d(x, f=channels, ks=(3, 3), s=(1, 1)), 2),
+                                         lambda x: conv2d_downscale(x, f=channels, ks=(3, 3)))),
+        ])
+        sess.run(tf.global_variables_initializer())
+
+        for name, (scope, separate, fused) in ops.items():
+            separate_out, fused_out = sess.run([separate, fused])
+            result = OrderedDict([
+                ('op', name),
+                ('size', size),
+                ('channels', channels),
+                ('batch_size', FLAGS.batch_size),
+                ('max_abs_diff', float(np.max(np.abs(separate_out - fused_out)))),
+                ('max_abs_output', float(np.max(np.abs(separate_out)))),
+            ])
+            for version, out in [('separate', separate), ('fused', fused)]:
+                grads = tf.gradients(tf.reduce_sum(tf.square(out)), tf.trainable_variables(scope))
+                result['%s_forward_ms' % version] = time_op(sess, out.op)
+                result['%s_backward_ms' % version] = time_op(sess, grads)
+            results.append(result)
+
+            print('%-16s max abs diff %.2e  forward %8.2f -> %8.2f ms  forward+backward %8.2f -> %8.2f ms' % (
+                name, result['max_abs_diff'], result['separate_forward_ms'], result['fused_forward_ms'],
+                result['separate_backward_ms'], result['fused_backward_ms']))
+
+    write_results(results, FLAGS.output_json, FLAGS.output_csv)
+
+
+if __name__ == '__main__':
+    tf.app.run()
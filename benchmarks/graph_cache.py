@@ -0,0 +1,92 @@
+"""
+Compares the time taken to build the PGGAN training graphs with the time taken to import them from the graph cache
+(see utils/graph_cache.py).
+
+Every stage is built in a fresh graph and exported to a temporary cache, then imported in another fresh graph in
+which one training step is run to check that the imported graph trains. Example:
+
+    python benchmarks/graph_cache.py --stages=4,6,8 --trans=True --output_json=./bench/graph_cache.json
+"""
+import shutil
+import tempfile
+import time
+import traceback
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from utils.benchmark import synthetic_text_dataset, write_results
+from utils.config import config_from_yaml
+
+flags = tf.app.flags
+flags.DEFINE_string('stages', '2,4,6,8', 'Comma separated list of the PGGAN stages to benchmark [2,4,6,8]')
+flags.DEFINE_boolean('trans', False, 'Benchmark the transition phase of the stages [False]')
+flags.DEFINE_string('dataset', 'flowers', 'The dataset whose config is used [flowers]')
+flags.DEFINE_integer('batch_size', 8, 'The batch size [8]')
+flags.DEFINE_integer('num_examples', 16, 'Number of synthetic examples [16]')
+flags.DEFINE_string('output_json', '', 'Path of the JSON results')
+flags.DEFINE_string('output_csv', '', 'Path of the CSV results')
+FLAGS = flags.FLAGS
+
+
+def build(stage, cfg, dataset, work_dir, cache_dir):
+    """Builds or imports the training graph of the stage in the default graph and returns it with the elapsed time"""
+    from models.pggan.pggan import PGGAN
+
+    start = time.perf_counter()
+    pggan = PGGAN(batch_size=FLAGS.batch_size, steps=10, check_dir_write=work_dir, check_dir_read=work_dir,
+                  dataset=dataset, sample_path=work_dir, log_dir=work_dir, stage=stage, trans=FLAGS.trans,
+                  fused_step=cfg.TRAIN.FUSED_STEP, mixed_precision=cfg.TRAIN.MIXED_PRECISION, async_checkpoint=False,
+                  xla=cfg.TRAIN.XLA, recompute=cfg.TRAIN.RECOMPUTE[stage - 1], graph_cache_dir=cache_dir)
+    return pggan, time.perf_counter() - start
+
+
+def benchmark(stage):
+    result = OrderedDict([('stage', stage), ('size', 4 * 2 ** (stage - 1)), ('trans', FLAGS.trans),
+                          ('batch_size', FLAGS.batch_size)])
+
+    cfg = config_from_yaml('./models/pggan/cfg/%s.yml' % FLAGS.dataset)
+    dataset = synthetic_text_dataset(cfg.MODEL.SIZES[stage - 1], FLAGS.num_examples, cfg.MODEL.EMBED_DIM)
+    work_dir = tempfile.mkdtemp(prefix='bench_graph_cache_%d_' % stage)
+    cache_dir = tempfile.mkdtemp(prefix='graph_cache_%d_' % stage)
+    try:
+        with tf.Graph().as_default():
+            _, result['build_s'] = build(stage, cfg, dataset, work_dir, '')
+        # Builds the graph again and exports it
+        with tf.Graph().as_default():
+            _, result['build_export_s'] = build(stage, cfg, dataset, work_dir, cache_dir)
+        with tf.Graph().as_default():
+            pggan, result['import_s'] = build(stage, cfg, dataset, work_dir, cache_dir)
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                sample_z = np.random.normal(0, 1, (pggan.sample_num, pggan.z_dim))
+                sample_cond = np.random.normal(0, 1, (pggan.sample_num, pggan.embed_dim))
+                step = pggan.DG_optim if pggan.fused_step else [pggan.D_optim, pggan.G_optim]
+                sess.run(step, feed_dict=pggan.get_feed_dict(1, sample_z, sample_cond))
+        result['speedup'] = result['build_s'] / result['import_s']
+    except Exception as e:
+        traceback.print_exc()
+        result['error'] = str(e)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return result
+
+
+def main(_):
+    results = []
+    for stage in [int(s) for s in FLAGS.stages.split(',') if s.strip()]:
+        result = benchmark(stage)
+        results.append(result)
+        if 'error' in result:
+            print('stage %d: failed, %s' % (stage, result['error']))
+        else:
+            print('stage %d: build %.2f s, build and export %.2f s, import %.2f s (%.1fx)' % (
+                stage, result['build_s'], result['build_export_s'], result['import_s'], result['speedup']))
+
+    write_results(results, FLAGS.output_json, FLAGS.output_csv)
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,109 @@
+"""
+Compares the image decoding and resizing backends of the preprocessing (see preprocess/image_backend.py).
+
+Every backend decodes and resizes the same images exactly like get_image does when the datasets are built. The
+decoding and resizing times are recorded and the resized images are compared pixel by pixel with the ones of the
+scipy backend, which is the reference bicubic implementation the existing datasets were built with. Example:
+
+    python benchmarks/image_backends.py --image_glob='./data/flowers/jpg/*.jpg' --output_json=./bench/images.json
+"""
+import glob
+import time
+import traceback
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from preprocess.image_backend import BACKENDS, get_backend
+from preprocess.utils import colorize
+from utils.benchmark import PhaseTimer, write_results
+
+flags = tf.app.flags
+flags.DEFINE_string('image_glob', './data/flowers/jpg/*.jpg', 'Glob pattern of the images to process')
+flags.DEFINE_integer('num_images', 200, 'Number of images to process [200]')
+flags.DEFINE_integer('size', 600, 'The size the images are resized to [600]')
+flags.DEFINE_string('backends', ','.join(BACKENDS), 'Comma separated list of the backends to compare [%s]'
+                    % ','.join(BACKENDS))
+flags.DEFINE_boolean('draft', True, 'Let the backends decode downscaled images when they support it [True]')
+flags.DEFINE_string('output_json', '', 'Path of the JSON results')
+flags.DEFINE_string('output_csv', '', 'Path of the CSV results')
+FLAGS = flags.FLAGS
+
+REFERENCE = 'scipy'
+
+
+def process(backend, paths, size, draft):
+    """Decodes and resizes the images like get_image and returns them with the timings of both phases"""
+    timer = PhaseTimer()
+    images = []
+    for path in paths:
+        with timer.phase('decode'):
+            img = backend.imread(path, size if draft else None)
+        with timer.phase('resize'):
+            img = backend.resize(colorize(img), size)
+        images.append(np.asarray(img, dtype=np.uint8))
+    return np.stack(images), timer
+
+
+def pixel_diff(images, reference):
+    diff = np.abs(images.astype(np.float32) - reference.astype(np.float32))
+    mse = np.mean(diff ** 2)
+    return OrderedDict([
+        ('mean_abs_pixel_diff', float(np.mean(diff))),
+        ('max_abs_pixel_diff', float(np.max(diff))),
+        ('p99_abs_pixel_diff', float(np.percentile(diff, 99))),
+        ('psnr', float('inf') if mse == 0 else float(10 * np.log10(255. ** 2 / mse))),
+    ])
+
+
+def main(_):
+    paths = sorted(glob.glob(FLAGS.image_glob))[:FLAGS.num_images]
+    if not paths:
+        raise RuntimeError('No images match %s' % FLAGS.image_glob)
+
+    names = [name.strip() for name in FLAGS.backends.split(',') if name.strip()]
+    if REFERENCE not in names:
+        names = [REFERENCE] + names
+
+    results = []
+    reference = None
+    for name in names:
+        result = OrderedDict([('backend', name), ('num_images', len(paths)), ('size', FLAGS.size)])
+        try:
+            backend = get_backend(name)
+            # The reference never decodes downscaled images, since the existing datasets were built without it
+            draft = FLAGS.draft and name != REFERENCE
+            start = time.perf_counter()
+            images, timer = process(backend, paths, FLAGS.size, draft)
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            print('%s failed: %s' % (name, e))
+            traceback.print_exc()
+            result['error'] = str(e)
+            results.append(result)
+            continue
+
+        result['draft'] = draft
+        result['images_per_sec'] = len(paths) / elapsed
+        if name == REFERENCE:
+            reference = images
+        elif reference is not None:
+            result.update(pixel_diff(images, reference))
+        else:
+            result['note'] = 'The %s reference is unavailable, the pixels are not compared' % REFERENCE
+        result['phases'] = timer.summary()
+        results.append(result)
+
+        print('%-8s %8.1f images/sec  decode %6.2f ms  resize %6.2f ms' % (
+            name, result['images_per_sec'], result['phases']['decode']['mean_ms'],
+            result['phases']['resize']['mean_ms']))
+        if 'psnr' in result:
+            print('         mean abs diff %.3f  max abs diff %.0f  PSNR %.2f dB' % (
+                result['mean_abs_pixel_diff'], result['max_abs_pixel_diff'], result['psnr']))
+
+    write_results(results, FLAGS.output_json, FLAGS.output_csv)
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,126 @@
+"""
+Measures the peak memory and the step time of the PGGAN training steps with and without the recomputation of the
+activations of the conv stages (see PGGAN.checkpointed).
+
+Every stage is built in a fresh graph on synthetic data, trained for a number of warmup steps followed by a number
+of timed D and G updates, and one more step is run with a full trace to record the peak memory of the allocators.
+On devices whose allocator keeps no statistics, the largest allocation of a single op is reported instead and the
+result is flagged with memory_exact = False. Example:
+
+    python benchmarks/pggan_recompute.py --stages=6,7,8 --batch_size=8 --device=gpu --output_json=./bench/remat.json
+"""
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from utils.benchmark import PhaseTimer, peak_memory_bytes, synthetic_text_dataset, write_results
+from utils.config import config_from_yaml
+
+flags = tf.app.flags
+flags.DEFINE_string('stages', '6,7,8', 'Comma separated list of the PGGAN stages to benchmark [6,7,8]')
+flags.DEFINE_boolean('trans', False, 'Benchmark the transition phase of the stages [False]')
+flags.DEFINE_string('dataset', 'flowers', 'The dataset whose config is used [flowers]')
+flags.DEFINE_string('device', 'cpu', 'The device to run on: cpu or gpu [cpu]')
+flags.DEFINE_integer('batch_size', 8, 'The batch size [8]')
+flags.DEFINE_integer('warmup_steps', 2, 'Number of steps which are not timed [2]')
+flags.DEFINE_integer('steps', 5, 'Number of timed steps [5]')
+flags.DEFINE_integer('num_examples', 16, 'Number of synthetic examples [16]')
+flags.DEFINE_string('output_json', '', 'Path of the JSON results')
+flags.DEFINE_string('output_csv', '', 'Path of the CSV results')
+FLAGS = flags.FLAGS
+
+
+def session_config():
+    config = tf.ConfigProto()
+    if FLAGS.device == 'cpu':
+        config.device_count['GPU'] = 0
+    else:
+        config.gpu_options.allow_growth = True
+    return config
+
+
+def benchmark(stage, recompute):
+    from models.pggan.pggan import PGGAN
+
+    result = OrderedDict([
+        ('stage', stage),
+        ('size', 4 * 2 ** (stage - 1)),
+        ('trans', FLAGS.trans),
+        ('recompute', recompute),
+        ('device', FLAGS.device),
+        ('batch_size', FLAGS.batch_size),
+    ])
+
+    cfg = config_from_yaml('./models/pggan/cfg/%s.yml' % FLAGS.dataset)
+    work_dir = tempfile.mkdtemp(prefix='bench_pggan_%d_' % stage)
+    timer = PhaseTimer()
+    try:
+        with tf.Graph().as_default(), tf.Session(config=session_config()) as sess:
+            dataset = synthetic_text_dataset(cfg.MODEL.SIZES[stage - 1], FLAGS.num_examples, cfg.MODEL.EMBED_DIM)
+            pggan = PGGAN(batch_size=FLAGS.batch_size, steps=FLAGS.warmup_steps + FLAGS.steps + 2,
+                          check_dir_write=work_dir, check_dir_read=work_dir, dataset=dataset, sample_path=work_dir,
+                          log_dir=work_dir, stage=stage, trans=FLAGS.trans,
+                          fused_step=cfg.TRAIN.FUSED_STEP, mixed_precision=cfg.TRAIN.MIXED_PRECISION,
+                          async_checkpoint=False, recompute=recompute)
+            sess.run(tf.global_variables_initializer())
+
+            sample_z = np.random.normal(0, 1, (pggan.sample_num, pggan.z_dim))
+            sample_cond = np.random.normal(0, 1, (pggan.sample_num, pggan.embed_dim))
+            step = pggan.DG_optim if pggan.fused_step else [pggan.D_optim, pggan.G_optim]
+
+            for idx in range(1, FLAGS.warmup_steps + 1):
+                sess.run(step, feed_dict=pggan.get_feed_dict(idx, sample_z, sample_cond))
+
+            start = time.perf_counter()
+            last = FLAGS.warmup_steps + FLAGS.steps
+            for idx in range(FLAGS.warmup_steps + 1, last + 1):
+                feed_dict = pggan.get_feed_dict(idx, sample_z, sample_cond)
+                with timer.phase('step'):
+                    sess.run(step, feed_dict=feed_dict)
+            elapsed = time.perf_counter() - start
+
+            run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+            run_metadata = tf.RunMetadata()
+            sess.run(step, feed_dict=pggan.get_feed_dict(last + 1, sample_z, sample_cond), options=run_options,
+                     run_metadata=run_metadata)
+            peak, exact = peak_memory_bytes(run_metadata)
+
+        result['steps_per_sec'] = FLAGS.steps / elapsed
+        result['step_ms'] = timer.summary()['step']['mean_ms']
+        result['peak_memory_mb'] = peak / 2 ** 20
+        result['memory_exact'] = exact
+    except Exception as e:
+        traceback.print_exc()
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return result
+
+
+def main(_):
+    results = []
+    for stage in [int(stage) for stage in FLAGS.stages.split(',') if stage.strip()]:
+        for recompute in [False, True]:
+            print('Benchmarking stage %d, recompute: %s...' % (stage, recompute))
+            result = benchmark(stage, recompute)
+            results.append(result)
+            if 'error' in result:
+                print('stage %d failed: %s' % (stage, result['error']))
+            else:
+                print('stage %d (%dpx) recompute %-5s %9.2f ms/step  peak memory %9.1f MB%s' % (
+                    stage, result['size'], recompute, result['step_ms'], result['peak_memory_mb'],
+                    '' if result['memory_exact'] else ' (largest op, lower bound)'))
+            sys.stdout.flush()
+
+    write_results(results, FLAGS.output_json, FLAGS.output_csv)
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,99 @@
+"""
+Measures the import time of the entry points and of the utility modules they share.
+
+Every module is imported in a fresh interpreter a number of times, and the median wall-clock time is reported
+after subtracting the median start-up time of an interpreter which imports nothing. The packages taking the longest
+to import are taken from the -X importtime report of Python. Example:
+
+    python benchmarks/startup.py --repeats=5 --output_json=./bench/startup.json
+"""
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from utils.benchmark import write_results
+
+ENTRY_POINTS = [
+    'models.gancls.run',
+    'models.wgancls.run',
+    'models.stackgan.stageI.run',
+    'models.stackgan.stageII.run',
+    'models.pggan.train_pggan',
+    'models.pggan.eval_pggan',
+    'models.pggan.visualize_pggan',
+    'evaluation.shards',
+    'utils.utils',
+    'utils.visualize',
+    'preprocess.dataset',
+]
+
+flags = tf.app.flags
+flags.DEFINE_string('modules', ','.join(ENTRY_POINTS), 'Comma separated list of the modules to import')
+flags.DEFINE_integer('repeats', 5, 'Number of times every module is imported [5]')
+flags.DEFINE_integer('top', 5, 'Number of the slowest packages reported per module [5]')
+flags.DEFINE_string('output_json', '', 'Path of the JSON results')
+flags.DEFINE_string('output_csv', '', 'Path of the CSV results')
+FLAGS = flags.FLAGS
+
+
+def run(code, importtime=False):
+    """Runs the code in a fresh interpreter and returns the elapsed seconds and the stderr"""
+    args = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    start = time.perf_counter()
+    proc = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else 'exit code %d' % proc.returncode)
+    return elapsed, proc.stderr
+
+
+def slowest_packages(importtime_report, top):
+    """Returns the top-level packages of an -X importtime report which take the longest to import, as (package,
+    ms) pairs. The time of a package is the sum of the self times of all its modules."""
+    totals = {}
+    for line in importtime_report.splitlines():
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue
+        package = name.strip().split('.')[0]
+        totals[package] = totals.get(package, 0.) + int(self_us) / 1000.
+    return sorted(totals.items(), key=lambda item: -item[1])[:top]
+
+
+def main(_):
+    baseline = float(np.median([run('pass')[0] for _ in range(FLAGS.repeats)]))
+    print('Interpreter start-up: %.3f s' % baseline)
+
+    results = []
+    for module in [name.strip() for name in FLAGS.modules.split(',') if name.strip()]:
+        result = OrderedDict([('module', module)])
+        try:
+            code = 'import %s' % module
+            times = [run(code)[0] for _ in range(FLAGS.repeats)]
+            _, report = run(code, importtime=True)
+        except RuntimeError as e:
+            print('%-32s failed: %s' % (module, e))
+            result['error'] = str(e)
+            results.append(result)
+            continue
+
+        result['import_s'] = float(np.median(times)) - baseline
+        result['min_import_s'] = min(times) - baseline
+        result['slowest_packages'] = OrderedDict(slowest_packages(report, FLAGS.top))
+        results.append(result)
+
+        print('%-32s %7.3f s  slowest: %s' % (module, result['import_s'], ', '.join(
+            '%s %.0f ms' % item for item in result['slowest_packages'].items())))
+
+    write_results(results, FLAGS.output_json, FLAGS.output_csv)
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,403 @@
+"""
+Measures the training throughput of the GAN models on synthetic data.
+
+Each model is built from its config in a fresh graph and trained for a number of warmup steps followed by a number
+of timed steps. The time of every phase of a step (data, D step, G step or fused DG step, summaries, checkpoint) is
+recorded and the results are written as JSON and/or CSV. Example:
+
+    python benchmarks/train_throughput.py --models=gancls,stagei,pggan --steps=20 --output_json=./bench/cpu.json
+
+With --xla, every model is benchmarked once per XLA JIT compilation mode (see jit_scope and set_xla_jit in
+utils/ops.py). The duration of the first step, which includes the compilation of the update subgraphs, is reported
+separately from the steady-state step time of the timed steps:
+
+    python benchmarks/train_throughput.py --models=wgancls,pggan --xla=off,scoped,global --output_json=./bench/xla.json
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from utils.benchmark import PhaseTimer, synthetic_text_dataset, write_results
+from utils.config import config_from_yaml
+from utils.ops import AUTO, NCHW, NHWC, XLA_GLOBAL, XLA_OFF, check_xla_mode, enable_cpu_global_jit, set_xla_jit
+from utils.saver import save, AsyncSaver
+
+flags = tf.app.flags
+flags.DEFINE_string('models', 'gancls,wgancls,stagei,stageii,pggan',
+                    'Comma separated list of the models to benchmark [gancls,wgancls,stagei,stageii,pggan]')
+flags.DEFINE_string('dataset', 'flowers', 'The dataset whose configs are used [flowers]')
+flags.DEFINE_string('device', 'cpu', 'The device to run on: cpu or gpu [cpu]')
+flags.DEFINE_integer('warmup_steps', 5, 'Number of steps which are not timed [5]')
+flags.DEFINE_integer('steps', 20, 'Number of timed steps [20]')
+flags.DEFINE_integer('batch_size', 0, 'Overrides the batch size of the configs if positive [0]')
+flags.DEFINE_integer('summary_period', 10, 'Number of steps between two summaries [10]')
+flags.DEFINE_integer('checkpoint_period', 0, 'Number of steps between two checkpoints. 0 checkpoints once at the '
+                                             'last timed step and a negative value disables checkpoints [0]')
+flags.DEFINE_integer('pggan_stage', 3, 'The PGGAN stage to benchmark [3]')
+flags.DEFINE_boolean('pggan_trans', False, 'Benchmark the PGGAN transition phase of the stage [False]')
+flags.DEFINE_integer('num_examples', 64, 'Number of synthetic examples [64]')
+flags.DEFINE_integer('intra_op_threads', 0, 'Number of intra op threads. 0 lets TensorFlow decide [0]')
+flags.DEFINE_integer('inter_op_threads', 0, 'Number of inter op threads. 0 lets TensorFlow decide [0]')
+flags.DEFINE_string('xla', '', 'Comma separated list of the XLA modes to compare (off, scoped, global). Empty uses the '
+                                'mode of the configs []')
+flags.DEFINE_string('output_json', '', 'Path of the JSON results')
+flags.DEFINE_string('output_csv', '', 'Path of the CSV results')
+FLAGS = flags.FLAGS
+
+CFG_PATHS = {
+    'gancls': './models/gancls/cfg/%s.yml',
+    'wgancls': './models/wgancls/cfg/%s.yml',
+    'stagei': './models/stackgan/stageI/cfg/%s.yml',
+    'stageii': './models/stackgan/stageII/cfg/%s.yml',
+    'pggan': './models/pggan/cfg/%s.yml',
+}
+
+
+def get_cfg(model_name, work_dir, xla=XLA_OFF):
+    cfg = config_from_yaml(CFG_PATHS[model_name] % FLAGS.dataset)
+    if FLAGS.batch_size > 0:
+        cfg.TRAIN.BATCH_SIZE = FLAGS.batch_size
+    cfg.TRAIN.XLA = xla
+    # The automatic data format follows the device of the benchmark rather than the GPUs of the machine
+    if cfg.MODEL.get('DATA_FORMAT') == AUTO:
+        cfg.MODEL.DATA_FORMAT = NCHW if FLAGS.device == 'gpu' else NHWC
+    cfg.CHECKPOINT_DIR = os.path.join(work_dir, 'checkpoints/')
+    cfg.LOGS_DIR = os.path.join(work_dir, 'logs/')
+    cfg.SAMPLE_DIR = os.path.join(work_dir, 'samples/')
+    return cfg
+
+
+def get_xla_mode(model_name, xla):
+    """The XLA mode to benchmark. The models whose config has no XLA switch run with XLA off unless the mode is
+    given explicitly, in which case only the global mode affects them."""
+    if not xla:
+        cfg = config_from_yaml(CFG_PATHS[model_name] % FLAGS.dataset)
+        xla = cfg.TRAIN.get('XLA', XLA_OFF)
+    check_xla_mode(xla)
+    return xla
+
+
+def session_config(xla=XLA_OFF):
+    config = tf.ConfigProto(intra_op_parallelism_threads=FLAGS.intra_op_threads,
+                            inter_op_parallelism_threads=FLAGS.inter_op_threads)
+    if FLAGS.device == 'cpu':
+        config.device_count['GPU'] = 0
+    else:
+        config.gpu_options.allow_growth = True
+    return set_xla_jit(config, xla)
+
+
+def build_gancls(sess, work_dir, xla):
+    from models.gancls.model import GanCls
+    from models.gancls.trainer import GanClsTrainer
+
+    cfg = get_cfg('gancls', work_dir, xla)
+    dataset = synthetic_text_dataset(cfg.MODEL.OUTPUT_SIZE, FLAGS.num_examples, cfg.MODEL.EMBED_DIM)
+    model = GanCls(cfg)
+    trainer = GanClsTrainer(sess=sess, model=model, dataset=dataset, cfg=cfg)
+    trainer.define_losses()
+    trainer.define_summaries()
+
+    def next_feed(idx):
+        images, wrong_images, embed, _, _ = dataset.train.next_batch(model.batch_size, 4, embeddings=True,
+                                                                     wrong_img=True)
+        batch_z = np.random.normal(0, 1, [model.batch_size, model.z_dim]).astype(np.float32)
+        return {
+            model.inputs: images,
+            model.wrong_inputs: wrong_images,
+            model.phi_inputs: embed,
+            model.z: batch_z,
+        }
+
+    return {
+        'cfg': cfg,
+        'batch_size': model.batch_size,
+        'next_feed': next_feed,
+        'd_step': trainer.D_optim,
+        'g_step': trainer.G_optim,
+        'dg_step': None,
+        'n_critic': 1,
+        'summaries': [trainer.D_merged_summ, trainer.G_merged_summ],
+        'writer': trainer.writer,
+        'saver': trainer.checkpoint_saver,
+    }
+
+
+def build_wgancls(sess, work_dir, xla):
+    from models.wgancls.model import WGanCls
+    from models.wgancls.trainer import WGanClsTrainer
+
+    cfg = get_cfg('wgancls', work_dir, xla)
+    dataset = synthetic_text_dataset(cfg.MODEL.OUTPUT_SIZE, FLAGS.num_examples, cfg.MODEL.EMBED_DIM)
+    model = WGanCls(cfg)
+    trainer = WGanClsTrainer(sess=sess, model=model, dataset=dataset, cfg=cfg)
+    trainer.define_summaries()
+
+    sample_z = np.random.normal(0, 1, (model.sample_num, model.z_dim))
+    sample_cond = np.random.normal(0, 1, (model.sample_num, model.embed_dim))
+
+    def next_feed(idx):
+        images, wrong_images, embed, _, _ = dataset.train.next_batch(model.batch_size, 4, embeddings=True,
+                                                                     wrong_img=True)
+        batch_z = np.random.normal(0, 1, (model.batch_size, model.z_dim))
+        eps = np.random.uniform(0., 1., size=(model.batch_size, 1, 1, 1))
+        return {
+            model.learning_rate_d: cfg.TRAIN.D_LR,
+            model.learning_rate_g: cfg.TRAIN.G_LR,
+            model.x: images,
+            model.x_mismatch: wrong_images,
+            model.cond: embed,
+            model.z: batch_z,
+            model.epsilon: eps,
+            model.z_sample: sample_z,
+            model.cond_sample: sample_cond,
+            model.iter: idx,
+        }
+
+    saver = tf.train.Saver(max_to_keep=cfg.TRAIN.CHECKPOINTS_TO_KEEP)
+    if cfg.TRAIN.ASYNC_CHECKPOINT:
+        saver = AsyncSaver(max_to_keep=cfg.TRAIN.CHECKPOINTS_TO_KEEP)
+
+    return {
+        'cfg': cfg,
+        'batch_size': model.batch_size,
+        'next_feed': next_feed,
+        'd_step': [model.D_optim, model.kt_optim],
+        'g_step': model.G_optim,
+        'dg_step': [model.DG_optim, model.kt_optim] if cfg.TRAIN.FUSED_STEP else None,
+        'n_critic': cfg.TRAIN.N_CRITIC,
+        'summaries': [trainer.summary_op],
+        'writer': trainer.writer,
+        'saver': saver,
+    }
+
+
+def build_stackgan(sess, work_dir, xla, stage):
+    from models.stackgan.stageI.model import ConditionalGan as ConditionalGanStageI
+
+    if stage == 1:
+        from models.stackgan.stageI.trainer import ConditionalGanTrainer
+
+        cfg = get_cfg('stagei', work_dir, xla)
+        model = ConditionalGanStageI(cfg)
+        dataset = synthetic_text_dataset(cfg.MODEL.OUTPUT_SIZE, FLAGS.num_examples, cfg.MODEL.EMBED_DIM)
+        trainer = ConditionalGanTrainer(sess=sess, model=model, dataset=dataset, cfg=cfg)
+    else:
+        from models.stackgan.stageII.model import ConditionalGan
+        from models.stackgan.stageII.trainer import ConditionalGanTrainer
+
+        cfg_stage_i = get_cfg('stagei', work_dir, xla)
+        cfg = get_cfg('stageii', work_dir, xla)
+        stage_i = ConditionalGanStageI(cfg_stage_i, build_model=False)
+        model = ConditionalGan(stage_i, cfg)
+        dataset = synthetic_text_dataset(cfg.MODEL.OUTPUT_SIZE, FLAGS.num_examples, cfg.MODEL.EMBED_DIM)
+        trainer = ConditionalGanTrainer(sess=sess, model=model, dataset=dataset, cfg=cfg, cfg_stage_i=cfg_stage_i)
+
+    trainer.define_losses()
+    trainer.define_summaries()
+
+    def next_feed(idx):
+        images, wrong_images, embed, _, _ = dataset.train.next_batch(model.batch_size, 4, embeddings=True,
+                                                                     wrong_img=True)
+        batch_z = np.random.normal(0, 1, (model.batch_size, model.z_dim))
+        return {
+            trainer.learning_rate: trainer.lr,
+            model.inputs: images,
+            model.wrong_inputs: wrong_images,
+            model.embed_inputs: embed,
+            model.z: batch_z,
+        }
+
+    return {
+        'cfg': cfg,
+        'batch_size': model.batch_size,
+        'next_feed': next_feed,
+        'd_step': trainer.D_optim,
+        'g_step': trainer.G_optim,
+        'dg_step': trainer.DG_optim if cfg.TRAIN.FUSED_STEP else None,
+        'n_critic': 1,
+        'summaries': [trainer.D_merged_summ, trainer.G_merged_summ],
+        'writer': trainer.writer,
+        'saver': trainer.checkpoint_saver,
+    }
+
+
+def build_pggan(sess, work_dir, xla):
+    from models.pggan.pggan import PGGAN
+
+    cfg = get_cfg('pggan', work_dir, xla)
+    stage = FLAGS.pggan_stage
+    batch_size = FLAGS.batch_size if FLAGS.batch_size > 0 else 16
+    dataset = synthetic_text_dataset(cfg.MODEL.SIZES[stage - 1], FLAGS.num_examples, cfg.MODEL.EMBED_DIM)
+
+    pggan = PGGAN(batch_size=batch_size, steps=FLAGS.warmup_steps + FLAGS.steps + 1,
+                  check_dir_write=cfg.CHECKPOINT_DIR, check_dir_read=cfg.CHECKPOINT_DIR,
+                  dataset=dataset, sample_path=cfg.SAMPLE_DIR, log_dir=cfg.LOGS_DIR, stage=stage,
+                  trans=FLAGS.pggan_trans, fused_step=cfg.TRAIN.FUSED_STEP, mixed_precision=cfg.TRAIN.MIXED_PRECISION,
+                  async_checkpoint=cfg.TRAIN.ASYNC_CHECKPOINT, xla=cfg.TRAIN.XLA)
+
+    sample_z = np.random.normal(0, 1, (pggan.sample_num, pggan.z_dim))
+    sample_cond = np.random.normal(0, 1, (pggan.sample_num, pggan.embed_dim))
+
+    return {
+        'cfg': cfg,
+        'batch_size': batch_size,
+        'next_feed': lambda idx: pggan.get_feed_dict(idx, sample_z, sample_cond),
+        'd_step': pggan.D_optim,
+        'g_step': pggan.G_optim,
+        'dg_step': pggan.DG_optim if pggan.fused_step else None,
+        'n_critic': 1,
+        'summaries': [pggan.summary_op],
+        'writer': tf.summary.FileWriter(cfg.LOGS_DIR),
+        'saver': pggan.checkpoint_saver,
+    }
+
+
+BUILDERS = OrderedDict([
+    ('gancls', build_gancls),
+    ('wgancls', build_wgancls),
+    ('stagei', lambda sess, work_dir, xla: build_stackgan(sess, work_dir, xla, stage=1)),
+    ('stageii', lambda sess, work_dir, xla: build_stackgan(sess, work_dir, xla, stage=2)),
+    ('pggan', build_pggan),
+])
+
+
+def run_step(sess, spec, idx, timer: PhaseTimer, checkpoint):
+    with timer.phase('data'):
+        feed_dict = spec['next_feed'](idx)
+
+    if spec['dg_step'] is not None and idx % spec['n_critic'] == 0:
+        with timer.phase('dg_step'):
+            sess.run(spec['dg_step'], feed_dict=feed_dict)
+    else:
+        with timer.phase('d_step'):
+            sess.run(spec['d_step'], feed_dict=feed_dict)
+        if idx % spec['n_critic'] == 0:
+            with timer.phase('g_step'):
+                sess.run(spec['g_step'], feed_dict=feed_dict)
+
+    if FLAGS.summary_period > 0 and idx % FLAGS.summary_period == 0:
+        with timer.phase('summaries'):
+            for summary_str in sess.run(spec['summaries'], feed_dict=feed_dict):
+                spec['writer'].add_summary(summary_str, idx)
+
+    if checkpoint:
+        with timer.phase('checkpoint'):
+            save(spec['saver'], sess, spec['cfg'].CHECKPOINT_DIR, idx)
+
+
+def benchmark(model_name, xla=XLA_OFF):
+    result = OrderedDict([
+        ('model', model_name),
+        ('dataset', FLAGS.dataset),
+        ('device', FLAGS.device),
+        ('xla', xla),
+        ('warmup_steps', FLAGS.warmup_steps),
+        ('steps', FLAGS.steps),
+    ])
+
+    work_dir = tempfile.mkdtemp(prefix='bench_%s_' % model_name)
+    timer = PhaseTimer()
+    try:
+        with tf.Graph().as_default(), tf.Session(config=session_config(xla)) as sess:
+            start = time.perf_counter()
+            spec = BUILDERS[model_name](sess, work_dir, xla)
+            sess.run(tf.global_variables_initializer())
+            result['build_s'] = time.perf_counter() - start
+            result['batch_size'] = spec['batch_size']
+            result['mixed_precision'] = bool(spec['cfg'].TRAIN.MIXED_PRECISION)
+            result['fused_step'] = spec['dg_step'] is not None
+
+            # The first step includes the XLA compilation of the update subgraphs
+            start = time.perf_counter()
+            for idx in range(1, FLAGS.warmup_steps + 1):
+                run_step(sess, spec, idx, timer, checkpoint=False)
+                if idx == 1:
+                    result['first_step_s'] = time.perf_counter() - start
+            result['warmup_s'] = time.perf_counter() - start
+            timer.reset()
+
+            start = time.perf_counter()
+            last = FLAGS.warmup_steps + FLAGS.steps
+            for idx in range(FLAGS.warmup_steps + 1, last + 1):
+                if FLAGS.checkpoint_period > 0:
+                    checkpoint = (idx - FLAGS.warmup_steps) % FLAGS.checkpoint_period == 0
+                else:
+                    checkpoint = FLAGS.checkpoint_period == 0 and idx == last
+                run_step(sess, spec, idx, timer, checkpoint)
+            elapsed = time.perf_counter() - start
+
+            # The time needed to finish the background writes is not part of the step time
+            if isinstance(spec['saver'], AsyncSaver):
+                with timer.phase('checkpoint_flush'):
+                    spec['saver'].close()
+            spec['writer'].close()
+
+        result['elapsed_s'] = elapsed
+        result['steps_per_sec'] = FLAGS.steps / elapsed
+        result['images_per_sec'] = FLAGS.steps * result['batch_size'] / elapsed
+        result['phases'] = timer.summary()
+    except Exception as e:
+        traceback.print_exc()
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return result
+
+
+def print_xla_comparison(results):
+    """Prints the compilation and the steady-state step time of every XLA mode relative to XLA off"""
+    baselines = {r['model']: r for r in results if r['xla'] == XLA_OFF and 'error' not in r}
+    print('\n%-8s %-7s %14s %12s %10s' % ('model', 'xla', 'first step (s)', 'steps/sec', 'speedup'))
+    for result in results:
+        if 'error' in result:
+            continue
+        baseline = baselines.get(result['model'])
+        speedup = '%9.2fx' % (result['steps_per_sec'] / baseline['steps_per_sec']) if baseline else '%10s' % '-'
+        print('%-8s %-7s %14.2f %12.3f %s' % (result['model'], result['xla'], result.get('first_step_s', float('nan')),
+                                              result['steps_per_sec'], speedup))
+
+
+def main(_):
+    xla_modes = [mode.strip() for mode in FLAGS.xla.split(',') if mode.strip()] or ['']
+    # On CPU, the global JIT only clusters the ops when this flag is set before the first session is created
+    if XLA_GLOBAL in xla_modes and FLAGS.device == 'cpu':
+        enable_cpu_global_jit()
+
+    results = []
+    for model_name in FLAGS.models.split(','):
+        model_name = model_name.strip()
+        if model_name not in BUILDERS:
+            raise ValueError('Unknown model %s. Choose from %s' % (model_name, ', '.join(BUILDERS)))
+
+        for xla in xla_modes:
+            xla = get_xla_mode(model_name, xla)
+            print('Benchmarking %s (XLA %s)...' % (model_name, xla))
+            result = benchmark(model_name, xla)
+            results.append(result)
+            if 'error' in result:
+                print('%s failed: %s' % (model_name, result['error']))
+            else:
+                print('%s: %.3f steps/sec, %.2f images/sec' % (model_name, result['steps_per_sec'],
+                                                             result['images_per_sec']))
+                if 'first_step_s' in result:
+                    print('    %-16s %9.2f s' % ('first step', result['first_step_s']))
+                for name, stats in result['phases'].items():
+                    print('    %-16s mean: %9.2f ms  p90: %9.2f ms' % (name, stats['mean_ms'], stats['p90_ms']))
+            sys.stdout.flush()
+
+    if len(xla_modes) > 1:
+        print_xla_comparison(results)
+    write_results(results, FLAGS.output_json, FLAGS.output_csv)
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,185 @@
+"""
+Times the stages of the FID/IS/IMD evaluation pipeline on synthetic data.
+
+The generator and the Inception network are randomly initialised, so no checkpoint or dataset is required. For each
+batch size the following stages are timed separately:
+    generation: Running the generator of the model on random noise and embeddings
+    denormalize: Converting the generated images from [-1, 1] to [0, 255] with denormalize_images
+    prep_incep_img: Resizing the images to the Inception input with prep_incep_img
+    inception: The forward pass of Inception up to the pool_3 activations
+The matrix square root of calculate_frechet_distance is timed once. The images/sec of every stage and the peak RSS
+of the process after every stage are reported and written as JSON and/or CSV. Example:
+
+    python evaluation/benchmark.py --model=gancls --batch_sizes=16,64 --output_json=./bench/eval.json
+"""
+import resource
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from evaluation import fid, shards
+from models.inception.model import inception_net
+from utils.benchmark import write_results
+from utils.config import config_from_yaml
+from utils.ops import AUTO, NCHW, NHWC
+from utils.utils import denormalize_images, prep_incep_img
+
+flags = tf.app.flags
+flags.DEFINE_string('model', 'gancls', 'The generator to benchmark: gancls, wgancls, stagei or stageii [gancls]')
+flags.DEFINE_string('dataset', 'flowers', 'The dataset whose configs are used [flowers]')
+flags.DEFINE_string('batch_sizes', '16,32,64', 'Comma separated list of batch sizes [16,32,64]')
+flags.DEFINE_integer('num_batches', 4, 'Number of timed batches per stage and batch size [4]')
+flags.DEFINE_integer('warmup_batches', 1, 'Number of batches run before timing a stage [1]')
+flags.DEFINE_integer('act_dim', 2048, 'Dimension of the activations used to time sqrtm [2048]')
+flags.DEFINE_string('device', 'cpu', 'The device to run on: cpu or gpu [cpu]')
+flags.DEFINE_string('output_json', '', 'Path of the JSON results')
+flags.DEFINE_string('output_csv', '', 'Path of the CSV results')
+FLAGS = flags.FLAGS
+
+CFG_PATHS = {
+    'gancls': './models/gancls/cfg/%s.yml',
+    'wgancls': './models/wgancls/cfg/%s.yml',
+    'stagei': './models/stackgan/stageI/cfg/%s.yml',
+    'stageii': './models/stackgan/stageII/cfg/%s.yml',
+}
+
+
+def peak_rss_mb():
+    """The peak resident set size of the process in MB"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def session_config():
+    config = tf.ConfigProto()
+    if FLAGS.device == 'cpu':
+        config.device_count['GPU'] = 0
+    else:
+        config.gpu_options.allow_growth = True
+    return config
+
+
+def get_cfg(model_name):
+    cfg = config_from_yaml(CFG_PATHS[model_name] % FLAGS.dataset)
+    # The automatic data format follows the device of the benchmark rather than the GPUs of the machine
+    if cfg.MODEL.get('DATA_FORMAT') == AUTO:
+        cfg.MODEL.DATA_FORMAT = NCHW if FLAGS.device == 'gpu' else NHWC
+    return cfg
+
+
+def build_generator(batch_size):
+    cfg = get_cfg(FLAGS.model)
+    cfg_stage_i = get_cfg('stagei') if FLAGS.model == 'stageii' else None
+    z, cond, gen, _, _ = shards.build_generator(FLAGS.model, cfg, batch_size, cfg_stage_i)
+    return z, cond, gen
+
+
+def time_stage(fn, batches):
+    """Runs fn on the warmup batches and then times it on the remaining ones. Returns the outputs and the time."""
+    for batch in batches[:FLAGS.warmup_batches]:
+        fn(batch)
+
+    outputs = []
+    start = time.perf_counter()
+    for batch in batches[FLAGS.warmup_batches:]:
+        outputs.append(fn(batch))
+    return outputs, time.perf_counter() - start
+
+
+def stage_result(stage, batch_size, num_images, elapsed):
+    return OrderedDict([
+        ('stage', stage),
+        ('model', FLAGS.model),
+        ('device', FLAGS.device),
+        ('batch_size', batch_size),
+        ('num_images', num_images),
+        ('elapsed_s', elapsed),
+        ('images_per_sec', num_images / elapsed if elapsed > 0 else float('inf')),
+        ('peak_rss_mb', peak_rss_mb()),
+    ])
+
+
+def benchmark_batch_size(batch_size):
+    results = []
+    n_batches = FLAGS.warmup_batches + FLAGS.num_batches
+    num_images = FLAGS.num_batches * batch_size
+
+    with tf.Graph().as_default(), tf.Session(config=session_config()) as sess:
+        z, cond, gen = build_generator(batch_size)
+        sess.run(tf.global_variables_initializer())
+
+        z_dim, embed_dim = z.get_shape().as_list()[1], cond.get_shape().as_list()[1]
+        noise = [(np.random.normal(0, 1, size=(batch_size, z_dim)),
+                  np.random.normal(0, 1, size=(batch_size, embed_dim))) for _ in range(n_batches)]
+        generated, elapsed = time_stage(lambda batch: sess.run(gen, feed_dict={z: batch[0], cond: batch[1]}),
+                                        noise)
+        results.append(stage_result('generation', batch_size, num_images, elapsed))
+
+    # The warmup batches are reused so every stage sees the same number of batches
+    generated = generated[:FLAGS.warmup_batches] + generated
+    samples, elapsed = time_stage(denormalize_images, generated)
+    results.append(stage_result('denormalize', batch_size, num_images, elapsed))
+
+    # The evaluators store the denormalized samples in a float array before resizing them
+    samples = [batch.astype(np.float64) for batch in samples[:FLAGS.warmup_batches] + samples]
+    incep_inputs, elapsed = time_stage(lambda batch: np.array([prep_incep_img(img) for img in batch]), samples)
+    results.append(stage_result('prep_incep_img', batch_size, num_images, elapsed))
+
+    with tf.Graph().as_default(), tf.Session(config=session_config()) as sess:
+        inputs = tf.placeholder(tf.float32, [batch_size, 299, 299, 3], name='inputs')
+        _, layers = inception_net(inputs, num_classes=20)
+        act_op = tf.reshape(layers['PreLogits'], shape=[batch_size, -1])
+        sess.run(tf.global_variables_initializer())
+
+        incep_inputs = incep_inputs[:FLAGS.warmup_batches] + incep_inputs
+        _, elapsed = time_stage(lambda batch: sess.run(act_op, feed_dict={inputs: batch}), incep_inputs)
+        results.append(stage_result('inception', batch_size, num_images, elapsed))
+
+    return results
+
+
+def benchmark_sqrtm():
+    """Times the Frechet distance between the statistics of random activations"""
+    acts1 = np.random.normal(0, 1, size=(2 * FLAGS.act_dim, FLAGS.act_dim))
+    acts2 = np.random.normal(0.1, 1, size=(2 * FLAGS.act_dim, FLAGS.act_dim))
+    mu1, sigma1 = np.mean(acts1, axis=0), np.cov(acts1, rowvar=False)
+    mu2, sigma2 = np.mean(acts2, axis=0), np.cov(acts2, rowvar=False)
+
+    start = time.perf_counter()
+    fid.calculate_frechet_distance(mu1, sigma1, mu2, sigma2)
+    elapsed = time.perf_counter() - start
+
+    result = stage_result('sqrtm', 0, 0, elapsed)
+    result['act_dim'] = FLAGS.act_dim
+    del result['images_per_sec']
+    return result
+
+
+def main(_):
+    results = []
+    for batch_size in [int(bs) for bs in FLAGS.batch_sizes.split(',')]:
+        print('Benchmarking the evaluation stages with batch size %d...' % batch_size)
+        results += benchmark_batch_size(batch_size)
+        sys.stdout.flush()
+
+    print('Benchmarking sqrtm...')
+    results.append(benchmark_sqrtm())
+
+    for result in results:
+        if 'images_per_sec' in result:
+            print('%-16s bs: %4d  %10.2f images/sec  peak RSS: %8.1f MB' % (result['stage'], result['batch_size'],
+                                                                            result['images_per_sec'],
+                                                                            result['peak_rss_mb']))
+        else:
+            print('%-16s dim: %d  %10.2f s  peak RSS: %8.1f MB' % (result['stage'], result['act_dim'],
+                                                                   result['elapsed_s'], result['peak_rss_mb']))
+
+    write_results(results, FLAGS.output_json, FLAGS.output_csv)
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -62,6 +62,7 @@ def get_activations(images, sess, batch_size, act_op, verbose=False):
     -- sess        : current session
     -- batch_size  : the x numpy array is split into batches with batch size
                      batch_size. A reasonable batch size depends on the disposable hardware.
+                     The last batch holds the remaining images, so act_op must accept any batch size.
     -- verbose    : If set to True and parameter out_step is given, the number of calculated
                      batches is reported.
     Returns:
@@ -74,18 +75,14 @@ def get_activations(images, sess, batch_size, act_op, verbose=False):
     assert (np.min(images[0]) >= 0.0)
 
     d0 = len(images)
-    if batch_size > d0:
-        msg = "batch size is bigger than the data size"
-        raise RuntimeError(msg)
-
-    n_batches = d0 // batch_size
-    n_used_imgs = n_batches * batch_size
-    pred_arr = np.empty((n_used_imgs, 2048))
+    n_batches = int(np.ceil(d0 / batch_size))
+    pred_arr = np.empty((d0, 2048))
     for i in range(n_batches):
         if verbose:
             print("\rPropagating batch %d/%d" % (i + 1, n_batches), end="", flush=True)
+        # act_op accepts any batch size, so the last batch holds the remaining images
         start = i * batch_size
-        end = start + batch_size
+        end = min(start + batch_size, d0)
         batch = []
         for j in range(start, end):
             batch.append(prep_incep_img(images[j]))
@@ -217,9 +214,9 @@ def calculate_fid_given_paths():
         raise RuntimeError("Invalid path %s" % gen_img_path)
 
     with tf.Session() as sess:
-        _, layers = load_inception_inference(sess, FLAGS.num_classes, FLAGS.batch_size, FLAGS.checkpoint_dir)
+        _, layers = load_inception_inference(sess, FLAGS.num_classes, None, FLAGS.checkpoint_dir)
         pool3 = layers['PreLogits']
-        act_op = tf.reshape(pool3, shape=[FLAGS.batch_size, -1])
+        act_op = tf.reshape(pool3, shape=[-1, 2048])
 
         m1, s1 = _handle_path(real_img_path, sess, act_op)
         m2, s2 = _handle_path(gen_img_path, sess, act_op)
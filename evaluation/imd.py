@@ -31,7 +31,7 @@ def get_cosine_dist(real_img_act, gen_img_act):
     print(real_img_act.shape)
 
     cos_dist = []
-    for idx in range(FLAGS.batch_size):
+    for idx in range(len(gen_img_act)):
         dist = spatial.distance.cosine(gen_img_act[idx], real_img_act[idx])
         cos_dist.append(dist)
 
@@ -49,18 +49,14 @@ def compute_imd(sess, real_img, gen_img, act_op, verbose=False):
 
     batch_size = FLAGS.batch_size
     d0 = len(real_img)
-    if batch_size > d0:
-        msg = "batch size is bigger than the data size"
-        raise RuntimeError(msg)
-
-    n_batches = d0 // batch_size
-    n_used_imgs = n_batches * batch_size
-    distances = np.empty(n_used_imgs)
+    n_batches = int(np.ceil(d0 / batch_size))
+    distances = np.empty(d0)
     for i in range(n_batches):
         if verbose:
             print("\rComputing batch %d/%d" % (i + 1, n_batches), end="", flush=True)
+        # act_op accepts any batch size, so the last batch holds the remaining images
         start = i * batch_size
-        end = start + batch_size
+        end = min(start + batch_size, d0)
         r_img_batch = []
         g_img_batch = []
         for j in range(start, end):
@@ -84,10 +80,10 @@ def main(unused_argv=None):
         config.gpu_options.allow_growth = True
         with tf.Session(config=config) as sess:
             with tf.device("/gpu:%d" % FLAGS.gpu):
-                _, layers = load_inception_inference(sess, FLAGS.num_classes, FLAGS.batch_size, FLAGS.checkpoint_dir)
+                _, layers = load_inception_inference(sess, FLAGS.num_classes, None, FLAGS.checkpoint_dir)
 
                 pool3 = layers['PreLogits']
-                act_op = tf.reshape(pool3, shape=[FLAGS.batch_size, -1])
+                act_op = tf.reshape(pool3, shape=[-1, 2048])
 
                 real_images = load_inception_data(FLAGS.real_img_folder, alphabetic=True)
                 gen_images = load_inception_data(FLAGS.gen_img_folder, alphabetic=True)
@@ -44,7 +44,8 @@ def get_inception_score(images, sess, batch_size, splits, pred_op, verbose=False
 
     preds = []
     num_examples = len(images)
-    n_batches = int(math.floor(float(num_examples) / float(batch_size)))
+    # pred_op accepts any batch size, so the last batch holds the remaining images
+    n_batches = int(math.ceil(float(num_examples) / float(batch_size)))
     indices = list(np.arange(num_examples))
     np.random.shuffle(indices)
     for i in range(n_batches):
@@ -38,7 +38,7 @@ def main(_):
         config.gpu_options.allow_growth = True
         with tf.Session(config=config) as sess:
             with tf.device("/gpu:%d" % FLAGS.gpu):
-                logits, _ = load_inception_inference(sess, FLAGS.num_classes, FLAGS.batch_size, FLAGS.checkpoint_dir)
+                logits, _ = load_inception_inference(sess, FLAGS.num_classes, None, FLAGS.checkpoint_dir)
                 pred_op = tf.nn.softmax(logits)
 
                 images = load_inception_data(FLAGS.img_folder)
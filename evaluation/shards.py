@@ -0,0 +1,305 @@
+"""
+Sharded, resumable generation of the samples used by the FID and Inception Score evaluations.
+
+The generated images are written as uint8 .npy shards of a fixed size together with a manifest recording the seed,
+the checkpoint step of the generator and, for every shard, the test examples and embeddings the images were
+conditioned on. Every image is a deterministic function of the seed and its index (see utils.sampling), so the
+result does not depend on how the job is split. A shard is only marked as complete once all its files have been
+written, so a restarted job skips the completed shards and regenerates the others. Several workers can share the
+job by taking disjoint shards:
+
+    python evaluation/shards.py --model=wgancls --cfg=./models/wgancls/cfg/flowers.yml --worker=0 --num_workers=2
+    python evaluation/shards.py --model=wgancls --cfg=./models/wgancls/cfg/flowers.yml --worker=1 --num_workers=2
+
+The evaluators read the shards from cfg.EVAL.SHARD_DIR with ShardedImages instead of generating the samples.
+"""
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from utils.sampling import Sampler, COND_NOISE_STREAM, STAGEII_COND_NOISE_STREAM, SAMPLER_VERSION
+from utils.saver import load
+from utils.utils import denormalize_images
+
+MANIFEST = 'manifest.json'
+
+
+def cond_noise_placeholder(z, dim, name):
+    """Conditioning augmentation noise, with the batch size of z, which is sampled in the graph unless it is fed"""
+    noise = tf.truncated_normal(tf.stack([tf.shape(z)[0], dim]))
+    return tf.placeholder_with_default(noise, [z.get_shape().as_list()[0], dim], name=name)
+
+
+def build_generator(model_name, cfg, batch_size, cfg_stage_i=None):
+    """
+    Builds the generator of a model for inference. With a batch_size of None the generator accepts batches of any
+    size, so a single graph serves every batch size and the last, partial batch.
+
+    Returns:
+        z, cond: The noise and embedding placeholders
+        gen: The generated images in [-1, 1]
+        checkpoints: A list of (saver, checkpoint directory) pairs restoring the generator
+        cond_noise: A list of (placeholder, stream) pairs of the conditioning augmentation noise of the generator
+    """
+    if model_name == 'stageii':
+        from models.stackgan.stageI.model import ConditionalGan as ConditionalGanStageI
+        from models.stackgan.stageII.model import ConditionalGan
+
+        stage_i = ConditionalGanStageI(cfg_stage_i, build_model=False)
+        model = ConditionalGan(stage_i, cfg, build_model=False)
+
+        # Stage II refines the images generated by stage I
+        z = tf.placeholder(tf.float32, [batch_size, stage_i.z_dim], name='z')
+        cond = tf.placeholder(tf.float32, [batch_size, stage_i.embed_dim], name='cond')
+        eps_i = cond_noise_placeholder(z, stage_i.compressed_embed_dim, 'cond_epsilon')
+        eps_ii = cond_noise_placeholder(z, model.compressed_embed_dim, 'stageII_cond_epsilon')
+        stagei_gen, _, _ = stage_i.generator(z, cond, is_training=False, cond_epsilon=eps_i)
+        gen, _, _ = model.generator(stagei_gen, cond, is_training=False, cond_epsilon=eps_ii)
+        checkpoints = [(tf.train.Saver(tf.global_variables('g_net')), cfg_stage_i.CHECKPOINT_DIR),
+                       (tf.train.Saver(tf.global_variables('stageII_g_net')), cfg.CHECKPOINT_DIR)]
+        return z, cond, gen, checkpoints, [(eps_i, COND_NOISE_STREAM), (eps_ii, STAGEII_COND_NOISE_STREAM)]
+
+    if model_name == 'gancls':
+        from models.gancls.model import GanCls
+        model = GanCls(cfg, build_model=False)
+    elif model_name == 'wgancls':
+        from models.wgancls.model import WGanCls
+        model = WGanCls(cfg, build_model=False)
+    elif model_name == 'stagei':
+        from models.stackgan.stageI.model import ConditionalGan
+        model = ConditionalGan(cfg, build_model=False)
+    else:
+        raise ValueError('Unknown model %s' % model_name)
+
+    z = tf.placeholder(tf.float32, [batch_size, model.z_dim], name='z')
+    cond = tf.placeholder(tf.float32, [batch_size, model.embed_dim], name='cond')
+    if model_name == 'gancls':
+        # GAN-CLS has no conditioning augmentation
+        gen = model.generator(z, cond, is_training=False)
+        cond_noise = []
+    else:
+        eps = cond_noise_placeholder(z, model.compressed_embed_dim, 'cond_epsilon')
+        gen, _, _ = model.generator(z, cond, is_training=False, cond_epsilon=eps)
+        cond_noise = [(eps, COND_NOISE_STREAM)]
+    checkpoints = [(tf.train.Saver(tf.global_variables('g_net')), cfg.CHECKPOINT_DIR)]
+    return z, cond, gen, checkpoints, cond_noise
+
+
+def get_shard_path(shard_dir, shard):
+    return os.path.join(shard_dir, 'shard_%05d.npy' % shard)
+
+
+def get_shard_info_path(shard_dir, shard):
+    return os.path.join(shard_dir, 'shard_%05d.json' % shard)
+
+
+def write_json(path, obj):
+    """Writes the file atomically"""
+    tmp_path = '%s.tmp%d' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(shard_dir):
+    path = os.path.join(shard_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(shard_dir, manifest):
+    """Writes the manifest of the job or checks that it matches the one of a previous run"""
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+
+    existing = read_manifest(shard_dir)
+    if existing is None:
+        write_json(os.path.join(shard_dir, MANIFEST), manifest)
+        return
+
+    # The manifests written before the sampler was versioned hold the samples of version 1
+    existing.setdefault('sampler_version', 1)
+    for key in ['size', 'shard_size', 'seed', 'sampler_version', 'checkpoint_step', 'image_shape']:
+        if existing[key] != manifest[key]:
+            raise RuntimeError('The shards in %s were generated with %s=%s, not %s. Use a new directory.'
+                               % (shard_dir, key, existing[key], manifest[key]))
+
+
+def is_shard_complete(shard_dir, shard):
+    return os.path.exists(get_shard_info_path(shard_dir, shard)) and os.path.exists(get_shard_path(shard_dir, shard))
+
+
+def has_shards(shard_dir):
+    """Returns True if all the shards of the manifest in shard_dir have been generated"""
+    if not shard_dir:
+        return False
+    manifest = read_manifest(shard_dir)
+    if manifest is None:
+        return False
+
+    missing = [shard for shard in range(manifest['num_shards']) if not is_shard_complete(shard_dir, shard)]
+    if missing:
+        raise RuntimeError('%d shards of %s are missing, e.g. shard %d. Finish the generation job first.'
+                           % (len(missing), shard_dir, missing[0]))
+    return True
+
+
+def generate_shards(sess, z, cond, gen, dataset, shard_dir, size, shard_size, seed, checkpoint_step, cond_noise=(),
+                    worker=0, num_workers=1, verbose=True, batch_size=None):
+    """
+    Generates the shards worker, worker + num_workers, ... of the job and skips the ones which are complete.
+
+    The noise, the captions and the conditioning augmentation noise of every image are drawn by a Sampler from the
+    seed of the job and the index of the image, so the images do not depend on the worker or the batch generating
+    them. cond_noise is the list of (placeholder, stream) pairs of the conditioning augmentation of the generator.
+    batch_size is only required when the generator was built with a dynamic batch size, in which case the last
+    batch of a shard only holds the remaining images.
+    """
+    static_batch_size = z.get_shape().as_list()[0]
+    batch_size = batch_size or static_batch_size
+    z_dim = z.get_shape().as_list()[1]
+    if batch_size is None:
+        raise ValueError('The batch size is required when the generator has a dynamic batch size')
+    if static_batch_size is not None:
+        if batch_size != static_batch_size:
+            raise ValueError('The generator was built with a batch size of %d, not %d' % (static_batch_size,
+                                                                                       batch_size))
+        if shard_size % batch_size != 0:
+            raise ValueError('The shard size %d must be a multiple of the batch size %d' % (shard_size, batch_size))
+
+    num_shards = int(np.ceil(size / shard_size))
+    image_shape = gen.get_shape().as_list()[1:]
+    write_manifest(shard_dir, {
+        'size': size,
+        'shard_size': shard_size,
+        'num_shards': num_shards,
+        'seed': seed,
+        'sampler_version': SAMPLER_VERSION,
+        'checkpoint_step': checkpoint_step,
+        'image_shape': image_shape,
+        'dtype': 'uint8',
+    })
+
+    sampler = Sampler(seed)
+    for shard in range(worker, num_shards, num_workers):
+        if is_shard_complete(shard_dir, shard):
+            if verbose:
+                print('Shard %d/%d is complete, skipping it' % (shard + 1, num_shards))
+            continue
+
+        n = min(shard_size, size - shard * shard_size)
+        n_batches = int(np.ceil(n / batch_size))
+
+        images = np.empty([n_batches * batch_size] + image_shape, dtype=np.uint8)
+        examples, embedding_ids = [], []
+        for i in range(n_batches):
+            if verbose:
+                print("\rShard %d/%d: generating batch %d/%d" % (shard + 1, num_shards, i + 1, n_batches), end="",
+                      flush=True)
+            start = i * batch_size
+            end = start + batch_size if static_batch_size else min(start + batch_size, n)
+            indices = np.arange(start, end) + shard * shard_size
+
+            # The condition of every image is the mean of 4 of the embeddings of a test example
+            embed, batch_examples, batch_embedding_ids = sampler.embeddings(indices, dataset.embeddings)
+            feed_dict = {z: sampler.z(indices, z_dim), cond: embed}
+            for eps, stream in cond_noise:
+                feed_dict[eps] = sampler.cond_noise(indices, eps.get_shape().as_list()[1], stream)
+
+            gen_batch = sess.run(gen, feed_dict=feed_dict)
+            images[start:end] = denormalize_images(np.clip(gen_batch, -1., 1.))
+            examples.append(batch_examples)
+            embedding_ids.append(batch_embedding_ids)
+        if verbose:
+            print()
+
+        # The shard is marked as complete by its info file, which is written last
+        tmp_path = '%s.tmp%d.npy' % (get_shard_path(shard_dir, shard)[:-len('.npy')], os.getpid())
+        np.save(tmp_path, images[:n])
+        os.replace(tmp_path, get_shard_path(shard_dir, shard))
+        write_json(get_shard_info_path(shard_dir, shard), {
+            'shard': shard,
+            'size': n,
+            'indices': np.concatenate(examples)[:n].tolist(),
+            'embedding_ids': np.concatenate(embedding_ids)[:n].tolist(),
+        })
+
+
+class ShardedImages(object):
+    """
+    Read-only sequence of the generated images of a sharded job. The shards are memory mapped, so the images are
+    read from disk as they are accessed and can be passed to the scorers in place of an in-memory array.
+    """
+
+    def __init__(self, shard_dir):
+        if not has_shards(shard_dir):
+            raise RuntimeError('No generated shards found in %s' % shard_dir)
+
+        self.shard_dir = shard_dir
+        self.manifest = read_manifest(shard_dir)
+        self.shard_size = self.manifest['shard_size']
+        self._shards = {}
+
+    def __len__(self):
+        return self.manifest['size']
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('Image index %d out of range' % idx)
+
+        shard = idx // self.shard_size
+        if shard not in self._shards:
+            self._shards[shard] = np.load(get_shard_path(self.shard_dir, shard), mmap_mode='r')
+        return np.asarray(self._shards[shard][idx % self.shard_size])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+def main(_):
+    from preprocess.dataset import TextDataset
+    from utils.config import config_from_yaml
+    from utils.session import session_config
+
+    cfg = config_from_yaml(FLAGS.cfg)
+    cfg_stage_i = config_from_yaml(FLAGS.cfg_stage_I) if FLAGS.model == 'stageii' else None
+    shard_dir = FLAGS.shard_dir or cfg.EVAL.SHARD_DIR
+
+    dataset = TextDataset(cfg.DATASET_DIR, cfg.MODEL.OUTPUT_SIZE, embedding_dtype=cfg.EMBEDDING_DTYPE)
+    dataset.test = dataset.get_data('%s/test' % cfg.DATASET_DIR)
+
+    with tf.Session(config=session_config(FLAGS.model)) as sess:
+        z, cond, gen, checkpoints, cond_noise = build_generator(FLAGS.model, cfg, None, cfg_stage_i)
+
+        checkpoint_step = None
+        for saver, checkpoint_dir in checkpoints:
+            could_load, checkpoint_step = load(saver, sess, checkpoint_dir)
+            if not could_load:
+                raise RuntimeError('Could not load the checkpoints of the generator from %s' % checkpoint_dir)
+
+        generate_shards(sess, z, cond, gen, dataset.test, shard_dir, cfg.EVAL.SIZE, FLAGS.shard_size, FLAGS.seed,
+                        checkpoint_step, cond_noise, worker=FLAGS.worker, num_workers=FLAGS.num_workers,
+                        batch_size=cfg.EVAL.SAMPLE_SIZE)
+
+
+if __name__ == '__main__':
+    flags = tf.app.flags
+    flags.DEFINE_string('model', 'wgancls', 'The model generating the samples: gancls, wgancls, stagei or stageii')
+    flags.DEFINE_string('cfg', './models/wgancls/cfg/flowers.yml', 'Relative path to the config of the model')
+    flags.DEFINE_string('cfg_stage_I', './models/stackgan/stageI/cfg/flowers.yml',
+                        'Relative path to the config of stage I when generating with stage II')
+    flags.DEFINE_string('shard_dir', '', 'Overrides the EVAL.SHARD_DIR of the config')
+    flags.DEFINE_integer('shard_size', 1024, 'Number of images per shard [1024]')
+    flags.DEFINE_integer('seed', 0, 'Seed of the noise and of the conditioning [0]')
+    flags.DEFINE_integer('worker', 0, 'Index of this worker [0]')
+    flags.DEFINE_integer('num_workers', 1, 'Number of workers sharing the job [1]')
+    FLAGS = flags.FLAGS
+
+    tf.app.run()
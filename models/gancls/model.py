@@ -24,6 +24,14 @@ class GanCls(object):
         self.df_dim = cfg.MODEL.DF_DIM
         
         self.image_dims = [cfg.MODEL.IMAGE_SHAPE.H, cfg.MODEL.IMAGE_SHAPE.W, cfg.MODEL.IMAGE_SHAPE.D]
+        # Data format of the convolutions. The images in and out of the networks are always NHWC.
+        self.df = get_data_format(cfg.MODEL.DATA_FORMAT)
+        self.data_format = df_to_channel(self.df)
+
+        # Mixed precision: float16 compute with float32 master weights
+        self.mixed_precision = cfg.TRAIN.MIXED_PRECISION
+        self.dtype = get_compute_dtype(self.mixed_precision)
+        self.custom_getter = get_variable_getter(self.mixed_precision)
 
         self.w_init = tf.random_normal_initializer(stddev=0.02)
         self.batch_norm_init = {
@@ -54,37 +62,46 @@ class GanCls(object):
     def discriminator(self, inputs, embed, is_training=True, reuse=False):
         s16 = self.output_size / 16
 
-        with tf.variable_scope("d_net", reuse=reuse):
+        with tf.variable_scope("d_net", reuse=reuse, custom_getter=self.custom_getter):
+            inputs = tf.cast(to_data_format(inputs, self.df), self.dtype)
+            embed = tf.cast(embed, self.dtype)
+
             net_ho = tf.layers.conv2d(inputs=inputs, filters=self.df_dim, kernel_size=(4, 4), strides=(2, 2),
                                       padding='same', activation=lambda l: tf.nn.leaky_relu(l, 0.2),
-                                      kernel_initializer=self.w_init)
+                                      kernel_initializer=self.w_init, data_format=self.data_format)
             net_h1 = tf.layers.conv2d(inputs=net_ho, filters=self.df_dim * 2, kernel_size=(4, 4), strides=(2, 2),
-                                      padding='same', activation=None, kernel_initializer=self.w_init)
+                                      padding='same', activation=None, kernel_initializer=self.w_init,
+                                      data_format=self.data_format)
             net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init,
-                                act=lambda l: tf.nn.leaky_relu(l, 0.2))
+                                act=lambda l: tf.nn.leaky_relu(l, 0.2), df=self.df)
             net_h2 = tf.layers.conv2d(inputs=net_h1, filters=self.df_dim * 4, kernel_size=(4, 4), strides=(2, 2),
-                                      padding='same', activation=None, kernel_initializer=self.w_init)
+                                      padding='same', activation=None, kernel_initializer=self.w_init,
+                                      data_format=self.data_format)
             net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init,
-                                act=lambda l: tf.nn.leaky_relu(l, 0.2))
+                                act=lambda l: tf.nn.leaky_relu(l, 0.2), df=self.df)
             net_h3 = tf.layers.conv2d(inputs=net_h2, filters=self.df_dim * 8, kernel_size=(4, 4), strides=(2, 2),
-                                      padding='same', activation=None, kernel_initializer=self.w_init)
+                                      padding='same', activation=None, kernel_initializer=self.w_init,
+                                      data_format=self.data_format)
             net_h3 = batch_norm(net_h3, train=is_training, init=self.batch_norm_init,
-                                act=None)
+                                act=None, df=self.df)
             # --------------------------------------------------------
 
             # Residual layer
             net = tf.layers.conv2d(inputs=net_h3, filters=self.df_dim * 2, kernel_size=(1, 1), strides=(1, 1),
-                                   padding='valid', activation=None, kernel_initializer=self.w_init)
+                                   padding='valid', activation=None, kernel_initializer=self.w_init,
+                                   data_format=self.data_format)
             net = batch_norm(net, train=is_training, init=self.batch_norm_init,
-                             act=lambda l: tf.nn.leaky_relu(l, 0.2))
+                             act=lambda l: tf.nn.leaky_relu(l, 0.2), df=self.df)
             net = tf.layers.conv2d(inputs=net, filters=self.df_dim * 2, kernel_size=(3, 3), strides=(1, 1),
-                                   padding='same', activation=None, kernel_initializer=self.w_init)
+                                   padding='same', activation=None, kernel_initializer=self.w_init,
+                                   data_format=self.data_format)
             net = batch_norm(net, train=is_training, init=self.batch_norm_init,
-                             act=lambda l: tf.nn.leaky_relu(l, 0.2))
+                             act=lambda l: tf.nn.leaky_relu(l, 0.2), df=self.df)
             net = tf.layers.conv2d(inputs=net, filters=self.df_dim * 8, kernel_size=(3, 3), strides=(1, 1),
-                                   padding='same', activation=None, kernel_initializer=self.w_init)
+                                   padding='same', activation=None, kernel_initializer=self.w_init,
+                                   data_format=self.data_format)
             net = batch_norm(net, train=is_training, init=self.batch_norm_init,
-                             act=None)
+                             act=None, df=self.df)
             net_h4 = tf.add(net_h3, net)
             net_h4 = tf.nn.leaky_relu(net_h4, 0.2)
             # --------------------------------------------------------
@@ -94,17 +111,18 @@ class GanCls(object):
                                         activation=lambda l: tf.nn.leaky_relu(l, 0.2))
 
             # Append embeddings in depth
-            net_embed = tf.expand_dims(tf.expand_dims(net_embed, 1), 1)
-            net_embed = tf.tile(net_embed, [1, 4, 4, 1])
-            net_h4_concat = tf.concat([net_h4, net_embed], axis=3)
+            net_h4_concat = concat_cond(net_h4, net_embed, df=self.df)
 
             net_h4 = tf.layers.conv2d(inputs=net_h4_concat, filters=self.df_dim * 8, kernel_size=(1, 1), strides=(1, 1),
-                                      padding='valid', activation=None, kernel_initializer=self.w_init)
+                                      padding='valid', activation=None, kernel_initializer=self.w_init,
+                                      data_format=self.data_format)
             net_h4 = batch_norm(net_h4, train=is_training, init=self.batch_norm_init,
-                                act=lambda l: tf.nn.leaky_relu(l, 0.2))
+                                act=lambda l: tf.nn.leaky_relu(l, 0.2), df=self.df)
 
             net_logits = tf.layers.conv2d(inputs=net_h4, filters=1, kernel_size=(s16, s16), strides=(s16, s16),
-                                          padding='valid', kernel_initializer=self.w_init)
+                                          padding='valid', kernel_initializer=self.w_init,
+                                          data_format=self.data_format)
+            net_logits = tf.cast(net_logits, tf.float32)
 
             return tf.nn.sigmoid(net_logits), net_logits
 
@@ -112,7 +130,10 @@ class GanCls(object):
         s = self.output_size
         s2, s4, s8, s16 = int(s / 2), int(s / 4), int(s / 8), int(s / 16)
 
-        with tf.variable_scope("g_net", reuse=reuse):
+        with tf.variable_scope("g_net", reuse=reuse, custom_getter=self.custom_getter):
+            z = tf.cast(z, self.dtype)
+            embed = tf.cast(embed, self.dtype)
+
             # Compress the embedding and append it to z
             net_embed = tf.layers.dense(inputs=embed, units=self.compressed_embed_dim, activation=None)
 
@@ -121,72 +142,84 @@ class GanCls(object):
             net_h0 = tf.layers.dense(net_input, units=self.gf_dim * 8 * s16 * s16, activation=None,
                                      kernel_initializer=self.w_init)
             net_h0 = batch_norm(net_h0, train=is_training, init=self.batch_norm_init,
-                                act=None)
+                                act=None, df=self.df)
             # --------------------------------------------------------
-            net_h0 = tf.reshape(net_h0, [-1, 4, 4, self.gf_dim * 8])
+            net_h0 = dense_to_feature_map(net_h0, 4, 4, self.gf_dim * 8, df=self.df)
 
             # Residual layer
             net = tf.layers.conv2d(inputs=net_h0, filters=self.gf_dim * 2, kernel_size=(1, 1), strides=(1, 1),
-                                   padding='valid', activation=None, kernel_initializer=self.w_init)
+                                   padding='valid', activation=None, kernel_initializer=self.w_init,
+                                   data_format=self.data_format)
             net = batch_norm(net, train=is_training, init=self.batch_norm_init,
-                             act=tf.nn.relu)
+                             act=tf.nn.relu, df=self.df)
             net = tf.layers.conv2d(inputs=net, filters=self.gf_dim * 2, kernel_size=(3, 3), strides=(1, 1),
-                                   padding='same', activation=None, kernel_initializer=self.w_init)
+                                   padding='same', activation=None, kernel_initializer=self.w_init,
+                                   data_format=self.data_format)
             net = batch_norm(net, train=is_training, init=self.batch_norm_init,
-                             act=tf.nn.relu)
+                             act=tf.nn.relu, df=self.df)
             net = tf.layers.conv2d(inputs=net, filters=self.gf_dim * 8, kernel_size=(3, 3), strides=(1, 1),
-                                   padding='same', activation=None, kernel_initializer=self.w_init)
+                                   padding='same', activation=None, kernel_initializer=self.w_init,
+                                   data_format=self.data_format)
             net = batch_norm(net, train=is_training, init=self.batch_norm_init,
-                             act=None)
+                             act=None, df=self.df)
             net_h1 = tf.add(net_h0, net)
             net_h1 = tf.nn.relu(net_h1)
             # --------------------------------------------------------
 
             net_h2 = tf.layers.conv2d_transpose(net_h1, filters=self.gf_dim * 4, kernel_size=(4, 4), strides=(2, 2),
-                                                padding='same', activation=None, kernel_initializer=self.w_init)
+                                                padding='same', activation=None, kernel_initializer=self.w_init,
+                                                data_format=self.data_format)
             net_h2 = tf.layers.conv2d(inputs=net_h2, filters=self.gf_dim * 4, kernel_size=(3, 3), strides=(1, 1),
-                                      padding='same', activation=None, kernel_initializer=self.w_init)
+                                      padding='same', activation=None, kernel_initializer=self.w_init,
+                                      data_format=self.data_format)
             net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init,
-                                act=None)
+                                act=None, df=self.df)
             # --------------------------------------------------------
 
             # Residual layer
             net = tf.layers.conv2d(inputs=net_h2, filters=self.gf_dim, kernel_size=(1, 1), strides=(1, 1),
-                                   padding='valid', activation=None, kernel_initializer=self.w_init)
+                                   padding='valid', activation=None, kernel_initializer=self.w_init,
+                                   data_format=self.data_format)
             net = batch_norm(net, train=is_training, init=self.batch_norm_init,
-                             act=tf.nn.relu)
+                             act=tf.nn.relu, df=self.df)
             net = tf.layers.conv2d(inputs=net, filters=self.gf_dim, kernel_size=(3, 3), strides=(1, 1),
-                                   padding='same', activation=None, kernel_initializer=self.w_init)
+                                   padding='same', activation=None, kernel_initializer=self.w_init,
+                                   data_format=self.data_format)
             net = batch_norm(net, train=is_training, init=self.batch_norm_init,
-                             act=tf.nn.relu)
+                             act=tf.nn.relu, df=self.df)
             net = tf.layers.conv2d(inputs=net, filters=self.gf_dim * 4, kernel_size=(3, 3), strides=(1, 1),
-                                   padding='same', activation=None, kernel_initializer=self.w_init)
+                                   padding='same', activation=None, kernel_initializer=self.w_init,
+                                   data_format=self.data_format)
             net = batch_norm(net, train=is_training, init=self.batch_norm_init,
-                             act=None)
+                             act=None, df=self.df)
             net_h3 = tf.add(net_h2, net)
             net_h3 = tf.nn.relu(net_h3)
             # --------------------------------------------------------
 
             net_h4 = tf.layers.conv2d_transpose(net_h3, filters=self.gf_dim * 2, kernel_size=(4, 4), strides=(2, 2),
-                                                padding='same', activation=None, kernel_initializer=self.w_init)
+                                                padding='same', activation=None, kernel_initializer=self.w_init,
+                                                data_format=self.data_format)
             net_h4 = tf.layers.conv2d(inputs=net_h4, filters=self.gf_dim * 2, kernel_size=(3, 3), strides=(1, 1),
-                                      padding='same', activation=None, kernel_initializer=self.w_init)
+                                      padding='same', activation=None, kernel_initializer=self.w_init,
+                                      data_format=self.data_format)
             net_h4 = batch_norm(net_h4, train=is_training, init=self.batch_norm_init,
-                                act=tf.nn.relu)
+                                act=tf.nn.relu, df=self.df)
 
             net_h5 = tf.layers.conv2d_transpose(net_h4, filters=self.gf_dim, kernel_size=(4, 4), strides=(2, 2),
-                                                padding='same', activation=None, kernel_initializer=self.w_init)
+                                                padding='same', activation=None, kernel_initializer=self.w_init,
+                                                data_format=self.data_format)
             net_h5 = tf.layers.conv2d(inputs=net_h5, filters=self.gf_dim, kernel_size=(3, 3), strides=(1, 1),
-                                      padding='same', activation=None, kernel_initializer=self.w_init)
+                                      padding='same', activation=None, kernel_initializer=self.w_init,
+                                      data_format=self.data_format)
             net_h5 = batch_norm(net_h5, train=is_training, init=self.batch_norm_init,
-                                act=tf.nn.relu)
+                                act=tf.nn.relu, df=self.df)
 
             net_logits = tf.layers.conv2d_transpose(net_h5, filters=self.image_dims[-1], kernel_size=(4, 4),
                                                     strides=(2, 2), padding='same', activation=None,
-                                                    kernel_initializer=self.w_init)
+                                                    kernel_initializer=self.w_init, data_format=self.data_format)
             net_logits = tf.layers.conv2d(inputs=net_logits, filters=self.image_dims[-1], kernel_size=(3, 3),
                                           strides=(1, 1), padding='same', activation=None,
-                                          kernel_initializer=self.w_init)
+                                          kernel_initializer=self.w_init, data_format=self.data_format)
 
-            net_output = tf.nn.tanh(net_logits)
-            return net_output
+            net_output = from_data_format(tf.nn.tanh(net_logits), self.df)
+            return tf.cast(net_output, tf.float32)
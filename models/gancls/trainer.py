@@ -2,11 +2,13 @@ from random import randint
 
 import tensorflow as tf
 from models.gancls.model import GanCls
-from utils.utils import save_images, get_balanced_factorization
-from utils.saver import save, load
+from utils.utils import get_balanced_factorization
+from utils.saver import save, load, AsyncSaver
+from utils.artifacts import ArtifactWriter
+from utils.optim import loss_scale_optimizer
+from utils.summary import EXPENSIVE, SCALAR, ProgressLine, get_summary_policy
 from preprocess.dataset import TextDataset
 import numpy as np
-import time
 
 
 class GanClsTrainer(object):
@@ -42,12 +44,17 @@ class GanClsTrainer(object):
         self.g_vars = [var for var in t_vars if 'g_net' in var.name]
 
         self.saver = tf.train.Saver(max_to_keep=self.cfg.TRAIN.CHECKPOINTS_TO_KEEP)
+        self.checkpoint_saver = self.saver
+        if self.cfg.TRAIN.ASYNC_CHECKPOINT:
+            self.checkpoint_saver = AsyncSaver(max_to_keep=self.cfg.TRAIN.CHECKPOINTS_TO_KEEP)
 
         update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
         with tf.control_dependencies(update_ops):
-            self.D_optim = tf.train.AdamOptimizer(self.cfg.TRAIN.D_LR, beta1=self.cfg.TRAIN.D_BETA_DECAY) \
+            d_optimizer = tf.train.AdamOptimizer(self.cfg.TRAIN.D_LR, beta1=self.cfg.TRAIN.D_BETA_DECAY)
+            self.D_optim = loss_scale_optimizer(d_optimizer, self.model.mixed_precision) \
                 .minimize(self.D_loss, var_list=self.d_vars)
-            self.G_optim = tf.train.AdamOptimizer(self.cfg.TRAIN.G_LR, beta1=self.cfg.TRAIN.G_BETA_DECAY) \
+            g_optimizer = tf.train.AdamOptimizer(self.cfg.TRAIN.G_LR, beta1=self.cfg.TRAIN.G_BETA_DECAY)
+            self.G_optim = loss_scale_optimizer(g_optimizer, self.model.mixed_precision) \
                 .minimize(self.G_loss, var_list=self.g_vars)
 
     def define_summaries(self):
@@ -63,20 +70,28 @@ class GanClsTrainer(object):
         self.G_loss_summ = tf.summary.scalar("g_loss", self.G_loss)
         self.D_loss_summ = tf.summary.scalar("d_loss", self.D_loss)
 
-        self.G_merged_summ = tf.summary.merge([self.G_summ, self.G_loss_summ])
-        self.D_merged_summ = tf.summary.merge([self.D_real_mismatch_summ,
-                                               self.D_real_match_summ,
-                                               self.D_synthetic_summ,
-                                               self.D_synthetic_loss_summ,
-                                               self.D_real_mismatch_loss_summ,
-                                               self.D_real_match_loss_summ,
-                                               self.D_loss_summ])
+        self.G_scalar_summ = tf.summary.merge([self.G_loss_summ])
+        self.G_expensive_summ = tf.summary.merge([self.G_summ])
+        self.G_merged_summ = tf.summary.merge([self.G_scalar_summ, self.G_expensive_summ])
+
+        self.D_scalar_summ = tf.summary.merge([self.D_loss_summ])
+        self.D_expensive_summ = tf.summary.merge([self.D_real_mismatch_summ,
+                                                  self.D_real_match_summ,
+                                                  self.D_synthetic_summ,
+                                                  self.D_synthetic_loss_summ,
+                                                  self.D_real_mismatch_loss_summ,
+                                                  self.D_real_match_loss_summ])
+        self.D_merged_summ = tf.summary.merge([self.D_scalar_summ, self.D_expensive_summ])
 
         self.writer = tf.summary.FileWriter(self.cfg.LOGS_DIR, self.sess.graph)
+        # The scalars and the histograms/images run on their own periods and are written in batches
+        self.summaries = get_summary_policy(self.cfg.TRAIN.SUMMARY, self.writer)
 
     def train(self):
         self.define_losses()
         self.define_summaries()
+        # The sample grids are written by a background thread
+        self.artifacts = ArtifactWriter(self.writer)
 
         tf.global_variables_initializer().run()
 
@@ -93,7 +108,6 @@ class GanClsTrainer(object):
         print()
 
         counter = 1
-        start_time = time.time()
         could_load, checkpoint_counter = load(self.saver, self.sess, self.cfg.CHECKPOINT_DIR)
         if could_load:
             counter = checkpoint_counter
@@ -101,6 +115,10 @@ class GanClsTrainer(object):
         else:
             print(" [!] Load failed...")
 
+        d_summaries = {SCALAR: self.D_scalar_summ, EXPENSIVE: self.D_expensive_summ}
+        g_summaries = {SCALAR: self.G_scalar_summ, EXPENSIVE: self.G_expensive_summ}
+        progress = ProgressLine(self.cfg.TRAIN.SUMMARY.PROGRESS_SECS)
+
         for epoch in range(self.cfg.TRAIN.EPOCH):
             # Updates per epoch are given by the training data size / batch size
             updates_per_epoch = self.dataset.train.num_examples // self.model.batch_size
@@ -114,29 +132,28 @@ class GanClsTrainer(object):
                 # Update D network
                 _, err_d_real_match, err_d_real_mismatch, err_d_fake, err_d, summary_str = self.sess.run(
                     [self.D_optim, self.D_real_match_loss, self.D_real_mismatch_loss, self.D_synthetic_loss,
-                     self.D_loss, self.D_merged_summ],
+                     self.D_loss, self.summaries.fetches(counter, d_summaries)],
                     feed_dict={
                         self.model.inputs: images,
                         self.model.wrong_inputs: wrong_images,
                         self.model.phi_inputs: embed,
                         self.model.z: batch_z
                     })
-                self.writer.add_summary(summary_str, counter)
+                self.summaries.add(summary_str, counter)
 
                 # Update G network
-                _, err_g, summary_str = self.sess.run([self.G_optim, self.G_loss, self.G_merged_summ],
+                _, err_g, summary_str = self.sess.run([self.G_optim, self.G_loss,
+                                                       self.summaries.fetches(counter, g_summaries)],
                                                       feed_dict={
                                                           self.model.inputs: images,
                                                           self.model.wrong_inputs: wrong_images,
                                                           self.model.phi_inputs: embed,
                                                           self.model.z: batch_z
                                                       })
-                self.writer.add_summary(summary_str, counter)
+                self.summaries.add(summary_str, counter)
 
                 counter += 1
-                print("Epoch: [%2d] [%4d/%4d] time: %4.4f, d_loss: %.8f, g_loss: %.8f"
-                      % (epoch, idx, updates_per_epoch,
-                         time.time() - start_time, err_d, err_g))
+                progress.update("Epoch: [%2d] [%4d/%4d]" % (epoch, idx, updates_per_epoch), d_loss=err_d, g_loss=err_g)
 
                 if np.mod(counter, 100) == 0:
                     try:
@@ -145,8 +162,8 @@ class GanClsTrainer(object):
                                                             self.model.z_sample: sample_z,
                                                             self.model.phi_sample: sample_embed,
                                                           })
-                        save_images(samples, get_balanced_factorization(samples.shape[0]),
-                                    '{}train_{:02d}_{:04d}.png'.format(self.cfg.SAMPLE_DIR, epoch, idx))
+                        self.artifacts.save_images(samples, get_balanced_factorization(samples.shape[0]),
+                                                   '{}train_{:02d}_{:04d}.png'.format(self.cfg.SAMPLE_DIR, epoch, idx))
                         print("[Sample] d_loss: %.8f, g_loss: %.8f" % (err_d, err_g))
 
                         # Display the captions of the sampled images
@@ -161,4 +178,10 @@ class GanClsTrainer(object):
                         print(e)
 
                 if np.mod(counter, 500) == 2:
-                    save(self.saver, self.sess, self.cfg.CHECKPOINT_DIR, counter)
+                    save(self.checkpoint_saver, self.sess, self.cfg.CHECKPOINT_DIR, counter)
+
+        # Wait for the pending checkpoints, summaries and artifacts to be written
+        if isinstance(self.checkpoint_saver, AsyncSaver):
+            self.checkpoint_saver.close()
+        self.summaries.close()
+        self.artifacts.close()
@@ -0,0 +1,159 @@
+"""
+Memory-mapped cache of the features of the frozen Inception trunk.
+
+Only Mixed_7c and the logits of Inception are fine-tuned, so the output of the frozen trunk (Mixed_7b, 8x8x2048)
+only has to be computed once per image. Every image is cropped and flipped in a fixed number of ways, the first one
+being the centre crop, and the trunk features of every augmentation are stored as float16 (256 KB per augmented
+image). The training batches are then drawn from the cache and only the top blocks are run (see inception_top).
+
+The cache is only valid for the trunk parameters it was computed with, so the manifest records the checkpoint the
+trunk was restored from (its path, global step and modification time) together with the number of examples,
+augmentations and the seed of the crops. The manifest is written last, so an interrupted build is detected and redone.
+"""
+import json
+import os
+
+import numpy as np
+
+TRUNK_ENDPOINT = 'Mixed_7b'
+MANIFEST = 'manifest.json'
+
+
+def get_features_path(cache_dir):
+    return os.path.join(cache_dir, 'features.npy')
+
+
+def get_labels_path(cache_dir):
+    return os.path.join(cache_dir, 'labels.npy')
+
+
+def read_manifest(cache_dir):
+    path = os.path.join(cache_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def checkpoint_signature(checkpoint_path, step=None):
+    """Identifies the restored checkpoint by its path, global step and the modification time of its files"""
+    mtime = None
+    for path in [checkpoint_path + '.index', checkpoint_path]:
+        if os.path.exists(path):
+            mtime = os.path.getmtime(path)
+            break
+    return {'path': os.path.abspath(checkpoint_path), 'step': step, 'mtime': mtime}
+
+
+def has_feature_cache(cache_dir, manifest):
+    """Returns True if cache_dir holds a complete cache built with the given manifest"""
+    existing = read_manifest(cache_dir)
+    if existing is None:
+        return False
+    return all(existing.get(key) == value for key, value in manifest.items())
+
+
+def get_augmentations(num_examples, orig_size, size, num_augmentations, seed=0):
+    """
+    Returns the row and column offsets of the crops and the horizontal flips of shape [num_augmentations,
+    num_examples]. The first augmentation is the centre crop without a flip, the others are random like the ones of
+    Dataset.transform.
+    """
+    rng = np.random.RandomState(seed)
+    shape = (num_augmentations, num_examples)
+    rows = np.floor((orig_size - size) * rng.random_sample(shape)).astype(np.int64)
+    cols = np.floor((orig_size - size) * rng.random_sample(shape)).astype(np.int64)
+    flips = rng.random_sample(shape) > 0.5
+
+    rows[0] = cols[0] = (orig_size - size) // 2
+    flips[0] = False
+    return rows, cols, flips
+
+
+def crop(images, rows, cols, flips, size):
+    cropped = np.empty([len(images), size, size, images.shape[-1]], dtype=np.float32)
+    for i in range(len(images)):
+        image = images[i][rows[i]: rows[i] + size, cols[i]: cols[i] + size, :]
+        cropped[i] = np.fliplr(image) if flips[i] else image
+    return cropped
+
+
+def build_feature_cache(sess, inputs, features_op, dataset, labels, cache_dir, manifest, batch_size, verbose=True):
+    """
+    Computes the trunk features of every augmentation of every image of the dataset and writes the cache.
+
+    Parameters:
+        inputs: The image placeholder of the trunk
+        features_op: The output of the trunk, built in inference mode
+        dataset: The Dataset whose images are cached
+        labels: The label of every example of the dataset
+        manifest: The manifest of the cache, with the num_augmentations and the seed of the crops
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    manifest_path = os.path.join(cache_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    num_examples = dataset.num_examples
+    num_augmentations = manifest['num_augmentations']
+    size = inputs.get_shape().as_list()[1]
+    rows, cols, flips = get_augmentations(num_examples, dataset.images.shape[1], size, num_augmentations,
+                                          manifest['seed'])
+
+    shape = [num_augmentations, num_examples] + features_op.get_shape().as_list()[1:]
+    features = np.lib.format.open_memmap(get_features_path(cache_dir), mode='w+', dtype=np.float16, shape=shape)
+    for aug in range(num_augmentations):
+        for start in range(0, num_examples, batch_size):
+            if verbose:
+                print("\rCaching the features of augmentation %d/%d: %d/%d" % (aug + 1, num_augmentations, start,
+                                                                                 num_examples), end="", flush=True)
+            end = min(start + batch_size, num_examples)
+            images = crop(dataset.normalized_images(slice(start, end)), rows[aug, start:end], cols[aug, start:end],
+                          flips[aug, start:end], size)
+            features[aug, start:end] = sess.run(features_op, feed_dict={inputs: images})
+    if verbose:
+        print()
+    features.flush()
+    del features
+
+    np.save(get_labels_path(cache_dir), np.asarray(labels, dtype=np.int32))
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+class FeatureCache(object):
+    """
+    Read-only, memory-mapped trunk features. The batches are drawn from shuffled epochs over all the (augmentation,
+    example) pairs, so every augmentation of every image is seen once per epoch.
+    """
+
+    def __init__(self, cache_dir, rng=None):
+        if read_manifest(cache_dir) is None:
+            raise RuntimeError('No complete feature cache in %s' % cache_dir)
+        self.rng = rng if rng is not None else np.random
+        self._features = np.load(get_features_path(cache_dir), mmap_mode='r')
+        self._labels = np.load(get_labels_path(cache_dir))
+        self.num_augmentations, self.num_examples = self._features.shape[:2]
+        self._perm = None
+        self._index_in_epoch = self.size
+
+    @property
+    def size(self):
+        """The number of cached (augmentation, example) pairs"""
+        return self.num_augmentations * self.num_examples
+
+    @property
+    def feature_shape(self):
+        return list(self._features.shape[2:])
+
+    def next_batch(self, batch_size):
+        """Returns the next batch of float32 features and their labels"""
+        if self._index_in_epoch + batch_size > self.size:
+            self._perm = self.rng.permutation(self.size)
+            self._index_in_epoch = 0
+        ids = np.sort(self._perm[self._index_in_epoch:self._index_in_epoch + batch_size])
+        self._index_in_epoch += batch_size
+
+        augs, examples = ids // self.num_examples, ids % self.num_examples
+        return self._features[augs, examples].astype(np.float32), self._labels[examples]
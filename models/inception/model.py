@@ -18,8 +18,48 @@ def inception_net(images, num_classes, for_training=False, reuse=False):
     return logits, endpoints
 
 
+def inception_top(features, num_classes, for_training=False, reuse=True):
+    """
+    Builds the blocks of Inception v3 after Mixed_7b, i.e. Mixed_7c and the logits, on top of the Mixed_7b features.
+    The layers are the ones of inception.inception_v3 with the same variable names, so they share the variables of
+    an inception_net built in the same graph (reuse=True) and the checkpoints of the complete network.
+    """
+    with slim.arg_scope(inception.inception_v3_arg_scope()):
+        with tf.variable_scope('InceptionV3', reuse=reuse):
+            with slim.arg_scope([slim.batch_norm, slim.dropout], is_training=for_training):
+                with slim.arg_scope([slim.conv2d, slim.max_pool2d, slim.avg_pool2d], stride=1, padding='SAME'):
+                    with tf.variable_scope('Mixed_7c'):
+                        with tf.variable_scope('Branch_0'):
+                            branch_0 = slim.conv2d(features, 320, [1, 1], scope='Conv2d_0a_1x1')
+                        with tf.variable_scope('Branch_1'):
+                            branch_1 = slim.conv2d(features, 384, [1, 1], scope='Conv2d_0a_1x1')
+                            branch_1 = tf.concat([slim.conv2d(branch_1, 384, [1, 3], scope='Conv2d_0b_1x3'),
+                                                  slim.conv2d(branch_1, 384, [3, 1], scope='Conv2d_0c_3x1')], 3)
+                        with tf.variable_scope('Branch_2'):
+                            branch_2 = slim.conv2d(features, 448, [1, 1], scope='Conv2d_0a_1x1')
+                            branch_2 = slim.conv2d(branch_2, 384, [3, 3], scope='Conv2d_0b_3x3')
+                            branch_2 = tf.concat([slim.conv2d(branch_2, 384, [1, 3], scope='Conv2d_0c_1x3'),
+                                                  slim.conv2d(branch_2, 384, [3, 1], scope='Conv2d_0d_3x1')], 3)
+                        with tf.variable_scope('Branch_3'):
+                            branch_3 = slim.avg_pool2d(features, [3, 3], scope='AvgPool_0a_3x3')
+                            branch_3 = slim.conv2d(branch_3, 192, [1, 1], scope='Conv2d_0b_1x1')
+                        mixed_7c = tf.concat([branch_0, branch_1, branch_2, branch_3], 3)
+
+                with tf.variable_scope('Logits'):
+                    net = slim.avg_pool2d(mixed_7c, [8, 8], padding='VALID', scope='AvgPool_1a_8x8')
+                    pre_logits = slim.dropout(net, keep_prob=0.8, scope='Dropout_1b')
+                    logits = slim.conv2d(pre_logits, num_classes, [1, 1], activation_fn=None, normalizer_fn=None,
+                                         scope='Conv2d_1c_1x1')
+                    logits = tf.squeeze(logits, [1, 2], name='SpatialSqueeze')
+
+    return logits, {'Mixed_7c': mixed_7c, 'PreLogits': pre_logits, 'Logits': logits}
+
+
 def load_inception_inference(sess, num_classes, batch_size, checkpoint_dir):
-    """Loads the inception network with the parameters from checkpoint_dir"""
+    """
+    Loads the inception network with the parameters from checkpoint_dir. With a batch_size of None the network
+    accepts batches of any size, so a single graph serves every batch size and the last, partial batch.
+    """
     # Build a Graph that computes the logits predictions from the inference model.
     inputs = tf.placeholder(tf.float32, [batch_size, 299, 299, 3], name='inputs')
     logits, layers = inception_net(inputs, num_classes)
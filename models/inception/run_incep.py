@@ -4,6 +4,7 @@ from models.inception.trainer import InceptionTrainer
 from utils.utils import pp
 from utils.config import config_from_yaml
 from preprocess.dataset import TextDataset
+from preprocess.image_cache import get_image_cache
 
 import tensorflow as tf
 
@@ -29,7 +30,7 @@ def main(_):
     run_config.gpu_options.allow_growth = True
 
     datadir = cfg.DATASET_DIR
-    dataset = TextDataset(datadir, 299)
+    dataset = TextDataset(datadir, 299, image_cache=get_image_cache(cfg.TRAIN.IMAGE_CACHE))
 
     # We train inception on the test dataset which contains completely other classes from the train dataset
     # (used in GAN training). This is needed for a correct evaluation of the Inception/FID score.
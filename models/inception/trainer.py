@@ -1,9 +1,12 @@
 import tensorflow as tf
-from models.inception.model import inception_net
+from models.inception.feature_cache import FeatureCache, TRUNK_ENDPOINT, build_feature_cache, has_feature_cache, \
+    checkpoint_signature
+from models.inception.model import inception_net, inception_top
 from utils.saver import save, load
 from utils.utils import show_all_variables
 from preprocess.dataset import TextDataset
 import numpy as np
+import os
 import time
 import sys
 
@@ -14,13 +17,17 @@ class InceptionTrainer(object):
         self.dataset = dataset
         self.class_to_idx = self.dataset.test.class_to_index()
         self.cfg = cfg
+        # Train the top blocks from the cached features of the frozen trunk instead of the images
+        self.cached = self.cfg.TRAIN.FEATURE_CACHE.FLAG
 
     def define_summaries(self):
-        self.summary_op = tf.summary.merge([
+        summaries = [
             tf.summary.scalar('loss', self.loss),
-            tf.summary.image('image', self.x),
             tf.summary.scalar('train_acc', self.train_accuracy),
-        ])
+        ]
+        if not self.cached:
+            summaries.append(tf.summary.image('image', self.x))
+        self.summary_op = tf.summary.merge(summaries)
 
         self.writer = tf.summary.FileWriter(self.cfg.LOGS_DIR, self.sess.graph)
 
@@ -28,6 +35,18 @@ class InceptionTrainer(object):
         self.x = tf.placeholder(tf.float32, [self.cfg.TRAIN.BATCH_SIZE, 299, 299, 3], name='inputs')
         self.labels = tf.placeholder(tf.int32, [self.cfg.TRAIN.BATCH_SIZE])
         self.logits, layers = inception_net(self.x, self.cfg.MODEL.CLASSES, for_training=True)
+        update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+
+        if self.cached:
+            # The complete network is still built for its variables and checkpoints, but only the trunk in inference
+            # mode (to build the cache) and the top blocks on the cached features are run
+            self.trunk_inputs = tf.placeholder(tf.float32, [None, 299, 299, 3], name='trunk_inputs')
+            _, trunk_layers = inception_net(self.trunk_inputs, self.cfg.MODEL.CLASSES, reuse=True)
+            self.trunk_features = trunk_layers[TRUNK_ENDPOINT]
+            self.features = tf.placeholder(tf.float32, [self.cfg.TRAIN.BATCH_SIZE] +
+                                           self.trunk_features.get_shape().as_list()[1:], name='features')
+            self.logits, _ = inception_top(self.features, self.cfg.MODEL.CLASSES, for_training=True)
+            update_ops = [op for op in tf.get_collection(tf.GraphKeys.UPDATE_OPS) if op not in update_ops]
         self.pred = tf.nn.softmax(self.logits)
 
         train_correct_prediction = tf.equal(self.labels, tf.cast(tf.argmax(self.pred, 1), tf.int32))
@@ -45,7 +64,6 @@ class InceptionTrainer(object):
 
         self.pretrained_to_restore = [var for var in self.all_vars if var not in self.not_to_restore]
 
-        update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
         with tf.control_dependencies(update_ops):
             opt = tf.train.RMSPropOptimizer(learning_rate=0.00005)
             self.opt_step = opt.minimize(self.loss, var_list=self.vars_to_train)
@@ -66,6 +84,7 @@ class InceptionTrainer(object):
 
             # Load the pre-trained layer
             pretrain_saver.restore(self.sess, self.cfg.TRAIN.PRETRAINED_CHECKPOINT_DIR)
+            self.restored_checkpoint = checkpoint_signature(self.cfg.TRAIN.PRETRAINED_CHECKPOINT_DIR)
 
             # Initialise the not restored layers and the optimizer variables
             self.sess.run(tf.variables_initializer(self.not_to_restore + self.opt_vars))
@@ -74,6 +93,9 @@ class InceptionTrainer(object):
             could_load, checkpoint_counter = load(self.saver, self.sess, self.cfg.CHECKPOINT_DIR)
             if could_load:
                 start_point = checkpoint_counter
+                ckpt = tf.train.get_checkpoint_state(self.cfg.CHECKPOINT_DIR)
+                ckpt_path = os.path.join(self.cfg.CHECKPOINT_DIR, os.path.basename(ckpt.model_checkpoint_path))
+                self.restored_checkpoint = checkpoint_signature(ckpt_path, checkpoint_counter)
                 print(" [*] Load SUCCESS")
             else:
                 print(" [!] Load failed...")
@@ -81,26 +103,36 @@ class InceptionTrainer(object):
         sys.stdout.flush()
 
         batch_size = self.cfg.TRAIN.BATCH_SIZE
+        if self.cached:
+            feature_cache = self.load_feature_cache()
         for idx in range(start_point + 1, self.cfg.TRAIN.MAX_STEPS):
-            epoch_size = self.dataset.test.num_examples // batch_size
-            epoch = idx // epoch_size
+            if self.cached:
+                epoch = idx // (feature_cache.size // batch_size)
+                features, new_labels = feature_cache.next_batch(batch_size)
+                feed_dict = {
+                    self.features: features,
+                    self.labels: new_labels,
+                }
+            else:
+                epoch_size = self.dataset.test.num_examples // batch_size
+                epoch = idx // epoch_size
 
-            images, _, _, _, labels = self.dataset.test.next_batch(batch_size, labels=True)
+                images, _, _, _, labels = self.dataset.test.next_batch(batch_size, labels=True)
 
-            # Bring the labels in a continuous range: [0, num_classes)
-            new_labels = []
-            for label in labels:
-                new_labels.append(self.class_to_idx[label])
+                # Bring the labels in a continuous range: [0, num_classes)
+                new_labels = []
+                for label in labels:
+                    new_labels.append(self.class_to_idx[label])
 
-            assert(np.min(images) >= -1.)
-            assert(np.max(images) <= 1.)
-            assert(np.min(new_labels) >= 0)
-            assert(np.max(new_labels) < 50)  # 20 for flowers, 50 for birds
+                assert(np.min(images) >= -1.)
+                assert(np.max(images) <= 1.)
+                assert(np.min(new_labels) >= 0)
+                assert(np.max(new_labels) < 50)  # 20 for flowers, 50 for birds
 
-            feed_dict = {
-                self.x: images,
-                self.labels: new_labels,
-            }
+                feed_dict = {
+                    self.x: images,
+                    self.labels: new_labels,
+                }
 
             _, err = self.sess.run([self.opt_step, self.loss], feed_dict=feed_dict)
 
@@ -114,3 +146,22 @@ class InceptionTrainer(object):
             if np.mod(idx, 200) == 0:
                 save(self.saver, self.sess, self.cfg.CHECKPOINT_DIR, idx)
             sys.stdout.flush()
+
+    def load_feature_cache(self):
+        """Returns the cache of the trunk features, building it first if it is missing or stale"""
+        cache_cfg = self.cfg.TRAIN.FEATURE_CACHE
+        manifest = {
+            'endpoint': TRUNK_ENDPOINT,
+            # The trunk of a resumed run is restored from the checkpoints of the run, which may differ from the
+            # pretrained ones
+            'checkpoint': self.restored_checkpoint,
+            'num_examples': self.dataset.test.num_examples,
+            'num_augmentations': cache_cfg.NUM_AUGMENTATIONS,
+            'seed': cache_cfg.SEED,
+        }
+        if not has_feature_cache(cache_cfg.DIR, manifest):
+            print('Caching the %s features of the frozen trunk in %s' % (TRUNK_ENDPOINT, cache_cfg.DIR))
+            labels = [self.class_to_idx[label] for label in self.dataset.test.class_ids]
+            build_feature_cache(self.sess, self.trunk_inputs, self.trunk_features, self.dataset.test, labels,
+                                cache_cfg.DIR, manifest, self.cfg.TRAIN.BATCH_SIZE)
+        return FeatureCache(cache_cfg.DIR)
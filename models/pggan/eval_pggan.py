@@ -1,12 +1,14 @@
+import numpy as np
 import tensorflow as tf
 from evaluation import inception_score
 
 from models.inception.model import load_inception_inference
 from models.pggan.pggan import PGGAN
 from utils.config import config_from_yaml
-from utils.utils import make_gif, prep_incep_img
-from utils.visualize import *
+from utils.utils import make_gif, prep_incep_img, denormalize_images
+from preprocess.dataset import TextDataset
 from utils.saver import load
+from utils.session import session_config
 import os
 
 flags = tf.app.flags
@@ -32,7 +34,6 @@ if __name__ == "__main__":
     scale_factor = 1
     sample_size = 128
     stage = 7
-    incep_batch_size = batch_size
     incep_checkpoint_dir = cfg.EVAL.INCEP_CHECKPOINT_DIR
 
     pggan_checkpoint_dir_read = os.path.join(cfg.CHECKPOINT_DIR, 'stage%d/' % stage)
@@ -42,8 +43,7 @@ if __name__ == "__main__":
     if not os.path.exists(samples_dir):
         os.makedirs(samples_dir)
 
-    run_config = tf.ConfigProto()
-    run_config.gpu_options.allow_growth = True
+    run_config = session_config('pggan', verbose=False)
 
     pggan = PGGAN(batch_size=batch_size, steps=None,
                   check_dir_write='', check_dir_read=pggan_checkpoint_dir_read,
@@ -54,8 +54,7 @@ if __name__ == "__main__":
     z = tf.placeholder(tf.float32, [None, sample_size], name='z')
     gen_op, _, _ = pggan.generator(z, cond, stages=stage, t=False)
 
-    config = tf.ConfigProto()
-    config.gpu_options.allow_growth = True
+    config = session_config('pggan')
 
     with tf.Session(config=config) as sess:
         saver = tf.train.Saver(tf.global_variables('g_net'))
@@ -63,26 +62,28 @@ if __name__ == "__main__":
         if not could_load:
             raise RuntimeError('Could not load stage %d' % stage)
 
-        logits, _ = load_inception_inference(sess, cfg.EVAL.NUM_CLASSES, incep_batch_size, incep_checkpoint_dir)
+        logits, _ = load_inception_inference(sess, cfg.EVAL.NUM_CLASSES, None, incep_checkpoint_dir)
         pred_op = tf.nn.softmax(logits)
 
         size = 50000
-        n_batches = size // batch_size
+        n_batches = int(np.ceil(size / batch_size))
 
         all_preds = []
         for i in range(n_batches):
             print("\rGenerating batch %d/%d" % (i + 1, n_batches), end="", flush=True)
 
-            sample_z = np.random.normal(0, 1, size=(batch_size, sample_size))
-            _, _, embed, _, _ = dataset.test.next_batch(batch_size, 4, embeddings=True)
+            # The generator and Inception accept any batch size, so the last batch holds the remaining samples
+            bs = min(batch_size, size - i * batch_size)
+            sample_z = np.random.normal(0, 1, size=(bs, sample_size))
+            _, _, embed, _, _ = dataset.test.next_batch(bs, 4, embeddings=True)
 
             # Generate a batch and scale it up for inception
             gen_batch = sess.run(gen_op, feed_dict={z: sample_z, cond: embed})
             gen_batch = np.clip(gen_batch, -1., 1.)
 
             samples = denormalize_images(gen_batch)
-            incep_samples = np.empty((batch_size, 299, 299, 3))
-            for sample_idx in range(batch_size):
+            incep_samples = np.empty((bs, 299, 299, 3))
+            for sample_idx in range(bs):
                 incep_samples[sample_idx] = prep_incep_img(samples[sample_idx])
 
             # Run prediction for current batch
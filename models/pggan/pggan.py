@@ -1,19 +1,35 @@
 import tensorflow as tf
 import time
+from functools import partial
 
-from utils.ops import lrelu_act, conv2d, fc, upscale, pool, layer_norm
-from utils.utils import save_images, get_balanced_factorization, show_all_variables, save_captions, print_vars, \
+from utils.ops import lrelu_act, conv2d, fc, upscale, pool, layer_norm, get_compute_dtype, get_variable_getter, \
+    jit_scope, set_xla_jit, upscale_conv2d, XLA_OFF
+from utils.utils import get_balanced_factorization, show_all_variables, save_captions, print_vars, \
     initialize_uninitialized
-from utils.saver import load, save
+from utils.saver import load, save, AsyncSaver
+from utils.artifacts import ArtifactWriter
+from utils.profiler import StepProfiler
+from utils.summary import EXPENSIVE, SCALAR, SummaryPolicy, get_summary_policy
+from utils.optim import fused_step, loss_scale_optimizer, accumulate_gradients, input_gradient
+from utils.session import session_config
+from utils.graph_cache import graph_key, get_graph_path, has_graph, export_graph, import_graph
 import numpy as np
 import sys
 
+# The tensors and ops of the training graph used by the training loop, which are stored in the cached graphs
+GRAPH_TENSORS = ['x', 'x_mismatch', 'cond', 'z', 'epsilon', 'z_sample', 'cond_sample', 'iter', 'learning_rate', 'G',
+                 'sampler', 'D_loss', 'G_loss', 'D_optim', 'G_optim', 'DG_optim', 'DG_accum', 'DG_apply', 'summary_op',
+                 'scalar_summ', 'expensive_summ']
+GRAPH_SAVERS = ['saver', 'restore']
+
 
 class PGGAN(object):
 
     # build model
     def __init__(self, batch_size, steps, check_dir_write, check_dir_read, dataset, sample_path, log_dir, stage, trans,
-                 build_model=True):
+                 build_model=True, fused_step=False, mixed_precision=False, accum_steps=1,
+                 async_checkpoint=False, profiler=None, xla=XLA_OFF, recompute=False, graph_cache_dir='',
+                 summary_cfg=None):
 
         self.batch_size = batch_size
         self.steps = steps
@@ -24,6 +40,27 @@ class PGGAN(object):
         self.log_dir = log_dir
         self.stage = stage
         self.trans = trans
+        self.fused_step = fused_step
+        # Number of micro-batches whose gradients are accumulated before each update
+        self.accum_steps = accum_steps
+        # Write the checkpoints on a background thread. Disabled by default, see AsyncSaver.
+        self.async_checkpoint = async_checkpoint
+        # Times the phases of the training steps. Disabled by default.
+        self.profiler = profiler if profiler is not None else StepProfiler()
+        # The SUMMARY block of the config, with the periods of the scalar and expensive summaries. Without it all
+        # the summaries are written every 20 steps.
+        self.summary_cfg = summary_cfg
+
+        # Mixed precision: float16 compute with float32 master weights
+        self.mixed_precision = mixed_precision
+        self.dtype = get_compute_dtype(mixed_precision)
+        self.custom_getter = get_variable_getter(mixed_precision)
+
+        # XLA JIT compilation of the D and G updates: off, scoped or global
+        self.xla = xla
+        # Gradient checkpointing: only the outputs of the conv stages are kept for backprop and the activations
+        # inside the stages are recomputed. The variables must then be resource variables.
+        self.recompute = recompute
 
         self.z_dim = 128
         self.embed_dim = 1024
@@ -36,13 +73,51 @@ class PGGAN(object):
         self.lr_inp = self.lr
         self.output_size = 4 * pow(2, stage - 1)
 
-        self.dt = tf.Variable(0.0, trainable=False)
-        self.alpha_tra = tf.Variable(initial_value=0.0, trainable=False, name='alpha_tra')
-
-        if build_model:
-            self.build_model()
-            self.define_losses()
-            self.define_summaries()
+        # The built training graph is cached in graph_cache_dir and imported instead of being rebuilt next time
+        graph_path = self.get_graph_cache_path(graph_cache_dir) if build_model and graph_cache_dir else None
+        if graph_path and has_graph(graph_path):
+            self.import_graph(graph_path)
+        else:
+            self.dt = tf.Variable(0.0, trainable=False)
+            self.alpha_tra = tf.Variable(initial_value=0.0, trainable=False, name='alpha_tra')
+
+            if build_model:
+                self.build_model()
+                self.define_losses()
+                self.define_summaries()
+                if graph_path:
+                    self.export_graph(graph_path)
+
+    def get_graph_cache_path(self, cache_dir):
+        """The path of the cached training graph, keyed by the parameters of the graph and the code building it"""
+        params = {
+            'batch_size': self.batch_size, 'steps': self.steps, 'stage': self.stage, 'trans': self.trans,
+            'fused_step': self.fused_step, 'mixed_precision': self.mixed_precision, 'accum_steps': self.accum_steps,
+            'xla': self.xla, 'recompute': self.recompute,
+        }
+        sources = [__file__] + [sys.modules[f.__module__].__file__ for f in [conv2d, fused_step, save]]
+        name = 'pggan_stage%d%s' % (self.stage, '_t' if self.trans else '')
+        return get_graph_path(cache_dir, name, graph_key(params, sources))
+
+    def export_graph(self, path):
+        export_graph(path, {name: getattr(self, name, None) for name in GRAPH_TENSORS},
+                     {name: getattr(self, name) for name in GRAPH_SAVERS})
+        print('Exported the training graph to %s' % path)
+
+    def import_graph(self, path):
+        """Imports the cached training graph in place of build_model, define_losses and define_summaries"""
+        start_time = time.time()
+        tensors, savers = import_graph(path, GRAPH_TENSORS, GRAPH_SAVERS)
+        for name, value in list(tensors.items()) + list(savers.items()):
+            setattr(self, name, value)
+
+        self.alpha_tra = next(var for var in tf.global_variables() if var.op.name == 'alpha_tra')
+        self.d_vars = tf.trainable_variables('d_net')
+        self.g_vars = tf.trainable_variables('g_net')
+        self.checkpoint_saver = self.saver
+        if self.async_checkpoint:
+            self.checkpoint_saver = AsyncSaver(self.get_variables_up_to_stage(self.stage), max_to_keep=2)
+        print('Imported the training graph from %s in %.2f s' % (path, time.time() - start_time))
 
     def build_model(self):
         # Define the input tensor by appending the batch size dimension to the image dimension
@@ -59,16 +134,22 @@ class PGGAN(object):
         self.z_sample = tf.placeholder(tf.float32, [self.sample_num] + [self.z_dim], name='z_sample')
         self.cond_sample = tf.placeholder(tf.float32, [self.sample_num] + [self.embed_dim], name='cond_sample')
 
-        self.G, self.mean, self.log_sigma = self.generator(self.z, self.cond, stages=self.stage, t=self.trans)
+        with jit_scope(self.xla):
+            self.G, self.mean, self.log_sigma = self.generator(self.z, self.cond, stages=self.stage, t=self.trans)
+
+            self.Dg_logit = self.discriminator(self.G, self.cond, reuse=False, stages=self.stage, t=self.trans,
+                                               recompute=self.recompute)
+            self.Dx_logit = self.discriminator(self.x, self.cond, reuse=True, stages=self.stage, t=self.trans,
+                                               recompute=self.recompute)
+            self.Dxmi_logit = self.discriminator(self.x_mismatch, self.cond, reuse=True, stages=self.stage,
+                                                 t=self.trans, recompute=self.recompute)
 
-        self.Dg_logit = self.discriminator(self.G, self.cond, reuse=False, stages=self.stage, t=self.trans)
-        self.Dx_logit = self.discriminator(self.x, self.cond, reuse=True, stages=self.stage, t=self.trans)
-        self.Dxmi_logit = self.discriminator(self.x_mismatch, self.cond, reuse=True, stages=self.stage, t=self.trans)
-        
-        self.epsilon = tf.random_uniform([self.batch_size, 1, 1, 1], 0., 1.)
-        self.x_hat = self.epsilon * self.G + (1. - self.epsilon) * self.x
-        self.cond_inp = self.cond + 0.0
-        self.Dx_hat_logit = self.discriminator(self.x_hat, self.cond_inp, reuse=True, stages=self.stage, t=self.trans)
+            self.epsilon = tf.random_uniform([self.batch_size, 1, 1, 1], 0., 1.)
+            self.x_hat = self.epsilon * self.G + (1. - self.epsilon) * self.x
+            self.cond_inp = self.cond + 0.0
+            # The gradient penalty backpropagates twice through this pass, which the recomputed stages do not support
+            self.Dx_hat_logit = self.discriminator(self.x_hat, self.cond_inp, reuse=True, stages=self.stage,
+                                                   t=self.trans)
 
         self.sampler, _, _ = self.generator(self.z_sample, self.cond_sample, reuse=True, stages=self.stage,
                                             t=self.trans)
@@ -82,36 +163,54 @@ class PGGAN(object):
         show_all_variables()
 
     def get_gradient_penalty(self, x, y):
-        grad_y = tf.gradients(y, [x])[0]
+        grad_y = input_gradient(x, y, self.mixed_precision)
         slopes = tf.sqrt(tf.reduce_sum(tf.square(grad_y), reduction_indices=[1, 2, 3]))
         return tf.reduce_mean(tf.maximum(0.0, slopes - 1.) ** 2)
 
     def get_gradient_penalty2(self, x, y):
-        grad_y = tf.gradients(y, [x])[0]
+        grad_y = input_gradient(x, y, self.mixed_precision)
         slopes = tf.sqrt(tf.reduce_sum(tf.square(grad_y), reduction_indices=[1]))
         return tf.reduce_mean(tf.maximum(0.0, slopes - 1.) ** 2)
 
     def define_losses(self):
-        self.D_loss_real = tf.reduce_mean(self.Dx_logit)
-        self.D_loss_fake = tf.reduce_mean(self.Dg_logit)
-        self.D_loss_mismatch = tf.reduce_mean(self.Dxmi_logit)
-        self.wdist = self.D_loss_real - self.D_loss_fake
-        self.wdist2 = self.D_loss_real - self.D_loss_mismatch
-        self.reg_loss = tf.reduce_mean(tf.square(self.Dxmi_logit))
+        with jit_scope(self.xla):
+            self.D_loss_real = tf.reduce_mean(self.Dx_logit)
+            self.D_loss_fake = tf.reduce_mean(self.Dg_logit)
+            self.D_loss_mismatch = tf.reduce_mean(self.Dxmi_logit)
+            self.wdist = self.D_loss_real - self.D_loss_fake
+            self.wdist2 = self.D_loss_real - self.D_loss_mismatch
+            self.reg_loss = tf.reduce_mean(tf.square(self.Dxmi_logit))
+
+            self.G_kl_loss = self.kl_std_normal_loss(self.mean, self.log_sigma)
+            self.real_gp = self.get_gradient_penalty(self.x_hat, self.Dx_hat_logit)
+            self.real_gp2 = self.get_gradient_penalty2(self.cond_inp, self.Dx_hat_logit)
+
+            self.D_loss = -self.wdist - self.wdist2 + 200.0 * (self.real_gp + self.real_gp2)
+            self.G_loss = -self.D_loss_fake + 5.0 * self.G_kl_loss
+
+        self.D_optimizer = loss_scale_optimizer(tf.train.AdamOptimizer(0.000002, beta1=0.0, beta2=0.99),
+                                                self.mixed_precision)
+        self.G_optimizer = loss_scale_optimizer(tf.train.AdamOptimizer(0.000002, beta1=0.0, beta2=0.99),
+                                                self.mixed_precision)
 
-        self.G_kl_loss = self.kl_std_normal_loss(self.mean, self.log_sigma)
-        self.real_gp = self.get_gradient_penalty(self.x_hat, self.Dx_hat_logit)
-        self.real_gp2 = self.get_gradient_penalty2(self.cond_inp, self.Dx_hat_logit)
+        with tf.control_dependencies([self.alpha_assign]):
+            d_grads = self.D_optimizer.compute_gradients(self.D_loss, var_list=self.d_vars)
+            self.D_optim = self.D_optimizer.apply_gradients(d_grads)
+        g_grads = self.G_optimizer.compute_gradients(self.G_loss, var_list=self.g_vars)
+        self.G_optim = self.G_optimizer.apply_gradients(g_grads)
 
-        self.D_loss = -self.wdist - self.wdist2 + 200.0 * (self.real_gp + self.real_gp2)
-        self.G_loss = -self.D_loss_fake + 5.0 * self.G_kl_loss
+        # D and G update from a single forward pass
+        self.DG_optim = fused_step(self.D_optimizer, d_grads, self.G_optimizer, g_grads)
 
-        self.D_optimizer = tf.train.AdamOptimizer(0.000002, beta1=0.0, beta2=0.99)
-        self.G_optimizer = tf.train.AdamOptimizer(0.000002, beta1=0.0, beta2=0.99)
+        # Gradient accumulation over micro-batches. D and G are always updated simultaneously in this mode.
+        if self.accum_steps > 1:
+            d_accum, d_accum_grads, d_zero = accumulate_gradients(d_grads, self.accum_steps, name='d_grad_accum')
+            g_accum, g_accum_grads, g_zero = accumulate_gradients(g_grads, self.accum_steps, name='g_grad_accum')
+            self.DG_accum = tf.group(d_accum, g_accum)
 
-        with tf.control_dependencies([self.alpha_assign]):
-            self.D_optim = self.D_optimizer.minimize(self.D_loss, var_list=self.d_vars)
-        self.G_optim = self.G_optimizer.minimize(self.G_loss, var_list=self.g_vars)
+            DG_apply = fused_step(self.D_optimizer, d_accum_grads, self.G_optimizer, g_accum_grads)
+            with tf.control_dependencies([DG_apply]):
+                self.DG_apply = tf.group(d_zero(), g_zero())
 
         # variables to save
         vars_to_save = self.get_variables_up_to_stage(self.stage)
@@ -119,6 +218,9 @@ class PGGAN(object):
         print('\n\nVariables to save:')
         print_vars(vars_to_save)
         self.saver = tf.train.Saver(vars_to_save, max_to_keep=2)
+        self.checkpoint_saver = self.saver
+        if self.async_checkpoint:
+            self.checkpoint_saver = AsyncSaver(vars_to_save, max_to_keep=2)
 
         # variables to restore
         self.restore = None
@@ -130,13 +232,7 @@ class PGGAN(object):
             self.restore = tf.train.Saver(vars_to_restore)
 
     def define_summaries(self):
-        summaries = [
-            tf.summary.image('x', self.x),
-            tf.summary.image('G_img', self.G),
-
-            tf.summary.histogram('z', self.z),
-            tf.summary.histogram('z_sample', self.z_sample),
-
+        self.scalar_summ = tf.summary.merge([
             tf.summary.scalar('G_loss_wass', -self.D_loss_fake),
             tf.summary.scalar('kl_loss', self.G_kl_loss),
             tf.summary.scalar('G_loss', self.G_loss),
@@ -152,17 +248,30 @@ class PGGAN(object):
             tf.summary.scalar('wdist2', self.wdist2),
             tf.summary.scalar('d_loss_mismatch', self.D_loss_mismatch),
             tf.summary.scalar('real_gp2', self.real_gp2),
-        ]
-        self.summary_op = tf.summary.merge(summaries)
+        ])
+        self.expensive_summ = tf.summary.merge([
+            tf.summary.histogram('z', self.z),
+            tf.summary.histogram('z_sample', self.z_sample),
+        ])
+        self.summary_op = tf.summary.merge([self.scalar_summ, self.expensive_summ])
+
+    def get_summary_policy(self, writer):
+        if self.summary_cfg is None:
+            return SummaryPolicy(writer, scalar_period=20, expensive_period=20, flush_period=1)
+        return get_summary_policy(self.summary_cfg, writer)
 
     # do train
     def train(self):
-        config = tf.ConfigProto()
-        config.gpu_options.allow_growth = True
+        config = set_xla_jit(session_config('pggan'), self.xla)
 
         with tf.Session(config=config) as sess:
 
             summary_writer = tf.summary.FileWriter(self.log_dir, sess.graph)
+            # The image summaries and the sample grids are written by a background thread
+            artifacts = ArtifactWriter(summary_writer)
+            # The scalars and the histograms/images run on their own periods and are written in batches
+            summaries = self.get_summary_policy(summary_writer)
+            summary_ops = {SCALAR: self.scalar_summ, EXPENSIVE: self.expensive_summ}
             start_point = 0
 
             if self.stage != 1:
@@ -193,48 +302,89 @@ class PGGAN(object):
                     p = idx / self.steps
                     self.lr_inp = self.lr  # * np.exp(-2 * np.square(1 - p))
 
-                epoch_size = self.dataset.train.num_examples // self.batch_size
+                epoch_size = self.dataset.train.num_examples // (self.batch_size * self.accum_steps)
                 epoch = idx // epoch_size
-
-                images, wrong_images, embed, _, _ = self.dataset.train.next_batch(self.batch_size, 4,
-                                                                                  wrong_img=True,
-                                                                                  embeddings=True)
-                batch_z = np.random.normal(0, 1, (self.batch_size, self.z_dim))
-                eps = np.random.uniform(0., 1., size=(self.batch_size, 1, 1, 1))
-
-                feed_dict = {
-                    self.x: images,
-                    self.learning_rate: self.lr_inp,
-                    self.x_mismatch: wrong_images,
-                    self.cond: embed,
-                    self.z: batch_z,
-                    self.epsilon: eps,
-                    self.z_sample: sample_z,
-                    self.cond_sample: sample_cond,
-                    self.iter: idx,
-                }
-
-                _, err_d = sess.run([self.D_optim, self.D_loss], feed_dict=feed_dict)
-                _, err_g = sess.run([self.G_optim, self.G_loss], feed_dict=feed_dict)
+                profiler = self.profiler
+                # The generated images are written with the histograms
+                expensive = EXPENSIVE in summaries.due(idx)
+
+                if self.accum_steps > 1:
+                    # Accumulate the gradients of accum_steps micro-batches and apply them once. The summaries
+                    # are computed on the last micro-batch.
+                    err_d, err_g = 0.0, 0.0
+                    for k in range(self.accum_steps):
+                        with profiler.phase('data'):
+                            feed_dict = self.get_feed_dict(idx, sample_z, sample_cond)
+                        last = k == self.accum_steps - 1
+                        fetches = [self.DG_accum, self.D_loss, self.G_loss,
+                                   summaries.fetches(idx, summary_ops) if last else {}]
+                        if last and expensive:
+                            fetches.append(self.G)
+
+                        with profiler.phase('accum_step'):
+                            results = profiler.run(sess, fetches, feed_dict=feed_dict, step=idx)
+                        err_d += results[1] / self.accum_steps
+                        err_g += results[2] / self.accum_steps
+                        if last:
+                            with profiler.phase('summaries'):
+                                summaries.add(results[3], idx)
+                                if expensive:
+                                    artifacts.add_images('x', feed_dict[self.x], idx)
+                                    artifacts.add_images('G_img', results[4], idx)
+
+                    with profiler.phase('apply_step'):
+                        profiler.run(sess, self.DG_apply, step=idx)
+                elif self.fused_step:
+                    with profiler.phase('data'):
+                        feed_dict = self.get_feed_dict(idx, sample_z, sample_cond)
+                    # Update D and G with a single session call. The summaries are computed from the same
+                    # forward pass when they are due.
+                    fetches = [self.DG_optim, self.D_loss, self.G_loss, summaries.fetches(idx, summary_ops)]
+                    if expensive:
+                        fetches.append(self.G)
+
+                    with profiler.phase('dg_step'):
+                        results = profiler.run(sess, fetches, feed_dict=feed_dict, step=idx)
+                    err_d, err_g = results[1], results[2]
+                    with profiler.phase('summaries'):
+                        summaries.add(results[3], idx)
+                        if expensive:
+                            artifacts.add_images('x', feed_dict[self.x], idx)
+                            artifacts.add_images('G_img', results[4], idx)
+                else:
+                    with profiler.phase('data'):
+                        feed_dict = self.get_feed_dict(idx, sample_z, sample_cond)
+                    with profiler.phase('d_step'):
+                        _, err_d = profiler.run(sess, [self.D_optim, self.D_loss], feed_dict=feed_dict, step=idx)
+                    with profiler.phase('g_step'):
+                        _, err_g = profiler.run(sess, [self.G_optim, self.G_loss], feed_dict=feed_dict, step=idx)
+
+                    fetches = summaries.fetches(idx, summary_ops)
+                    if fetches:
+                        with profiler.phase('summaries'):
+                            summary_strs, g_img = sess.run([fetches, self.G if expensive else []],
+                                                           feed_dict=feed_dict)
+                            summaries.add(summary_strs, idx)
+                            if expensive:
+                                artifacts.add_images('x', feed_dict[self.x], idx)
+                                artifacts.add_images('G_img', g_img, idx)
 
                 if np.mod(idx, 20) == 0:
-                    summary_str = sess.run(self.summary_op, feed_dict=feed_dict)
-                    summary_writer.add_summary(summary_str, idx)
-
                     print("Epoch: [%2d] [%4d] time: %4.4f, d_loss: %.8f, g_loss: %.8f"
                           % (epoch, idx, time.time() - start_time, err_d, err_g))
 
                 if np.mod(idx, 2000) == 0:
                     try:
-                        samples = sess.run(self.sampler, feed_dict={
-                                                    self.z_sample: sample_z,
-                                                    self.cond_sample: sample_cond})
-                        samples = np.clip(samples, -1., 1.)
-                        if self.out_size > 256:
-                            samples = samples[:4]
+                        with profiler.phase('sampling'):
+                            samples = sess.run(self.sampler, feed_dict={
+                                                        self.z_sample: sample_z,
+                                                        self.cond_sample: sample_cond})
+                            samples = np.clip(samples, -1., 1.)
+                            if self.out_size > 256:
+                                samples = samples[:4]
 
-                        save_images(samples, get_balanced_factorization(samples.shape[0]),
-                                    '{}train_{:02d}_{:04d}.png'.format(self.sample_path, epoch, idx))
+                            artifacts.save_images(samples, get_balanced_factorization(samples.shape[0]),
+                                                  '{}train_{:02d}_{:04d}.png'.format(self.sample_path, epoch, idx))
 
                     except Exception as e:
                         print("Failed to generate sample image")
@@ -243,14 +393,45 @@ class PGGAN(object):
                         print(e)
 
                 if np.mod(idx, 2000) == 0 or idx == self.steps - 1:
-                    save(self.saver, sess, self.check_dir_write, idx)
+                    with profiler.phase('checkpoint'):
+                        save(self.checkpoint_saver, sess, self.check_dir_write, idx)
+                profiler.end_step(idx)
                 sys.stdout.flush()
 
+            # The next stage reads the last checkpoint of this stage
+            if self.async_checkpoint:
+                self.checkpoint_saver.close()
+            summaries.close()
+            artifacts.close()
+
         tf.reset_default_graph()
 
-    def discriminator(self, inp, cond, stages, t, reuse=False):
-        alpha_trans = self.alpha_tra
-        with tf.variable_scope("d_net", reuse=reuse):
+    def get_feed_dict(self, idx, sample_z, sample_cond):
+        images, wrong_images, embed, _, _ = self.dataset.train.next_batch(self.batch_size, 4,
+                                                                          wrong_img=True,
+                                                                          embeddings=True)
+        batch_z = np.random.normal(0, 1, (self.batch_size, self.z_dim))
+        eps = np.random.uniform(0., 1., size=(self.batch_size, 1, 1, 1))
+
+        return {
+            self.x: images,
+            self.learning_rate: self.lr_inp,
+            self.x_mismatch: wrong_images,
+            self.cond: embed,
+            self.z: batch_z,
+            self.epsilon: eps,
+            self.z_sample: sample_z,
+            self.cond_sample: sample_cond,
+            self.iter: idx,
+        }
+
+    def discriminator(self, inp, cond, stages, t, reuse=False, recompute=False):
+        alpha_trans = tf.cast(self.alpha_tra, self.dtype)
+        with tf.variable_scope("d_net", reuse=reuse, custom_getter=self.custom_getter,
+                               use_resource=self.recompute or None):
+            inp = tf.cast(inp, self.dtype)
+            cond = tf.cast(cond, self.dtype)
+
             x_iden = None
             if t:
                 x_iden = pool(inp, 2)
@@ -260,9 +441,7 @@ class PGGAN(object):
 
             for i in range(stages - 1, 0, -1):
                 with tf.variable_scope(self.get_conv_scope_name(i), reuse=reuse):
-                    x = conv2d(x, f=self.get_dnf(i), ks=(3, 3), s=(1, 1), act=lrelu_act())
-                    x = conv2d(x, f=self.get_dnf(i-1), ks=(3, 3), s=(1, 1), act=lrelu_act())
-                    x = pool(x, 2)
+                    x = self.checkpointed(partial(self.discriminator_block, stage=i), recompute)(x)
                 if i == stages - 1 and t:
                     x = tf.multiply(alpha_trans, x) + tf.multiply(tf.subtract(1., alpha_trans), x_iden)
 
@@ -274,18 +453,34 @@ class PGGAN(object):
                 x_b1 = conv2d(x_b1, f=self.get_dnf(0), ks=(4, 4), s=(1, 1), padding='VALID', act=lrelu_act())
                 output_b1 = fc(x_b1, units=1)
 
-            return output_b1
+            return tf.cast(output_b1, tf.float32)
 
-    def generator(self, z_var, cond_inp, stages, t, reuse=False, cond_noise=True):
-        alpha_trans = self.alpha_tra
-        with tf.variable_scope('g_net', reuse=reuse):
+    def conditionals(self, cond_inp, reuse=tf.AUTO_REUSE):
+        """
+        Builds only the embedding projection of the generator, which returns the (mean, log_sigma) of the conditioning
+        augmentation. These can be computed once per embedding and passed to the generator as cond_stats.
+        """
+        with tf.variable_scope('g_net', reuse=reuse, custom_getter=self.custom_getter):
+            with tf.variable_scope(self.get_conv_scope_name(0), reuse=reuse):
+                mean, log_sigma = self.generate_conditionals(tf.cast(cond_inp, self.dtype))
+                return tf.cast(mean, tf.float32), tf.cast(log_sigma, tf.float32)
+
+    def generator(self, z_var, cond_inp, stages, t, reuse=False, cond_noise=True, cond_epsilon=None, cond_stats=None):
+        alpha_trans = tf.cast(self.alpha_tra, self.dtype)
+        with tf.variable_scope('g_net', reuse=reuse, custom_getter=self.custom_getter,
+                               use_resource=self.recompute or None):
+            z_var = tf.cast(z_var, self.dtype)
 
             with tf.variable_scope(self.get_conv_scope_name(0), reuse=reuse):
-                mean_lr, log_sigma_lr = self.generate_conditionals(cond_inp)
-                cond = self.sample_normal_conditional(mean_lr, log_sigma_lr, cond_noise)
+                if cond_stats is None:
+                    mean_lr, log_sigma_lr = self.generate_conditionals(tf.cast(cond_inp, self.dtype))
+                else:
+                    mean_lr, log_sigma_lr = [tf.cast(stat, self.dtype) for stat in cond_stats]
+                cond = self.sample_normal_conditional(mean_lr, log_sigma_lr, cond_noise, cond_epsilon)
 
                 x = tf.concat([z_var, cond], axis=1)
-                x = fc(x, units=4*4*self.get_nf(0))
+                # Named explicitly so the variables are the same when the conditionals are not built in this scope
+                x = fc(x, units=4*4*self.get_nf(0), name='dense_2')
                 x = layer_norm(x)
                 x = tf.reshape(x, [-1, 4, 4, self.get_nf(0)])
 
@@ -302,18 +497,38 @@ class PGGAN(object):
                     x_iden = upscale(x_iden, 2)
 
                 with tf.variable_scope(self.get_conv_scope_name(i), reuse=reuse):
-                    x = upscale(x, 2)
-                    x = conv2d(x, f=self.get_nf(i), ks=(3, 3), s=(1, 1))
-                    x = layer_norm(x, act=tf.nn.relu)
-                    x = conv2d(x, f=self.get_nf(i), ks=(3, 3), s=(1, 1))
-                    x = layer_norm(x, act=tf.nn.relu)
+                    x = self.checkpointed(partial(self.generator_block, stage=i), self.recompute)(x)
 
             x = self.to_rgb(x, stages - 1)
 
             if t:
                 x = tf.multiply(tf.subtract(1., alpha_trans), x_iden) + tf.multiply(alpha_trans, x)
 
-            return x, mean_lr, log_sigma_lr
+            return tf.cast(x, tf.float32), tf.cast(mean_lr, tf.float32), tf.cast(log_sigma_lr, tf.float32)
+
+    def generator_block(self, x, stage):
+        # Same as conv2d(upscale(x, 2)), without materializing the upscaled input
+        x = upscale_conv2d(x, f=self.get_nf(stage), ks=(3, 3))
+        x = layer_norm(x, act=tf.nn.relu)
+        x = conv2d(x, f=self.get_nf(stage), ks=(3, 3), s=(1, 1))
+        return layer_norm(x, act=tf.nn.relu)
+
+    def discriminator_block(self, x, stage):
+        x = conv2d(x, f=self.get_dnf(stage), ks=(3, 3), s=(1, 1), act=lrelu_act())
+        x = conv2d(x, f=self.get_dnf(stage - 1), ks=(3, 3), s=(1, 1), act=lrelu_act())
+        return pool(x, 2)
+
+    def checkpointed(self, block, recompute):
+        """
+        Wraps a conv stage so that only its input is kept for backprop when recompute is True. The activations inside
+        the stage are recomputed from it during the backward pass, at the cost of a second forward pass of the stage.
+        Keeping one tensor per stage out of the several layers of a stage brings the activation memory close to the
+        square root of the depth. The stages are deterministic (no batch statistics or dropout), so the recomputed
+        activations are exact.
+        """
+        if not recompute:
+            return block
+        return tf.contrib.layers.recompute_grad(block)
 
     def concat_cond4(self, x, cond):
         cond_compress = tf.expand_dims(tf.expand_dims(cond, 1), 1)
@@ -352,9 +567,13 @@ class PGGAN(object):
         log_sigma = fc(embeddings, units, act=lrelu_act())
         return mean, log_sigma
 
-    def sample_normal_conditional(self, mean, log_sigma, cond_noise=True):
+    def sample_normal_conditional(self, mean, log_sigma, cond_noise=True, epsilon=None):
         if cond_noise:
-            epsilon = tf.truncated_normal(tf.shape(mean))
+            if epsilon is None:
+                epsilon = tf.truncated_normal(tf.shape(mean), dtype=mean.dtype)
+            else:
+                # Externally sampled noise, e.g. from utils.sampling for reproducible generation
+                epsilon = tf.cast(epsilon, mean.dtype)
             stddev = tf.exp(log_sigma)
             return mean + stddev * epsilon
         return mean
@@ -2,7 +2,10 @@ import tensorflow as tf
 
 from models.pggan.pggan import PGGAN
 from preprocess.dataset import TextDataset
+from preprocess.image_cache import get_image_cache
 from utils.config import config_from_yaml
+from utils.profiler import StepProfiler
+from utils.session import session_config
 import os
 
 flags = tf.app.flags
@@ -23,11 +26,16 @@ if __name__ == "__main__":
 
         cfg = config_from_yaml(FLAGS.cfg)
 
+        # Mixed precision halves the activation memory and the recomputation of the conv stages keeps only their
+        # outputs, so with either of them the high resolution stages keep the full batch size
+        recompute = cfg.TRAIN.RECOMPUTE[stage[i] - 1]
         batch_size = 16
-        if stage[i] >= 6:
+        if stage[i] >= 6 and not (cfg.TRAIN.MIXED_PRECISION or recompute):
             batch_size = 8
+        # Number of micro-batches accumulated per update. The effective batch size is accum_steps * batch_size.
+        accum_steps = cfg.TRAIN.ACCUM_STEPS[stage[i] - 1]
         images = 600000
-        max_iters = images // batch_size
+        max_iters = images // (batch_size * accum_steps)
         sample_size = 128
 
         pggan_checkpoint_dir_write = os.path.join(cfg.CHECKPOINT_DIR, 'stage%d/' % stage[i])
@@ -49,22 +57,30 @@ if __name__ == "__main__":
         if not os.path.exists(pggan_checkpoint_dir_read):
             os.makedirs(pggan_checkpoint_dir_read)
 
-        run_config = tf.ConfigProto()
-        run_config.gpu_options.allow_growth = True
+        run_config = session_config('pggan', verbose=False)
 
         datadir = cfg.DATASET_DIR
-        dataset = TextDataset(datadir, cfg.MODEL.SIZES[stage[i] - 1])
+        dataset = TextDataset(datadir, cfg.MODEL.SIZES[stage[i] - 1], embedding_dtype=cfg.EMBEDDING_DTYPE,
+                              image_cache=get_image_cache(cfg.TRAIN.IMAGE_CACHE))
 
         filename_test = '%s/test' % datadir
         dataset.test = dataset.get_data(filename_test)
 
         filename_train = '%s/train' % datadir
-        dataset.train = dataset.get_data(filename_train)
+        dataset.train = dataset.get_data(filename_train, sampling=cfg.TRAIN.SAMPLING)
+
+        profiler = StepProfiler(enabled=cfg.TRAIN.PROFILE.FLAG,
+                                trace_period=cfg.TRAIN.PROFILE.TRACE_PERIOD,
+                                log_period=cfg.TRAIN.PROFILE.LOG_PERIOD,
+                                trace_dir=os.path.join(logs_dir, 'timelines'))
 
         pggan = PGGAN(batch_size=batch_size, steps=max_iters,
                       check_dir_write=pggan_checkpoint_dir_write, check_dir_read=pggan_checkpoint_dir_read,
                       dataset=dataset, sample_path=sample_path, log_dir=logs_dir, stage=stage[i],
-                      trans=t)
+                      trans=t, fused_step=cfg.TRAIN.FUSED_STEP, mixed_precision=cfg.TRAIN.MIXED_PRECISION,
+                      accum_steps=accum_steps, async_checkpoint=cfg.TRAIN.ASYNC_CHECKPOINT, profiler=profiler,
+                      xla=cfg.TRAIN.XLA, recompute=recompute, graph_cache_dir=cfg.TRAIN.GRAPH_CACHE,
+                      summary_cfg=cfg.TRAIN.SUMMARY)
 
         pggan.train()
 
@@ -1,10 +1,14 @@
+import numpy as np
 import tensorflow as tf
 
 from models.pggan.pggan import PGGAN
 from utils.config import config_from_yaml
 from utils.utils import make_gif
-from utils.visualize import *
+from utils.visualize import gen_captioned_img, gen_cond_interp_img, gen_noise_interp_img, save_cap_batch, \
+    save_interp_cap_batch
+from preprocess.dataset import TextDataset
 from utils.saver import load
+from utils.session import session_config
 import os
 
 flags = tf.app.flags
@@ -37,8 +41,7 @@ if __name__ == "__main__":
     if not os.path.exists(samples_dir):
         os.makedirs(samples_dir)
 
-    run_config = tf.ConfigProto()
-    run_config.gpu_options.allow_growth = True
+    run_config = session_config('pggan', verbose=False)
 
     pggan = PGGAN(batch_size=batch_size, steps=None, check_dir_write=None, check_dir_read=pggan_checkpoint_dir_read,
                   dataset=dataset, sample_path=None, log_dir=None, stage=stage, trans=False, build_model=False)
@@ -48,8 +51,7 @@ if __name__ == "__main__":
     gen_op, _, _ = pggan.generator(z, cond, stages=stage, t=False)
     gen_no_noise, _, _ = pggan.generator(z, cond, stages=stage, t=False, cond_noise=False, reuse=True)
 
-    config = tf.ConfigProto()
-    config.gpu_options.allow_growth = True
+    config = session_config('pggan')
 
     with tf.Session(config=config) as sess:
         saver = tf.train.Saver(tf.global_variables('g_net'))
@@ -1,9 +1,12 @@
+import numpy as np
 import tensorflow as tf
 
 from models.pggan.pggan import PGGAN
 from utils.config import config_from_yaml
-from utils.visualize import *
+from utils.visualize import gen_pggan_sample, save_cap_batch
+from preprocess.dataset import TextDataset
 from utils.saver import load
+from utils.session import session_config
 import os
 
 flags = tf.app.flags
@@ -47,8 +50,7 @@ if __name__ == "__main__":
         if not os.path.exists(pggan_checkpoint_dir_read):
             os.makedirs(pggan_checkpoint_dir_read)
 
-        run_config = tf.ConfigProto()
-        run_config.gpu_options.allow_growth = True
+        run_config = session_config('pggan', verbose=False)
 
         pggan = PGGAN(batch_size=batch_size, steps=None, check_dir_write=None,
                       check_dir_read=pggan_checkpoint_dir_read,
@@ -58,8 +60,7 @@ if __name__ == "__main__":
         z = tf.placeholder(tf.float32, [None, z_dim], name='z')
         gen_op, _, _ = pggan.generator(z, cond, stages=stage[i], t=False)
 
-        config = tf.ConfigProto()
-        config.gpu_options.allow_growth = True
+        config = session_config('pggan')
 
         with tf.Session(config=config) as sess:
             saver = tf.train.Saver(tf.global_variables('g_net'))
@@ -1,5 +1,6 @@
 import tensorflow as tf
-from utils.ops import batch_norm, conv2d, conv2d_transpose
+from utils.ops import batch_norm, conv2d, conv2d_transpose, get_compute_dtype, get_variable_getter, get_data_format, \
+    to_data_format, from_data_format, dense_to_feature_map, concat_cond
 
 
 class ConditionalGan(object):
@@ -25,7 +26,14 @@ class ConditionalGan(object):
         self.df_dim = cfg.MODEL.DF_DIM
         
         self.image_dims = [cfg.MODEL.IMAGE_SHAPE.H, cfg.MODEL.IMAGE_SHAPE.W, cfg.MODEL.IMAGE_SHAPE.D]
-        
+        # Data format of the convolutions. The images in and out of the networks are always NHWC.
+        self.df = get_data_format(cfg.MODEL.DATA_FORMAT)
+
+        # Mixed precision: float16 compute with float32 master weights
+        self.mixed_precision = cfg.TRAIN.MIXED_PRECISION
+        self.dtype = get_compute_dtype(self.mixed_precision)
+        self.custom_getter = get_variable_getter(self.mixed_precision)
+
         self.w_init = tf.random_normal_initializer(stddev=0.02)
         self.batch_norm_init = {
             'gamma': tf.random_normal_initializer(1., 0.02),
@@ -66,9 +74,13 @@ class ConditionalGan(object):
                                     activation=lrelu, kernel_initializer=self.w_init)
         return mean, log_sigma
 
-    def sample_normal_conditional(self, mean, log_sigma, cond_noise=True):
+    def sample_normal_conditional(self, mean, log_sigma, cond_noise=True, epsilon=None):
         if cond_noise:
-            epsilon = tf.truncated_normal(tf.shape(mean))
+            if epsilon is None:
+                epsilon = tf.truncated_normal(tf.shape(mean), dtype=mean.dtype)
+            else:
+                # Externally sampled noise, e.g. from utils.sampling for reproducible generation
+                epsilon = tf.cast(epsilon, mean.dtype)
             stddev = tf.exp(log_sigma)
             return mean + stddev * epsilon
         return mean
@@ -77,23 +89,26 @@ class ConditionalGan(object):
         s16 = self.output_size / 16
         lrelu = lambda l: tf.nn.leaky_relu(l, 0.2)
         
-        with tf.variable_scope("d_net", reuse=reuse):
-            net_ho = conv2d(inputs, self.df_dim, ks=(4, 4), s=(2, 2), act=lrelu, init=self.w_init)
-            net_h1 = conv2d(net_ho, self.df_dim * 2, ks=(4, 4), s=(2, 2), init=self.w_init)
-            net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init, act=lrelu)
-            net_h2 = conv2d(net_h1, self.df_dim * 4, ks=(4, 4), s=(2, 2), init=self.w_init)
-            net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init, act=lrelu)
-            net_h3 = conv2d(net_h2, self.df_dim * 8, ks=(4, 4), s=(2, 2), init=self.w_init)
-            net_h3 = batch_norm(net_h3, train=is_training, init=self.batch_norm_init)
+        with tf.variable_scope("d_net", reuse=reuse, custom_getter=self.custom_getter):
+            inputs = tf.cast(to_data_format(inputs, self.df), self.dtype)
+            embed = tf.cast(embed, self.dtype)
+
+            net_ho = conv2d(inputs, self.df_dim, ks=(4, 4), s=(2, 2), act=lrelu, init=self.w_init, df=self.df)
+            net_h1 = conv2d(net_ho, self.df_dim * 2, ks=(4, 4), s=(2, 2), init=self.w_init, df=self.df)
+            net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
+            net_h2 = conv2d(net_h1, self.df_dim * 4, ks=(4, 4), s=(2, 2), init=self.w_init, df=self.df)
+            net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
+            net_h3 = conv2d(net_h2, self.df_dim * 8, ks=(4, 4), s=(2, 2), init=self.w_init, df=self.df)
+            net_h3 = batch_norm(net_h3, train=is_training, init=self.batch_norm_init, df=self.df)
             # --------------------------------------------------------
 
             # Residual layer
-            net = conv2d(net_h3, self.df_dim * 2, ks=(1, 1), s=(1, 1), padding='valid', init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=lrelu)
-            net = conv2d(net, self.df_dim * 2, ks=(3, 3), s=(1, 1), init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=lrelu)
-            net = conv2d(net, self.df_dim * 8, ks=(3, 3), s=(1, 1), init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init)
+            net = conv2d(net_h3, self.df_dim * 2, ks=(1, 1), s=(1, 1), padding='valid', init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
+            net = conv2d(net, self.df_dim * 2, ks=(3, 3), s=(1, 1), init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
+            net = conv2d(net, self.df_dim * 8, ks=(3, 3), s=(1, 1), init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, df=self.df)
             net_h4 = tf.add(net_h3, net)
             net_h4 = tf.nn.leaky_relu(net_h4, 0.2)
             # --------------------------------------------------------
@@ -102,72 +117,89 @@ class ConditionalGan(object):
             net_embed = tf.layers.dense(embed, units=self.compressed_embed_dim, activation=lrelu)
 
             # Append embeddings in depth
-            net_embed = tf.expand_dims(tf.expand_dims(net_embed, 1), 1)
-            net_embed = tf.tile(net_embed, [1, 4, 4, 1])
-            net_h4_concat = tf.concat([net_h4, net_embed], 3)
+            net_h4_concat = concat_cond(net_h4, net_embed, df=self.df)
 
-            net_h4 = conv2d(net_h4_concat, self.df_dim * 8, ks=(1, 1), s=(1, 1), padding='valid', init=self.w_init)
-            net_h4 = batch_norm(net_h4, train=is_training, init=self.batch_norm_init, act=lrelu)
+            net_h4 = conv2d(net_h4_concat, self.df_dim * 8, ks=(1, 1), s=(1, 1), padding='valid', init=self.w_init,
+                            df=self.df)
+            net_h4 = batch_norm(net_h4, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
 
-            net_logits = conv2d(net_h4, 1, ks=(s16, s16), s=(s16, s16), padding='valid', init=self.w_init)
+            net_logits = conv2d(net_h4, 1, ks=(s16, s16), s=(s16, s16), padding='valid', init=self.w_init, df=self.df)
+            net_logits = tf.cast(net_logits, tf.float32)
             return tf.nn.sigmoid(net_logits), net_logits
 
-    def generator(self, z, embed, is_training=True, reuse=False, cond_noise=True):
+    def conditionals(self, embed, reuse=tf.AUTO_REUSE):
+        """
+        Builds only the embedding projection of the generator, which returns the (mean, log_sigma) of the conditioning
+        augmentation. These can be computed once per embedding and passed to the generator as cond_stats.
+        """
+        with tf.variable_scope("g_net", reuse=reuse, custom_getter=self.custom_getter):
+            mean, log_sigma = self.generate_conditionals(tf.cast(embed, self.dtype))
+            return tf.cast(mean, tf.float32), tf.cast(log_sigma, tf.float32)
+
+    def generator(self, z, embed, is_training=True, reuse=False, cond_noise=True, cond_epsilon=None,
+                  cond_stats=None):
         s = self.output_size
         s2, s4, s8, s16 = int(s / 2), int(s / 4), int(s / 8), int(s / 16)
 
-        with tf.variable_scope("g_net", reuse=reuse):
+        with tf.variable_scope("g_net", reuse=reuse, custom_getter=self.custom_getter):
+            z = tf.cast(z, self.dtype)
+
             # Sample from the multivariate normal distribution of the embeddings
-            mean, log_sigma = self.generate_conditionals(embed)
-            net_embed = self.sample_normal_conditional(mean, log_sigma, cond_noise)
+            if cond_stats is None:
+                mean, log_sigma = self.generate_conditionals(tf.cast(embed, self.dtype))
+            else:
+                mean, log_sigma = [tf.cast(stat, self.dtype) for stat in cond_stats]
+            net_embed = self.sample_normal_conditional(mean, log_sigma, cond_noise, cond_epsilon)
             # --------------------------------------------------------
 
             # Concatenate the sampled embedding with the z vector
             net_input = tf.concat([z, net_embed], 1)
+            # Named explicitly so the variables are the same when the conditionals are not built in this scope
             net_h0 = tf.layers.dense(net_input, units=self.gf_dim*8*s16*s16, activation=None,
-                                     kernel_initializer=self.w_init)
-            net_h0 = batch_norm(net_h0, train=is_training, init=self.batch_norm_init, act=None)
-            net_h0 = tf.reshape(net_h0, [-1, s16, s16, self.gf_dim * 8])
+                                     kernel_initializer=self.w_init, name='dense_2')
+            net_h0 = batch_norm(net_h0, train=is_training, init=self.batch_norm_init, act=None, df=self.df)
+            net_h0 = dense_to_feature_map(net_h0, s16, s16, self.gf_dim * 8, df=self.df)
 
             # Residual layer
-            net = conv2d(net_h0, self.gf_dim * 2, ks=(1, 1), s=(1, 1), padding='valid',  init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
-            net = conv2d(net, self.gf_dim * 2, ks=(3, 3), s=(1, 1),  init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
-            net = conv2d(net, self.gf_dim * 8, ks=(3, 3), s=(1, 1), padding='same',  init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=None)
+            net = conv2d(net_h0, self.gf_dim * 2, ks=(1, 1), s=(1, 1), padding='valid',  init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
+            net = conv2d(net, self.gf_dim * 2, ks=(3, 3), s=(1, 1),  init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
+            net = conv2d(net, self.gf_dim * 8, ks=(3, 3), s=(1, 1), padding='same',  init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=None, df=self.df)
             net_h1 = tf.add(net_h0, net)
             net_h1 = tf.nn.relu(net_h1)
             # --------------------------------------------------------
 
-            net_h2 = conv2d_transpose(net_h1, self.gf_dim*4, ks=(4, 4), s=(2, 2),  init=self.w_init)
-            net_h2 = conv2d(net_h2, self.gf_dim*4, ks=(3, 3), s=(1, 1),  init=self.w_init)
-            net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init, act=None)
+            net_h2 = conv2d_transpose(net_h1, self.gf_dim*4, ks=(4, 4), s=(2, 2),  init=self.w_init, df=self.df)
+            net_h2 = conv2d(net_h2, self.gf_dim*4, ks=(3, 3), s=(1, 1),  init=self.w_init, df=self.df)
+            net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init, act=None, df=self.df)
             # --------------------------------------------------------
 
             # Residual layer
-            net = conv2d(net_h2, self.gf_dim, ks=(1, 1), s=(1, 1), padding='valid', init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
-            net = conv2d(net, self.gf_dim, ks=(3, 3), s=(1, 1),  init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
-            net = conv2d(net, self.gf_dim*4, ks=(3, 3), s=(1, 1),  init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=None)
+            net = conv2d(net_h2, self.gf_dim, ks=(1, 1), s=(1, 1), padding='valid', init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
+            net = conv2d(net, self.gf_dim, ks=(3, 3), s=(1, 1),  init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
+            net = conv2d(net, self.gf_dim*4, ks=(3, 3), s=(1, 1),  init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=None, df=self.df)
             net_h3 = tf.add(net_h2, net)
             net_h3 = tf.nn.relu(net_h3)
             # --------------------------------------------------------
 
-            net_h4 = conv2d_transpose(net_h3, self.gf_dim*2, ks=(4, 4), s=(2, 2), init=self.w_init)
-            net_h4 = conv2d(net_h4, self.gf_dim*2, ks=(3, 3), s=(1, 1), init=self.w_init)
-            net_h4 = batch_norm(net_h4, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
+            net_h4 = conv2d_transpose(net_h3, self.gf_dim*2, ks=(4, 4), s=(2, 2), init=self.w_init, df=self.df)
+            net_h4 = conv2d(net_h4, self.gf_dim*2, ks=(3, 3), s=(1, 1), init=self.w_init, df=self.df)
+            net_h4 = batch_norm(net_h4, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
 
-            net_h5 = conv2d_transpose(net_h4, self.gf_dim, ks=(4, 4), s=(2, 2),  init=self.w_init)
-            net_h5 = conv2d(net_h5, self.gf_dim, ks=(3, 3), s=(1, 1),  init=self.w_init)
-            net_h5 = batch_norm(net_h5, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
+            net_h5 = conv2d_transpose(net_h4, self.gf_dim, ks=(4, 4), s=(2, 2),  init=self.w_init, df=self.df)
+            net_h5 = conv2d(net_h5, self.gf_dim, ks=(3, 3), s=(1, 1),  init=self.w_init, df=self.df)
+            net_h5 = batch_norm(net_h5, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
 
-            net_logits = conv2d_transpose(net_h5, self.image_dims[-1], ks=(4, 4), s=(2, 2),  init=self.w_init)
-            net_logits = conv2d(net_logits, self.image_dims[-1], ks=(3, 3), s=(1, 1),  init=self.w_init)
+            net_logits = conv2d_transpose(net_h5, self.image_dims[-1], ks=(4, 4), s=(2, 2),  init=self.w_init,
+                                          df=self.df)
+            net_logits = conv2d(net_logits, self.image_dims[-1], ks=(3, 3), s=(1, 1),  init=self.w_init, df=self.df)
 
-            net_output = tf.nn.tanh(net_logits)
-            return net_output, mean, log_sigma
+            net_output = from_data_format(tf.nn.tanh(net_logits), self.df)
+            return tf.cast(net_output, tf.float32), tf.cast(mean, tf.float32), tf.cast(log_sigma, tf.float32)
 
 
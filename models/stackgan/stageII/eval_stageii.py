@@ -5,6 +5,7 @@ from preprocess.dataset import TextDataset
 import tensorflow as tf
 import numpy as np
 from evaluation import fid, inception_score
+from evaluation.shards import ShardedImages, has_shards
 from models.inception.model import load_inception_inference
 import os
 
@@ -19,10 +20,10 @@ class StageIIEval(object):
 
     def evaluate_fid(self):
         incep_batch_size = self.cfg.EVAL.INCEP_BATCH_SIZE
-        _, layers = load_inception_inference(self.sess, 20, incep_batch_size,
+        _, layers = load_inception_inference(self.sess, 20, None,
                                              self.cfg.EVAL.INCEP_CHECKPOINT_DIR)
         pool3 = layers['PreLogits']
-        act_op = tf.reshape(pool3, shape=[incep_batch_size, -1])
+        act_op = tf.reshape(pool3, shape=[-1, 2048])
 
         if not os.path.exists(self.cfg.EVAL.ACT_STAT_PATH):
             print('Computing activation statistics for real x')
@@ -34,31 +35,37 @@ class StageIIEval(object):
         mu_real = stats['mu']
         sigma_real = stats['sigma']
 
-        z = tf.placeholder(tf.float32, [self.bs, self.model.z_dim], name='real_images')
-        cond = tf.placeholder(tf.float32, [self.bs] + [self.model.embed_dim], name='cond')
-        eval_gen, _, _ = self.model.generator(z, cond, reuse=False)
-
-        saver = tf.train.Saver(tf.global_variables('g_net'))
-        could_load, _ = load(saver, self.sess, self.cfg.CHECKPOINT_DIR)
-        if could_load:
-            print(" [*] Load SUCCESS")
+        shard_dir = self.cfg.EVAL.SHARD_DIR
+        if has_shards(shard_dir):
+            print('Loading the generated x from %s' % shard_dir)
+            samples = ShardedImages(shard_dir)
         else:
-            print(" [!] Load failed...")
-            raise RuntimeError('Could not load the checkpoints of the generator')
+            z = tf.placeholder(tf.float32, [None, self.model.z_dim], name='real_images')
+            cond = tf.placeholder(tf.float32, [None] + [self.model.embed_dim], name='cond')
+            eval_gen, _, _ = self.model.generator(z, cond, reuse=False)
 
-        print('Generating batches...')
+            saver = tf.train.Saver(tf.global_variables('g_net'))
+            could_load, _ = load(saver, self.sess, self.cfg.CHECKPOINT_DIR)
+            if could_load:
+                print(" [*] Load SUCCESS")
+            else:
+                print(" [!] Load failed...")
+                raise RuntimeError('Could not load the checkpoints of the generator')
 
-        fid_size = self.cfg.EVAL.SIZE
-        n_batches = fid_size // self.bs
+            print('Generating batches...')
 
-        w, h, c = self.model.image_dims[0], self.model.image_dims[1], self.model.image_dims[2]
-        # Evaluate each bach on inception dynamically to avoid getting out of memory
-        for i in range(n_batches):
-            sample_z = np.random.normal(0, 1, size=(self.bs, self.model.z_dim))
-            images, _, embed, _, _ = self.dataset.test.next_batch(self.bs, 4, embeddings=True)
+            fid_size = self.cfg.EVAL.SIZE
+            n_batches = int(np.ceil(fid_size / self.bs))
 
-            samples = denormalize_images(self.sess.run(eval_gen, feed_dict={z: sample_z, cond: embed}))
+            w, h, c = self.model.image_dims[0], self.model.image_dims[1], self.model.image_dims[2]
+            # Evaluate each bach on inception dynamically to avoid getting out of memory
+            for i in range(n_batches):
+                # The generator accepts any batch size, so the last batch holds the remaining samples
+                bs = min(self.bs, fid_size - i * self.bs)
+                sample_z = np.random.normal(0, 1, size=(bs, self.model.z_dim))
+                images, _, embed, _, _ = self.dataset.test.next_batch(bs, 4, embeddings=True)
 
+                samples = denormalize_images(self.sess.run(eval_gen, feed_dict={z: sample_z, cond: embed}))
 
         print('Computing activation statistics for generated x...')
         mu_gen, sigma_gen = fid.calculate_activation_statistics(samples, self.sess, incep_batch_size, act_op,
@@ -74,12 +81,23 @@ class StageIIEval(object):
 
     def evaluate_inception(self):
         incep_batch_size = self.cfg.EVAL.INCEP_BATCH_SIZE
-        logits, _ = load_inception_inference(self.sess, self.cfg.EVAL.NUM_CLASSES, incep_batch_size,
+        logits, _ = load_inception_inference(self.sess, self.cfg.EVAL.NUM_CLASSES, None,
                                              self.cfg.EVAL.INCEP_CHECKPOINT_DIR)
         pred_op = tf.nn.softmax(logits)
 
-        z = tf.placeholder(tf.float32, [self.bs, self.model.stagei.z_dim], name='z')
-        cond = tf.placeholder(tf.float32, [self.bs] + [self.model.stagei.embed_dim], name='cond')
+        shard_dir = self.cfg.EVAL.SHARD_DIR
+        if has_shards(shard_dir):
+            print('Loading the generated x from %s' % shard_dir)
+            samples = ShardedImages(shard_dir)
+
+            print('Computing inception score...')
+            mean, std = inception_score.get_inception_score(samples, self.sess, incep_batch_size, 10, pred_op,
+                                                            verbose=True)
+            print('Inception Score | mean:', "%.2f" % mean, 'std:', "%.2f" % std)
+            return
+
+        z = tf.placeholder(tf.float32, [None, self.model.stagei.z_dim], name='z')
+        cond = tf.placeholder(tf.float32, [None] + [self.model.stagei.embed_dim], name='cond')
         stagei_gen, _, _ = self.model.stagei.generator(z, cond, reuse=False, is_training=False)
         eval_gen, _, _ = self.model.generator(stagei_gen, cond, reuse=False, is_training=False)
 
@@ -102,21 +120,23 @@ class StageIIEval(object):
         print('Generating batches...')
 
         size = self.cfg.EVAL.SIZE
-        n_batches = size // self.bs
+        n_batches = int(np.ceil(size / self.bs))
 
         all_preds = []
         for i in range(n_batches):
             print("\rGenerating batch %d/%d" % (i + 1, n_batches), end="", flush=True)
 
-            sample_z = np.random.normal(0, 1, size=(self.bs, self.model.z_dim))
-            _, _, embed, _, _ = self.dataset.test.next_batch(self.bs, 4, embeddings=True)
+            # The generator and Inception accept any batch size, so the last batch holds the remaining samples
+            bs = min(self.bs, size - i * self.bs)
+            sample_z = np.random.normal(0, 1, size=(bs, self.model.z_dim))
+            _, _, embed, _, _ = self.dataset.test.next_batch(bs, 4, embeddings=True)
 
             # Generate a batch and scale it up for inception
             gen_batch = self.sess.run(eval_gen, feed_dict={z: sample_z, cond: embed})
 
             samples = denormalize_images(gen_batch)
-            incep_samples = np.empty((self.bs, 299, 299, 3))
-            for sample_idx in range(self.bs):
+            incep_samples = np.empty((bs, 299, 299, 3))
+            for sample_idx in range(bs):
                 incep_samples[sample_idx] = prep_incep_img(samples[sample_idx])
 
             # Run prediction for current batch
@@ -1,7 +1,8 @@
 import tensorflow as tf
 
 from models.stackgan.stageI.model import ConditionalGan as StageI
-from utils.ops import batch_norm, conv2d, conv2d_transpose
+from utils.ops import batch_norm, conv2d, conv2d_transpose, get_compute_dtype, get_variable_getter, get_data_format, \
+    to_data_format, from_data_format, concat_cond
 
 
 class ConditionalGan(object):
@@ -28,7 +29,14 @@ class ConditionalGan(object):
         self.df_dim = cfg.MODEL.DF_DIM
         
         self.image_dims = [cfg.MODEL.IMAGE_SHAPE.H, cfg.MODEL.IMAGE_SHAPE.W, cfg.MODEL.IMAGE_SHAPE.D]
-        
+        # Data format of the convolutions. The images in and out of the networks are always NHWC.
+        self.df = get_data_format(cfg.MODEL.DATA_FORMAT)
+
+        # Mixed precision: float16 compute with float32 master weights
+        self.mixed_precision = cfg.TRAIN.MIXED_PRECISION
+        self.dtype = get_compute_dtype(self.mixed_precision)
+        self.custom_getter = get_variable_getter(self.mixed_precision)
+
         self.w_init = tf.random_normal_initializer(stddev=0.02)
         self.batch_norm_init = {
             'gamma': tf.random_normal_initializer(1., 0.02),
@@ -68,9 +76,13 @@ class ConditionalGan(object):
                                     activation=lambda l: tf.nn.leaky_relu(l, 0.2), kernel_initializer=self.w_init)
         return mean, log_sigma
 
-    def sample_normal_conditional(self, mean, log_sigma, cond_noise):
+    def sample_normal_conditional(self, mean, log_sigma, cond_noise, epsilon=None):
         if cond_noise:
-            epsilon = tf.truncated_normal(tf.shape(mean))
+            if epsilon is None:
+                epsilon = tf.truncated_normal(tf.shape(mean), dtype=mean.dtype)
+            else:
+                # Externally sampled noise, e.g. from utils.sampling for reproducible generation
+                epsilon = tf.cast(epsilon, mean.dtype)
             stddev = tf.exp(log_sigma)
             return mean + stddev * epsilon
         return mean
@@ -79,40 +91,43 @@ class ConditionalGan(object):
         s16 = self.output_size // 64
         lrelu = lambda l: tf.nn.leaky_relu(l, 0.2)
 
-        with tf.variable_scope("stageII_d_net", reuse=reuse):
-            net_ho = conv2d(inputs, self.df_dim, ks=(4, 4), s=(2, 2), act=lrelu, init=self.w_init)
+        with tf.variable_scope("stageII_d_net", reuse=reuse, custom_getter=self.custom_getter):
+            inputs = tf.cast(to_data_format(inputs, self.df), self.dtype)
+            embed = tf.cast(embed, self.dtype)
+
+            net_ho = conv2d(inputs, self.df_dim, ks=(4, 4), s=(2, 2), act=lrelu, init=self.w_init, df=self.df)
 
-            net_h1 = conv2d(net_ho, self.df_dim * 2, ks=(4, 4), s=(2, 2), init=self.w_init)
-            net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init, act=lrelu)
+            net_h1 = conv2d(net_ho, self.df_dim * 2, ks=(4, 4), s=(2, 2), init=self.w_init, df=self.df)
+            net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
 
-            net_h2 = conv2d(net_h1, self.df_dim * 4, ks=(4, 4), s=(2, 2), init=self.w_init)
-            net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init, act=lrelu)
+            net_h2 = conv2d(net_h1, self.df_dim * 4, ks=(4, 4), s=(2, 2), init=self.w_init, df=self.df)
+            net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
 
-            net_h3 = conv2d(net_h2, self.df_dim * 8, ks=(4, 4), s=(2, 2), init=self.w_init)
-            net_h3 = batch_norm(net_h3, train=is_training, init=self.batch_norm_init, act=lrelu)
+            net_h3 = conv2d(net_h2, self.df_dim * 8, ks=(4, 4), s=(2, 2), init=self.w_init, df=self.df)
+            net_h3 = batch_norm(net_h3, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
 
-            net_h4 = conv2d(net_h3, self.df_dim * 16, ks=(4, 4), s=(2, 2), init=self.w_init)
-            net_h4 = batch_norm(net_h4, train=is_training, init=self.batch_norm_init, act=lrelu)
+            net_h4 = conv2d(net_h3, self.df_dim * 16, ks=(4, 4), s=(2, 2), init=self.w_init, df=self.df)
+            net_h4 = batch_norm(net_h4, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
 
-            net_h5 = conv2d(net_h4, self.df_dim * 32, ks=(4, 4), s=(2, 2), init=self.w_init)
-            net_h5 = batch_norm(net_h5, train=is_training, init=self.batch_norm_init, act=lrelu)
+            net_h5 = conv2d(net_h4, self.df_dim * 32, ks=(4, 4), s=(2, 2), init=self.w_init, df=self.df)
+            net_h5 = batch_norm(net_h5, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
 
-            net_h6 = conv2d(net_h5, self.df_dim * 16, ks=(4, 4), s=(1, 1), init=self.w_init)
-            net_h6 = batch_norm(net_h6, train=is_training, init=self.batch_norm_init, act=lrelu)
+            net_h6 = conv2d(net_h5, self.df_dim * 16, ks=(4, 4), s=(1, 1), init=self.w_init, df=self.df)
+            net_h6 = batch_norm(net_h6, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
 
-            net_h7 = conv2d(net_h6, self.df_dim * 8, ks=(4, 4), s=(1, 1), init=self.w_init)
-            net_h7 = batch_norm(net_h7, train=is_training, init=self.batch_norm_init)
+            net_h7 = conv2d(net_h6, self.df_dim * 8, ks=(4, 4), s=(1, 1), init=self.w_init, df=self.df)
+            net_h7 = batch_norm(net_h7, train=is_training, init=self.batch_norm_init, df=self.df)
             # --------------------------------------------------------
 
             # Residual layer
-            net = conv2d(net_h7, self.df_dim * 2, ks=(1, 1), s=(1, 1), init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=lrelu)
+            net = conv2d(net_h7, self.df_dim * 2, ks=(1, 1), s=(1, 1), init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
 
-            net = conv2d(net, self.df_dim * 2, ks=(3, 3), s=(1, 1), init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=lrelu)
+            net = conv2d(net, self.df_dim * 2, ks=(3, 3), s=(1, 1), init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
 
-            net = conv2d(net, self.df_dim * 8, ks=(3, 3), s=(1, 1), init=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init)
+            net = conv2d(net, self.df_dim * 8, ks=(3, 3), s=(1, 1), init=self.w_init, df=self.df)
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, df=self.df)
 
             net_h8 = tf.add(net, net)
             net_h8 = tf.nn.leaky_relu(net_h8, 0.2)
@@ -122,83 +137,94 @@ class ConditionalGan(object):
             net_embed = tf.layers.dense(inputs=embed, units=self.compressed_embed_dim, activation=lrelu)
 
             # Append embeddings in depth
-            net_embed = tf.expand_dims(tf.expand_dims(net_embed, 1), 1)
-            net_embed = tf.tile(net_embed, [1, s16, s16, 1])
-            net_h8_concat = tf.concat([net_h8, net_embed], 3)
+            net_h8_concat = concat_cond(net_h8, net_embed, df=self.df)
 
-            net_h9 = conv2d(net_h8_concat, self.df_dim * 8, ks=(1, 1), s=(1, 1), init=self.w_init)
-            net_h9 = batch_norm(net_h9, train=is_training, init=self.batch_norm_init, act=lrelu)
+            net_h9 = conv2d(net_h8_concat, self.df_dim * 8, ks=(1, 1), s=(1, 1), init=self.w_init, df=self.df)
+            net_h9 = batch_norm(net_h9, train=is_training, init=self.batch_norm_init, act=lrelu, df=self.df)
 
-            net_logits = conv2d(net_h9, 1, ks=(s16, s16), s=(s16, s16), init=self.w_init)
+            net_logits = conv2d(net_h9, 1, ks=(s16, s16), s=(s16, s16), init=self.w_init, df=self.df)
+            net_logits = tf.cast(net_logits, tf.float32)
             return tf.nn.sigmoid(net_logits), net_logits
 
     def generator_encode_image(self, image, is_training=True):
-        net_h0 = conv2d(image, self.gf_dim, ks=(3, 3), s=(1, 1), act=tf.nn.relu)
+        net_h0 = conv2d(image, self.gf_dim, ks=(3, 3), s=(1, 1), act=tf.nn.relu, df=self.df)
 
-        net_h1 = conv2d(net_h0, self.gf_dim * 2, ks=(4, 4), s=(2, 2))
-        net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
+        net_h1 = conv2d(net_h0, self.gf_dim * 2, ks=(4, 4), s=(2, 2), df=self.df)
+        net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
 
-        output_tensor = conv2d(net_h1, self.gf_dim * 4, ks=(4, 4), s=(2, 2))
-        output_tensor = batch_norm(output_tensor, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
+        output_tensor = conv2d(net_h1, self.gf_dim * 4, ks=(4, 4), s=(2, 2), df=self.df)
+        output_tensor = batch_norm(output_tensor, train=is_training, init=self.batch_norm_init, act=tf.nn.relu,
+                                   df=self.df)
 
         return output_tensor
 
     def generator_residual_layer(self, input_layer, is_training=True):
         net_h0 = input_layer
 
-        net_h1 = conv2d(net_h0, self.gf_dim * 4, ks=(4, 4), s=(1, 1))
-        net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
+        net_h1 = conv2d(net_h0, self.gf_dim * 4, ks=(4, 4), s=(1, 1), df=self.df)
+        net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
 
-        net_h2 = conv2d(net_h1, self.gf_dim * 4, ks=(4, 4), s=(1, 1))
-        net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init)
+        net_h2 = conv2d(net_h1, self.gf_dim * 4, ks=(4, 4), s=(1, 1), df=self.df)
+        net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init, df=self.df)
 
         return tf.nn.relu(tf.add(net_h0, net_h2))
 
     def generator_upsample(self, input_layer, is_training=True):
-        net_h0 = conv2d_transpose(input_layer, self.gf_dim * 2, ks=(4, 4), init=self.w_init)
-        net_h0 = conv2d(net_h0, self.gf_dim * 2, ks=(3, 3), s=(1, 1))
-        net_h0 = batch_norm(net_h0, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
+        net_h0 = conv2d_transpose(input_layer, self.gf_dim * 2, ks=(4, 4), init=self.w_init, df=self.df)
+        net_h0 = conv2d(net_h0, self.gf_dim * 2, ks=(3, 3), s=(1, 1), df=self.df)
+        net_h0 = batch_norm(net_h0, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
 
-        net_h1 = conv2d_transpose(net_h0, self.gf_dim, ks=(4, 4), init=self.w_init)
-        net_h1 = conv2d(net_h1, self.gf_dim, ks=(3, 3), s=(1, 1))
-        net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
+        net_h1 = conv2d_transpose(net_h0, self.gf_dim, ks=(4, 4), init=self.w_init, df=self.df)
+        net_h1 = conv2d(net_h1, self.gf_dim, ks=(3, 3), s=(1, 1), df=self.df)
+        net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
 
-        net_h2 = conv2d_transpose(net_h1, self.gf_dim // 2, ks=(4, 4), init=self.w_init)
-        net_h2 = conv2d(net_h2, self.gf_dim // 2, ks=(3, 3), s=(1, 1))
-        net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
+        net_h2 = conv2d_transpose(net_h1, self.gf_dim // 2, ks=(4, 4), init=self.w_init, df=self.df)
+        net_h2 = conv2d(net_h2, self.gf_dim // 2, ks=(3, 3), s=(1, 1), df=self.df)
+        net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
 
-        net_h3 = conv2d_transpose(net_h2, self.gf_dim // 4, ks=(4, 4), init=self.w_init)
-        net_h3 = conv2d(net_h3, self.gf_dim // 4, ks=(3, 3), s=(1, 1))
-        net_h3 = batch_norm(net_h3, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
+        net_h3 = conv2d_transpose(net_h2, self.gf_dim // 4, ks=(4, 4), init=self.w_init, df=self.df)
+        net_h3 = conv2d(net_h3, self.gf_dim // 4, ks=(3, 3), s=(1, 1), df=self.df)
+        net_h3 = batch_norm(net_h3, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
 
-        return conv2d(net_h3, self.image_dims[-1], ks=(3, 3), s=(1, 1), act=tf.nn.tanh)
+        return conv2d(net_h3, self.image_dims[-1], ks=(3, 3), s=(1, 1), act=tf.nn.tanh, df=self.df)
+
+    def conditionals(self, embed, reuse=tf.AUTO_REUSE):
+        """
+        Builds only the embedding projection of the generator, which returns the (mean, log_sigma) of the conditioning
+        augmentation. These can be computed once per embedding and passed to the generator as cond_stats.
+        """
+        with tf.variable_scope("stageII_g_net", reuse=reuse, custom_getter=self.custom_getter):
+            mean, log_sigma = self.generate_conditionals(tf.cast(embed, self.dtype))
+            return tf.cast(mean, tf.float32), tf.cast(log_sigma, tf.float32)
 
-    def generator(self, image, embed, is_training=True, reuse=False, cond_noise=True):
-        s = 64
-        s2, s4, s8, s16 = int(s / 2), int(s / 4), int(s / 8), int(s / 16)
+    def generator(self, image, embed, is_training=True, reuse=False, cond_noise=True, cond_epsilon=None,
+                  cond_stats=None):
+        with tf.variable_scope("stageII_g_net", reuse=reuse, custom_getter=self.custom_getter):
+            image = tf.cast(to_data_format(image, self.df), self.dtype)
 
-        with tf.variable_scope("stageII_g_net", reuse=reuse):
             encoded_img = self.generator_encode_image(image, is_training=is_training)
 
             # Sample from the multivariate normal distribution of the embeddings
-            mean, log_sigma = self.generate_conditionals(embed)
-            net_embed = self.sample_normal_conditional(mean, log_sigma, cond_noise)
+            if cond_stats is None:
+                mean, log_sigma = self.generate_conditionals(tf.cast(embed, self.dtype))
+            else:
+                mean, log_sigma = [tf.cast(stat, self.dtype) for stat in cond_stats]
+            net_embed = self.sample_normal_conditional(mean, log_sigma, cond_noise, cond_epsilon)
             # --------------------------------------------------------
 
             # Concatenate the encoded image and the embeddings
-            net_embed = tf.expand_dims(tf.expand_dims(net_embed, 1), 1)
-            net_embed = tf.tile(net_embed, [1, s4, s4, 1])
-            imgenc_embed = tf.concat([encoded_img, net_embed], 3)
+            imgenc_embed = concat_cond(encoded_img, net_embed, df=self.df)
 
-            pre_res = conv2d(imgenc_embed, self.gf_dim * 4, ks=(3, 3), s=(1, 1))
-            pre_res = batch_norm(pre_res, train=is_training, init=self.batch_norm_init, act=tf.nn.relu)
+            pre_res = conv2d(imgenc_embed, self.gf_dim * 4, ks=(3, 3), s=(1, 1), df=self.df)
+            pre_res = batch_norm(pre_res, train=is_training, init=self.batch_norm_init, act=tf.nn.relu, df=self.df)
 
             r_block1 = self.generator_residual_layer(pre_res, is_training=is_training)
             r_block2 = self.generator_residual_layer(r_block1, is_training=is_training)
             r_block3 = self.generator_residual_layer(r_block2, is_training=is_training)
             r_block4 = self.generator_residual_layer(r_block3, is_training=is_training)
 
-            return self.generator_upsample(r_block4, is_training=is_training), mean, log_sigma
+            net_output = from_data_format(self.generator_upsample(r_block4, is_training=is_training), self.df)
+            return tf.cast(net_output, tf.float32), tf.cast(mean, tf.float32), tf.cast(log_sigma, tf.float32)
 
 
 
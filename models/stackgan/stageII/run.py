@@ -7,6 +7,7 @@ from models.stackgan.stageII.trainer import ConditionalGanTrainer
 from models.stackgan.stageII.visualize_stageiI import StageIIVisualizer
 from utils.utils import pp, show_all_variables
 from utils.config import config_from_yaml
+from utils.session import session_config
 from preprocess.dataset import TextDataset
 
 import tensorflow as tf
@@ -36,17 +37,16 @@ def main(_):
     if not os.path.exists(cfg.LOGS_DIR):
         os.makedirs(cfg.LOGS_DIR)
 
-    run_config = tf.ConfigProto()
-    run_config.gpu_options.allow_growth = True
+    run_config = session_config('stageii')
 
     datadir = cfg.DATASET_DIR
-    dataset = TextDataset(datadir, 256)
+    dataset = TextDataset(datadir, 256, embedding_dtype=cfg.EMBEDDING_DTYPE)
 
     filename_test = '%s/test' % datadir
     dataset.test = dataset.get_data(filename_test)
 
     filename_train = '%s/train' % datadir
-    dataset.train = dataset.get_data(filename_train)
+    dataset.train = dataset.get_data(filename_train, sampling=cfg.TRAIN.SAMPLING)
 
     with tf.Session(config=run_config) as sess:
         if cfg.EVAL.FLAG:
@@ -1,11 +1,15 @@
+import os
 import tensorflow as tf
 
 from models.stackgan.stageII.model import ConditionalGan
-from utils.utils import save_images, get_balanced_factorization, initialize_uninitialized, save_captions
-from utils.saver import save, load
+from utils.utils import get_balanced_factorization, initialize_uninitialized, save_captions
+from utils.saver import save, load, AsyncSaver
+from utils.artifacts import ArtifactWriter
+from utils.profiler import StepProfiler
+from utils.summary import EXPENSIVE, SCALAR, ProgressLine, get_summary_policy
+from utils.optim import fused_step, loss_scale_optimizer
 from preprocess.dataset import TextDataset
 import numpy as np
-import time
 
 
 class ConditionalGanTrainer(object):
@@ -49,13 +53,24 @@ class ConditionalGanTrainer(object):
         self.stagei_g_saver = tf.train.Saver(stagei_vars)
         self.stageii_saver = tf.train.Saver(var_list=stageii_vars,
                                             max_to_keep=self.cfg.TRAIN.CHECKPOINTS_TO_KEEP)
+        self.checkpoint_saver = self.stageii_saver
+        if self.cfg.TRAIN.ASYNC_CHECKPOINT:
+            self.checkpoint_saver = AsyncSaver(stageii_vars, max_to_keep=self.cfg.TRAIN.CHECKPOINTS_TO_KEEP)
 
         update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
         with tf.control_dependencies(update_ops):
-            self.D_optim = tf.train.AdamOptimizer(self.learning_rate, beta1=self.cfg.TRAIN.D_BETA_DECAY) \
-                .minimize(self.D_loss, var_list=self.model.d_vars)
-            self.G_optim = tf.train.AdamOptimizer(self.learning_rate, beta1=self.cfg.TRAIN.G_BETA_DECAY) \
-                .minimize(self.G_loss, var_list=self.model.g_vars)
+            d_optimizer = tf.train.AdamOptimizer(self.learning_rate, beta1=self.cfg.TRAIN.D_BETA_DECAY)
+            d_optimizer = loss_scale_optimizer(d_optimizer, self.model.mixed_precision)
+            d_grads = d_optimizer.compute_gradients(self.D_loss, var_list=self.model.d_vars)
+            self.D_optim = d_optimizer.apply_gradients(d_grads)
+
+            g_optimizer = tf.train.AdamOptimizer(self.learning_rate, beta1=self.cfg.TRAIN.G_BETA_DECAY)
+            g_optimizer = loss_scale_optimizer(g_optimizer, self.model.mixed_precision)
+            g_grads = g_optimizer.compute_gradients(self.G_loss, var_list=self.model.g_vars)
+            self.G_optim = g_optimizer.apply_gradients(g_grads)
+
+        # D and G update from a single forward pass
+        self.DG_optim = fused_step(d_optimizer, d_grads, g_optimizer, g_grads)
 
     def kl_loss(self, mean, log_sigma):
         loss = -log_sigma + .5 * (-1 + tf.exp(2. * log_sigma) + tf.square(mean))
@@ -78,24 +93,34 @@ class ConditionalGanTrainer(object):
         self.G_kl_loss_summ = tf.summary.scalar("g_kl_loss", self.G_kl_loss)
         self.G_loss_summ = tf.summary.scalar("g_loss", self.G_loss)
 
-        self.G_merged_summ = tf.summary.merge([self.G_img_summ,
-                                               self.G_loss_summ,
+        self.G_scalar_summ = tf.summary.merge([self.G_loss_summ,
                                                self.G_gan_loss_summ,
                                                self.G_kl_loss_summ])
+        self.G_expensive_summ = tf.summary.merge([self.G_img_summ])
+        self.G_merged_summ = tf.summary.merge([self.G_scalar_summ, self.G_expensive_summ])
 
-        self.D_merged_summ = tf.summary.merge([self.D_real_mismatch_summ,
-                                               self.D_real_match_summ,
-                                               self.D_synthetic_summ,
-                                               self.D_synthetic_loss_summ,
+        self.D_scalar_summ = tf.summary.merge([self.D_synthetic_loss_summ,
                                                self.D_real_mismatch_loss_summ,
                                                self.D_real_match_loss_summ,
                                                self.D_loss_summ])
+        self.D_expensive_summ = tf.summary.merge([self.D_real_mismatch_summ,
+                                                  self.D_real_match_summ,
+                                                  self.D_synthetic_summ])
+        self.D_merged_summ = tf.summary.merge([self.D_scalar_summ, self.D_expensive_summ])
 
         self.writer = tf.summary.FileWriter(self.cfg.LOGS_DIR, self.sess.graph)
+        # The scalars and the histograms/images run on their own periods and are written in batches
+        self.summaries = get_summary_policy(self.cfg.TRAIN.SUMMARY, self.writer)
 
     def train(self):
         self.define_losses()
         self.define_summaries()
+        # The sample grids are written by a background thread
+        self.artifacts = ArtifactWriter(self.writer)
+        profiler = StepProfiler(enabled=self.cfg.TRAIN.PROFILE.FLAG,
+                                trace_period=self.cfg.TRAIN.PROFILE.TRACE_PERIOD,
+                                log_period=self.cfg.TRAIN.PROFILE.LOG_PERIOD,
+                                trace_dir=os.path.join(self.cfg.LOGS_DIR, 'timelines'))
 
         sample_z = np.random.normal(0, 1, (self.model.sample_num, self.model.z_dim))
         _, sample_embed, _, captions = self.dataset.test.next_batch_test(self.model.sample_num, 0, 1)
@@ -105,7 +130,6 @@ class ConditionalGanTrainer(object):
         save_captions(self.cfg.SAMPLE_DIR, captions)
 
         counter = 1
-        start_time = time.time()
 
         could_load, checkpoint_counter = load(self.stageii_saver, self.sess, self.cfg.CHECKPOINT_DIR)
         if could_load:
@@ -126,14 +150,20 @@ class ConditionalGanTrainer(object):
         updates_per_epoch = self.dataset.train.num_examples // self.model.batch_size
         epoch_start = counter // updates_per_epoch
 
+        d_summaries = {SCALAR: self.D_scalar_summ, EXPENSIVE: self.D_expensive_summ}
+        g_summaries = {SCALAR: self.G_scalar_summ, EXPENSIVE: self.G_expensive_summ}
+        progress = ProgressLine(self.cfg.TRAIN.SUMMARY.PROGRESS_SECS)
+
         for epoch in range(epoch_start, self.cfg.TRAIN.EPOCH):
             cen_epoch = epoch // 100
 
             for idx in range(0, updates_per_epoch):
-                images, wrong_images, embed, _, _ = self.dataset.train.next_batch(self.model.batch_size, 4,
-                                                                                  embeddings=True,
-                                                                                  wrong_img=True)
-                batch_z = np.random.normal(0, 1, (self.model.batch_size, self.model.z_dim))
+                with profiler.phase('data'):
+                    images, wrong_images, embed, _, _ = self.dataset.train.next_batch(self.model.batch_size, 4,
+                                                                                      embeddings=True,
+                                                                                      wrong_img=True)
+                with profiler.phase('noise'):
+                    batch_z = np.random.normal(0, 1, (self.model.batch_size, self.model.z_dim))
 
                 feed_dict = {
                     self.learning_rate: self.lr * (0.5**cen_epoch),
@@ -143,30 +173,50 @@ class ConditionalGanTrainer(object):
                     self.model.z: batch_z
                 }
 
-                # Update D network
-                _, err_d, summary_str = self.sess.run([self.D_optim, self.D_loss, self.D_merged_summ],
-                                                      feed_dict=feed_dict)
-                self.writer.add_summary(summary_str, counter)
-
-                # Update G network
-                _, err_g, summary_str = self.sess.run([self.G_optim, self.G_loss, self.G_merged_summ],
-                                                      feed_dict=feed_dict)
-                self.writer.add_summary(summary_str, counter)
+                if self.cfg.TRAIN.FUSED_STEP:
+                    # Update D and G networks with a single session call
+                    with profiler.phase('dg_step'):
+                        _, err_d, err_g, d_summary_str, g_summary_str = profiler.run(
+                            self.sess, [self.DG_optim, self.D_loss, self.G_loss,
+                                        self.summaries.fetches(counter, d_summaries),
+                                        self.summaries.fetches(counter, g_summaries)],
+                            feed_dict=feed_dict, step=counter)
+                    with profiler.phase('summaries'):
+                        self.summaries.add(d_summary_str, counter)
+                        self.summaries.add(g_summary_str, counter)
+                else:
+                    # Update D network
+                    with profiler.phase('d_step'):
+                        _, err_d, d_summary_str = profiler.run(self.sess,
+                                                               [self.D_optim, self.D_loss,
+                                                                self.summaries.fetches(counter, d_summaries)],
+                                                               feed_dict=feed_dict, step=counter)
+
+                    # Update G network
+                    with profiler.phase('g_step'):
+                        _, err_g, g_summary_str = profiler.run(self.sess,
+                                                               [self.G_optim, self.G_loss,
+                                                                self.summaries.fetches(counter, g_summaries)],
+                                                               feed_dict=feed_dict, step=counter)
+
+                    with profiler.phase('summaries'):
+                        self.summaries.add(d_summary_str, counter)
+                        self.summaries.add(g_summary_str, counter)
 
                 counter += 1
-                print("Epoch: [%2d] [%4d/%4d] time: %4.4f, d_loss: %.8f, g_loss: %.8f"
-                      % (epoch, idx, updates_per_epoch,
-                         time.time() - start_time, err_d, err_g))
+                progress.update("Epoch: [%2d] [%4d/%4d]" % (epoch, idx, updates_per_epoch), d_loss=err_d, g_loss=err_g)
 
                 if np.mod(counter, 2000) == 0:
                     try:
-                        samples = self.sess.run(self.model.sampler,
-                                                feed_dict={
-                                                            self.model.z_sample: sample_z,
-                                                            self.model.embed_sample: sample_embed,
-                                                          })
-                        save_images(samples, get_balanced_factorization(samples.shape[0]),
-                                    '{}train_{:02d}_{:04d}.png'.format(self.cfg.SAMPLE_DIR, epoch, idx))
+                        with profiler.phase('sampling'):
+                            samples = self.sess.run(self.model.sampler,
+                                                    feed_dict={
+                                                                self.model.z_sample: sample_z,
+                                                                self.model.embed_sample: sample_embed,
+                                                              })
+                            self.artifacts.save_images(samples, get_balanced_factorization(samples.shape[0]),
+                                                       '{}train_{:02d}_{:04d}.png'.format(self.cfg.SAMPLE_DIR,
+                                                                                          epoch, idx))
                     except Exception as e:
                         print("Failed to generate sample image")
                         print(type(e))
@@ -174,4 +224,12 @@ class ConditionalGanTrainer(object):
                         print(e)
 
                 if np.mod(counter, 500) == 2:
-                    save(self.stageii_saver, self.sess, self.cfg.CHECKPOINT_DIR, counter)
+                    with profiler.phase('checkpoint'):
+                        save(self.checkpoint_saver, self.sess, self.cfg.CHECKPOINT_DIR, counter)
+                profiler.end_step(counter)
+
+        # Wait for the pending checkpoints, summaries and artifacts to be written
+        if isinstance(self.checkpoint_saver, AsyncSaver):
+            self.checkpoint_saver.close()
+        self.summaries.close()
+        self.artifacts.close()
@@ -16,8 +16,8 @@ class StageIIVisualizer(object):
         self.samples_dir = self.config.SAMPLE_DIR
 
     def visualize(self):
-        z = tf.placeholder(tf.float32, [self.model.batch_size, self.model.z_dim], name='z')
-        cond = tf.placeholder(tf.float32, [self.model.batch_size] + [self.model.embed_dim], name='cond')
+        z = tf.placeholder(tf.float32, [None, self.model.z_dim], name='z')
+        cond = tf.placeholder(tf.float32, [None] + [self.model.embed_dim], name='cond')
         gen_stagei, _, _ = self.model.stagei.generator(z, cond, is_training=False)
         gen, _, _ = self.model.generator(gen_stagei, cond, is_training=False)
         gen_no_noise, _, _ = self.model.generator(gen_stagei, cond, is_training=False, reuse=True, cond_noise=False)
@@ -7,6 +7,7 @@ from preprocess.dataset import TextDataset
 import tensorflow as tf
 import numpy as np
 from evaluation import fid, inception_score
+from evaluation.shards import ShardedImages, has_shards
 from models.inception.model import load_inception_inference
 import os
 
@@ -21,10 +22,10 @@ class WGanClsEval(object):
 
     def evaluate_fid(self):
         incep_batch_size = self.cfg.EVAL.INCEP_BATCH_SIZE
-        _, layers = load_inception_inference(self.sess, 20, incep_batch_size,
+        _, layers = load_inception_inference(self.sess, 20, None,
                                              self.cfg.EVAL.INCEP_CHECKPOINT_DIR)
         pool3 = layers['PreLogits']
-        act_op = tf.reshape(pool3, shape=[incep_batch_size, -1])
+        act_op = tf.reshape(pool3, shape=[-1, 2048])
 
         if not os.path.exists(self.cfg.EVAL.ACT_STAT_PATH):
             print('Computing activation statistics for real x')
@@ -36,33 +37,39 @@ class WGanClsEval(object):
         mu_real = stats['mu']
         sigma_real = stats['sigma']
 
-        z = tf.placeholder(tf.float32, [self.bs, self.model.z_dim], name='real_images')
-        cond = tf.placeholder(tf.float32, [self.bs] + [self.model.embed_dim], name='cond')
-        eval_gen, _, _ = self.model.generator(z, cond, reuse=False)
-
-        saver = tf.train.Saver(tf.global_variables('g_net'))
-        could_load, _ = load(saver, self.sess, self.cfg.CHECKPOINT_DIR)
-        if could_load:
-            print(" [*] Load SUCCESS")
+        shard_dir = self.cfg.EVAL.SHARD_DIR
+        if has_shards(shard_dir):
+            print('Loading the generated x from %s' % shard_dir)
+            samples = ShardedImages(shard_dir)
         else:
-            print(" [!] Load failed...")
-            raise RuntimeError('Could not load the checkpoints of the generator')
+            z = tf.placeholder(tf.float32, [None, self.model.z_dim], name='real_images')
+            cond = tf.placeholder(tf.float32, [None] + [self.model.embed_dim], name='cond')
+            eval_gen, _, _ = self.model.generator(z, cond, reuse=False)
+
+            saver = tf.train.Saver(tf.global_variables('g_net'))
+            could_load, _ = load(saver, self.sess, self.cfg.CHECKPOINT_DIR)
+            if could_load:
+                print(" [*] Load SUCCESS")
+            else:
+                print(" [!] Load failed...")
+                raise RuntimeError('Could not load the checkpoints of the generator')
 
-        print('Generating x...')
+            print('Generating x...')
 
-        fid_size = self.cfg.EVAL.SIZE
-        n_batches = fid_size // self.bs
+            fid_size = self.cfg.EVAL.SIZE
+            n_batches = int(np.ceil(fid_size / self.bs))
 
-        w, h, c = self.model.image_dims[0], self.model.image_dims[1], self.model.image_dims[2]
-        samples = np.zeros((n_batches * self.bs, w, h, c))
-        for i in range(n_batches):
-            start = i * self.bs
-            end = start + self.bs
+            w, h, c = self.model.image_dims[0], self.model.image_dims[1], self.model.image_dims[2]
+            samples = np.zeros((fid_size, w, h, c))
+            for i in range(n_batches):
+                # The generator accepts any batch size, so the last batch holds the remaining samples
+                start = i * self.bs
+                end = min(start + self.bs, fid_size)
 
-            sample_z = np.random.normal(0, 1, size=(self.bs, self.model.z_dim))
-            images, _, embed, _, _ = self.dataset.test.next_batch(self.bs, 4, embeddings=True)
+                sample_z = np.random.normal(0, 1, size=(end - start, self.model.z_dim))
+                images, _, embed, _, _ = self.dataset.test.next_batch(end - start, 4, embeddings=True)
 
-            samples[start: end] = denormalize_images(self.sess.run(eval_gen, feed_dict={z: sample_z, cond: embed}))
+                samples[start: end] = denormalize_images(self.sess.run(eval_gen, feed_dict={z: sample_z, cond: embed}))
 
         print('Computing activation statistics for generated x...')
         mu_gen, sigma_gen = fid.calculate_activation_statistics(samples, self.sess, incep_batch_size, act_op,
@@ -78,39 +85,45 @@ class WGanClsEval(object):
 
     def evaluate_inception(self):
         incep_batch_size = self.cfg.EVAL.INCEP_BATCH_SIZE
-        logits, _ = load_inception_inference(self.sess, 20, incep_batch_size,
+        logits, _ = load_inception_inference(self.sess, 20, None,
                                              self.cfg.EVAL.INCEP_CHECKPOINT_DIR)
         pred_op = tf.nn.softmax(logits)
 
-        z = tf.placeholder(tf.float32, [self.bs, self.model.z_dim], name='z')
-        cond = tf.placeholder(tf.float32, [self.bs] + [self.model.embed_dim], name='cond')
-        eval_gen, _, _ = self.model.generator(z, cond, is_training=False)
-
-        saver = tf.train.Saver(tf.global_variables('g_net'))
-        could_load, _ = load(saver, self.sess, self.cfg.CHECKPOINT_DIR)
-        if could_load:
-            print(" [*] Load SUCCESS")
+        shard_dir = self.cfg.EVAL.SHARD_DIR
+        if has_shards(shard_dir):
+            print('Loading the generated x from %s' % shard_dir)
+            samples = ShardedImages(shard_dir)
         else:
-            print(" [!] Load failed...")
-            raise RuntimeError('Could not load the checkpoints of the generator')
-
-        print('Generating x...')
-
-        size = self.cfg.EVAL.SIZE
-        n_batches = size // self.bs
-
-        w, h, c = self.model.image_dims[0], self.model.image_dims[1], self.model.image_dims[2]
-        samples = np.zeros((n_batches * self.bs, w, h, c))
-        for i in range(n_batches):
-            print("\rGenerating batch %d/%d" % (i + 1, n_batches), end="", flush=True)
-
-            sample_z = np.random.normal(0, 1, size=(self.bs, self.model.z_dim))
-            _, _, embed, _, _ = self.dataset.test.next_batch(self.bs, 4, embeddings=True)
-            start = i * self.bs
-            end = start + self.bs
-
-            gen_batch = self.sess.run(eval_gen, feed_dict={z: sample_z, cond: embed})
-            samples[start: end] = denormalize_images(gen_batch)
+            z = tf.placeholder(tf.float32, [None, self.model.z_dim], name='z')
+            cond = tf.placeholder(tf.float32, [None] + [self.model.embed_dim], name='cond')
+            eval_gen, _, _ = self.model.generator(z, cond, is_training=False)
+
+            saver = tf.train.Saver(tf.global_variables('g_net'))
+            could_load, _ = load(saver, self.sess, self.cfg.CHECKPOINT_DIR)
+            if could_load:
+                print(" [*] Load SUCCESS")
+            else:
+                print(" [!] Load failed...")
+                raise RuntimeError('Could not load the checkpoints of the generator')
+
+            print('Generating x...')
+
+            size = self.cfg.EVAL.SIZE
+            n_batches = int(np.ceil(size / self.bs))
+
+            w, h, c = self.model.image_dims[0], self.model.image_dims[1], self.model.image_dims[2]
+            samples = np.zeros((size, w, h, c))
+            for i in range(n_batches):
+                print("\rGenerating batch %d/%d" % (i + 1, n_batches), end="", flush=True)
+
+                # The generator accepts any batch size, so the last batch holds the remaining samples
+                start = i * self.bs
+                end = min(start + self.bs, size)
+                sample_z = np.random.normal(0, 1, size=(end - start, self.model.z_dim))
+                _, _, embed, _, _ = self.dataset.test.next_batch(end - start, 4, embeddings=True)
+
+                gen_batch = self.sess.run(eval_gen, feed_dict={z: sample_z, cond: embed})
+                samples[start: end] = denormalize_images(gen_batch)
 
         print('\nComputing inception score...')
         mean, std = inception_score.get_inception_score(samples, self.sess, incep_batch_size, 10, pred_op, verbose=True)
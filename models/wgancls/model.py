@@ -1,5 +1,6 @@
 import tensorflow as tf
 from utils.ops import *
+from utils.optim import fused_step, loss_scale_optimizer, input_gradient
 
 
 class WGanCls(object):
@@ -24,6 +25,16 @@ class WGanCls(object):
         self.df_dim = cfg.MODEL.DF_DIM
         
         self.image_dims = [cfg.MODEL.IMAGE_SHAPE.H, cfg.MODEL.IMAGE_SHAPE.W, cfg.MODEL.IMAGE_SHAPE.D]
+        # Data format of the convolutions. The images in and out of the networks are always NHWC.
+        self.df = get_data_format(cfg.MODEL.DATA_FORMAT)
+
+        # Mixed precision: float16 compute with float32 master weights
+        self.mixed_precision = cfg.TRAIN.MIXED_PRECISION
+        self.dtype = get_compute_dtype(self.mixed_precision)
+        self.custom_getter = get_variable_getter(self.mixed_precision)
+
+        # XLA JIT compilation of the D and G updates: off, scoped or global
+        self.xla = cfg.TRAIN.XLA
 
         self.global_step = tf.Variable(0, trainable=False)
 
@@ -45,14 +56,15 @@ class WGanCls(object):
         self.z_sample = tf.placeholder(tf.float32, [self.sample_num] + [self.z_dim], name='z_sample')
         self.cond_sample = tf.placeholder(tf.float32, [self.sample_num] + [self.embed_dim], name='cond_sample')
 
-        self.G, self.embed_mean, self.embed_log_sigma = self.generator(self.z, self.cond, reuse=False)
-        self.Dg_logit = self.discriminator(self.G, self.cond, reuse=False)
-        self.Dx_logit= self.discriminator(self.x, self.cond, reuse=True)
-        self.Dxmi_logit= self.discriminator(self.x_mismatch, self.cond, reuse=True)
+        with jit_scope(self.xla):
+            self.G, self.embed_mean, self.embed_log_sigma = self.generator(self.z, self.cond, reuse=False)
+            self.Dg_logit = self.discriminator(self.G, self.cond, reuse=False)
+            self.Dx_logit= self.discriminator(self.x, self.cond, reuse=True)
+            self.Dxmi_logit= self.discriminator(self.x_mismatch, self.cond, reuse=True)
 
-        self.x_hat = self.epsilon * self.G + (1. - self.epsilon) * self.x
-        self.cond_inp = self.cond + 0.0
-        self.Dx_hat_logit = self.discriminator(self.x_hat, self.cond_inp, reuse=True)
+            self.x_hat = self.epsilon * self.G + (1. - self.epsilon) * self.x
+            self.cond_inp = self.cond + 0.0
+            self.Dx_hat_logit = self.discriminator(self.x_hat, self.cond_inp, reuse=True)
 
         self.sampler, _, _ = self.generator(self.z_sample, self.cond_sample, reuse=True, is_training=False)
 
@@ -60,12 +72,12 @@ class WGanCls(object):
         self.g_vars = tf.trainable_variables('g_net')
 
     def get_gradient_penalty(self, x, y):
-        grad_y = tf.gradients(y, [x])[0]
+        grad_y = input_gradient(x, y, self.mixed_precision)
         slopes = tf.sqrt(tf.reduce_sum(tf.square(grad_y), reduction_indices=[1, 2, 3]))
         return tf.reduce_mean(tf.maximum(0.0, slopes - 1.)**2)
 
     def get_gradient_penalty2(self, x, y):
-        grad_y = tf.gradients(y, [x])[0]
+        grad_y = input_gradient(x, y, self.mixed_precision)
         slopes = tf.sqrt(tf.reduce_sum(tf.square(grad_y), reduction_indices=[1]))
         return tf.reduce_mean(tf.maximum(0.0, slopes - 1.)**2)
 
@@ -76,34 +88,42 @@ class WGanCls(object):
 
         self.kt = tf.Variable(0.7, trainable=True, name='kt')
 
-        self.D_loss_real = tf.reduce_mean(self.Dx_logit)
-        self.D_loss_fake = tf.reduce_mean(self.Dg_logit)
-        self.D_loss_mismatch = tf.reduce_mean(self.Dxmi_logit)
-        self.wdist = self.D_loss_real - self.D_loss_fake
-        self.wdist2 = self.D_loss_real - self.D_loss_mismatch
-        self.reg_loss = tf.reduce_mean(tf.square(self.Dxmi_logit))
-        self.balance_loss = tf.reduce_mean(tf.square(self.kt * self.wdist2 - self.wdist))
-
-        self.G_kl_loss = self.kl_std_normal_loss(self.embed_mean, self.embed_log_sigma)
-        self.real_gp = self.get_gradient_penalty(self.x_hat, self.Dx_hat_logit)
-        self.real_gp2 = self.get_gradient_penalty2(self.cond_inp, self.Dx_hat_logit)
-
-        self.D_loss = -self.wdist - self.kt * self.wdist2 + 150.0 * (self.real_gp + self.real_gp2)
-        self.G_loss = -self.D_loss_fake + kl_coeff * self.G_kl_loss
-
-        self.D_optim = tf.train.AdamOptimizer(self.learning_rate_d,
-                                              beta1=self.cfg.TRAIN.BETA1,
-                                              beta2=self.cfg.TRAIN.BETA2) \
-            .minimize(self.D_loss, var_list=self.d_vars, global_step=self.global_step)
+        with jit_scope(self.xla):
+            self.D_loss_real = tf.reduce_mean(self.Dx_logit)
+            self.D_loss_fake = tf.reduce_mean(self.Dg_logit)
+            self.D_loss_mismatch = tf.reduce_mean(self.Dxmi_logit)
+            self.wdist = self.D_loss_real - self.D_loss_fake
+            self.wdist2 = self.D_loss_real - self.D_loss_mismatch
+            self.reg_loss = tf.reduce_mean(tf.square(self.Dxmi_logit))
+            self.balance_loss = tf.reduce_mean(tf.square(self.kt * self.wdist2 - self.wdist))
+
+            self.G_kl_loss = self.kl_std_normal_loss(self.embed_mean, self.embed_log_sigma)
+            self.real_gp = self.get_gradient_penalty(self.x_hat, self.Dx_hat_logit)
+            self.real_gp2 = self.get_gradient_penalty2(self.cond_inp, self.Dx_hat_logit)
+
+            self.D_loss = -self.wdist - self.kt * self.wdist2 + 150.0 * (self.real_gp + self.real_gp2)
+            self.G_loss = -self.D_loss_fake + kl_coeff * self.G_kl_loss
+
+        d_optimizer = tf.train.AdamOptimizer(self.learning_rate_d,
+                                             beta1=self.cfg.TRAIN.BETA1,
+                                             beta2=self.cfg.TRAIN.BETA2)
+        d_optimizer = loss_scale_optimizer(d_optimizer, self.mixed_precision)
+        d_grads = d_optimizer.compute_gradients(self.D_loss, var_list=self.d_vars)
+        self.D_optim = d_optimizer.apply_gradients(d_grads, global_step=self.global_step)
         update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
 
         self.kt_optim = tf.train.GradientDescentOptimizer(0.001).minimize(self.balance_loss, var_list=[self.kt])
 
+        g_optimizer = tf.train.AdamOptimizer(self.learning_rate_g,
+                                             beta1=self.cfg.TRAIN.BETA1,
+                                             beta2=self.cfg.TRAIN.BETA2)
+        g_optimizer = loss_scale_optimizer(g_optimizer, self.mixed_precision)
         with tf.control_dependencies(update_ops):
-            self.G_optim = tf.train.AdamOptimizer(self.learning_rate_g,
-                                                  beta1=self.cfg.TRAIN.BETA1,
-                                                  beta2=self.cfg.TRAIN.BETA2)\
-                .minimize(self.G_loss, var_list=self.g_vars)
+            g_grads = g_optimizer.compute_gradients(self.G_loss, var_list=self.g_vars)
+            self.G_optim = g_optimizer.apply_gradients(g_grads)
+
+        # D and G update from a single forward pass (used every n_critic iterations)
+        self.DG_optim = fused_step(d_optimizer, d_grads, g_optimizer, g_grads, global_step=self.global_step)
 
     def generate_conditionals(self, embeddings):
         """Takes the embeddings, compresses them and builds the statistics for a multivariate normal distribution"""
@@ -114,9 +134,13 @@ class WGanCls(object):
         log_sigma = fc(embeddings, self.compressed_embed_dim, act=lrelu)
         return mean, log_sigma
 
-    def sample_normal_conditional(self, mean, log_sigma, cond_noise=True):
+    def sample_normal_conditional(self, mean, log_sigma, cond_noise=True, epsilon=None):
         if cond_noise:
-            epsilon = tf.truncated_normal(tf.shape(mean))
+            if epsilon is None:
+                epsilon = tf.truncated_normal(tf.shape(mean), dtype=mean.dtype)
+            else:
+                # Externally sampled noise, e.g. from utils.sampling for reproducible generation
+                epsilon = tf.cast(epsilon, mean.dtype)
             stddev = tf.exp(log_sigma)
             return mean + stddev * epsilon
         return mean
@@ -129,19 +153,22 @@ class WGanCls(object):
     def discriminator(self, inputs, embed, reuse=False):
         s16 = self.output_size / 16
         lrelu = lambda l: tf.nn.leaky_relu(l, 0.2)
-        inputs = to_nchw(inputs)
+        inputs = to_data_format(inputs, self.df)
+
+        with tf.variable_scope("d_net", reuse=reuse, custom_getter=self.custom_getter):
+            inputs = tf.cast(inputs, self.dtype)
+            embed = tf.cast(embed, self.dtype)
 
-        with tf.variable_scope("d_net", reuse=reuse):
-            net_ho = conv2d(inputs, self.df_dim, ks=(4, 4), s=(2, 2), act=lrelu, df=NCHW)
-            net_h1 = conv2d(net_ho, self.df_dim * 2, ks=(4, 4), s=(2, 2), df=NCHW, act=lrelu)
-            net_h2 = conv2d(net_h1, self.df_dim * 4, ks=(4, 4), s=(2, 2), df=NCHW, act=lrelu)
-            net_h3 = conv2d(net_h2, self.df_dim * 8, ks=(4, 4), s=(2, 2), df=NCHW)
+            net_ho = conv2d(inputs, self.df_dim, ks=(4, 4), s=(2, 2), act=lrelu, df=self.df)
+            net_h1 = conv2d(net_ho, self.df_dim * 2, ks=(4, 4), s=(2, 2), df=self.df, act=lrelu)
+            net_h2 = conv2d(net_h1, self.df_dim * 4, ks=(4, 4), s=(2, 2), df=self.df, act=lrelu)
+            net_h3 = conv2d(net_h2, self.df_dim * 8, ks=(4, 4), s=(2, 2), df=self.df)
             # --------------------------------------------------------
 
             # Residual layer
-            net = conv2d(net_h3, self.df_dim * 2, ks=(1, 1), s=(1, 1), padding='valid', df=NCHW, act=lrelu)
-            net = conv2d(net, self.df_dim * 4, ks=(3, 3), s=(1, 1), df=NCHW, act=lrelu)
-            net = conv2d(net, self.df_dim * 8, ks=(3, 3), s=(1, 1), df=NCHW)
+            net = conv2d(net_h3, self.df_dim * 2, ks=(1, 1), s=(1, 1), padding='valid', df=self.df, act=lrelu)
+            net = conv2d(net, self.df_dim * 4, ks=(3, 3), s=(1, 1), df=self.df, act=lrelu)
+            net = conv2d(net, self.df_dim * 8, ks=(3, 3), s=(1, 1), df=self.df)
             net_h4 = tf.add(net_h3, net)
             net_h4 = tf.nn.leaky_relu(net_h4, 0.2)
             # --------------------------------------------------------
@@ -150,35 +177,47 @@ class WGanCls(object):
             net_embed = fc(embed, self.compressed_embed_dim, act=lrelu)
 
             # Spatially replicate embeddings in depth
-            net_embed = tf.expand_dims(tf.expand_dims(net_embed, 2), 2)
-            net_embed = tf.tile(net_embed, [1, 1, 4, 4])
-            net_h4_concat = tf.concat([net_h4, net_embed], 1)
+            net_h4_concat = concat_cond(net_h4, net_embed, df=self.df)
 
-            net_h5 = conv2d(net_h4_concat, self.df_dim*8, ks=(3, 3), s=(1, 1), padding='same', df=NCHW, act=lrelu)
-            net_h6 = conv2d(net_h5, self.df_dim*8, ks=(1, 1), s=(1, 1), padding='valid', df=NCHW, act=lrelu)
+            net_h5 = conv2d(net_h4_concat, self.df_dim*8, ks=(3, 3), s=(1, 1), padding='same', df=self.df, act=lrelu)
+            net_h6 = conv2d(net_h5, self.df_dim*8, ks=(1, 1), s=(1, 1), padding='valid', df=self.df, act=lrelu)
 
-            out = conv2d(net_h6, 1, ks=(4, 4), s=(4, 4), padding='valid', df=NCHW)
-            return out
+            out = conv2d(net_h6, 1, ks=(4, 4), s=(4, 4), padding='valid', df=self.df)
+            return tf.cast(out, tf.float32)
 
-    def generator(self, z, embed, reuse=False, is_training=True, df=NCHW, cond_noise=True):
+    def conditionals(self, embed, reuse=tf.AUTO_REUSE):
+        """
+        Builds only the embedding projection of the generator, which returns the (mean, log_sigma) of the conditioning
+        augmentation. These can be computed once per embedding and passed to the generator as cond_stats.
+        """
+        with tf.variable_scope("g_net", reuse=reuse, custom_getter=self.custom_getter):
+            mean, log_sigma = self.generate_conditionals(tf.cast(embed, self.dtype))
+            return tf.cast(mean, tf.float32), tf.cast(log_sigma, tf.float32)
+
+    def generator(self, z, embed, reuse=False, is_training=True, cond_noise=True, cond_epsilon=None, cond_stats=None):
         s = self.output_size
+        df = self.df
         s2, s4, s8, s16 = int(s / 2), int(s / 4), int(s / 8), int(s / 16)
 
-        with tf.variable_scope("g_net", reuse=reuse):
+        with tf.variable_scope("g_net", reuse=reuse, custom_getter=self.custom_getter):
+            z = tf.cast(z, self.dtype)
+
             # Sample from the multivariate normal distribution of the embeddings
-            mean, log_sigma = self.generate_conditionals(embed)
-            net_embed = self.sample_normal_conditional(mean, log_sigma, cond_noise)
+            if cond_stats is None:
+                mean, log_sigma = self.generate_conditionals(tf.cast(embed, self.dtype))
+            else:
+                mean, log_sigma = [tf.cast(stat, self.dtype) for stat in cond_stats]
+            net_embed = self.sample_normal_conditional(mean, log_sigma, cond_noise, cond_epsilon)
             # --------------------------------------------------------
 
             # Concatenate the sampled embedding with the z vector
             net_input = tf.concat([z, net_embed], 1)
-            net_h0 = fc(net_input, self.gf_dim * 8 * s16 * s16, act=None)
+            # Named explicitly so the variables are the same when the conditionals are not built in this scope
+            net_h0 = fc(net_input, self.gf_dim * 8 * s16 * s16, act=None, name='dense_2')
             net_h0 = batch_norm(net_h0, train=is_training, act=None, df=df)
             # --------------------------------------------------------
-            if df == NCHW:
-                net_h0 = tf.reshape(net_h0, [-1, self.gf_dim * 8, s16, s16])
-            else:
-                net_h0 = tf.reshape(net_h0, [-1, s16, s16, self.gf_dim * 8])
+            # The units of the dense layer are ordered as in NCHW, the data format the checkpoints were trained in
+            net_h0 = dense_to_feature_map(net_h0, s16, s16, self.gf_dim * 8, df=df, units_df=NCHW)
 
             # Residual layer
             net = conv2d(net_h0, self.gf_dim * 2, ks=(1, 1), s=(1, 1), padding='valid', df=df)
@@ -220,6 +259,5 @@ class WGanCls(object):
 
             net_output = tf.nn.tanh(net_logits)
 
-            if df == NCHW:
-                net_output = to_nhwc(net_output)
-            return net_output, mean, log_sigma
+            net_output = from_data_format(net_output, df)
+            return tf.cast(net_output, tf.float32), tf.cast(mean, tf.float32), tf.cast(log_sigma, tf.float32)
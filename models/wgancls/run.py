@@ -6,6 +6,8 @@ from models.wgancls.eval_wgan import WGanClsEval
 from models.wgancls.visualize_wgan import WGanClsVisualizer
 from utils.utils import show_all_variables
 from utils.config import config_from_yaml
+from utils.ops import set_xla_jit
+from utils.session import session_config
 from preprocess.dataset import TextDataset
 
 import tensorflow as tf
@@ -27,17 +29,16 @@ def main(_):
     if not os.path.exists(cfg.LOGS_DIR):
         os.makedirs(cfg.LOGS_DIR)
 
-    run_config = tf.ConfigProto()
-    run_config.gpu_options.allow_growth = True
+    run_config = set_xla_jit(session_config('wgancls'), cfg.TRAIN.XLA)
 
     datadir = cfg.DATASET_DIR
-    dataset = TextDataset(datadir, 64)
+    dataset = TextDataset(datadir, 64, embedding_dtype=cfg.EMBEDDING_DTYPE)
 
     filename_test = '%s/test' % datadir
     dataset.test = dataset.get_data(filename_test)
 
     filename_train = '%s/train' % datadir
-    dataset.train = dataset.get_data(filename_train)
+    dataset.train = dataset.get_data(filename_train, sampling=cfg.TRAIN.SAMPLING)
 
     with tf.Session(config=run_config) as sess:
         if cfg.EVAL.FLAG:
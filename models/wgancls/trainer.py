@@ -1,7 +1,11 @@
+import os
 import tensorflow as tf
 from models.wgancls.model import WGanCls
-from utils.utils import save_images, get_balanced_factorization, save_captions
-from utils.saver import save, load
+from utils.utils import get_balanced_factorization, save_captions
+from utils.saver import save, load, AsyncSaver
+from utils.artifacts import ArtifactWriter
+from utils.profiler import StepProfiler
+from utils.summary import EXPENSIVE, SCALAR, get_summary_policy
 from preprocess.dataset import TextDataset
 import numpy as np
 import time
@@ -18,13 +22,7 @@ class WGanClsTrainer(object):
         self.lr_g = self.cfg.TRAIN.G_LR
 
     def define_summaries(self):
-        self.summary_op = tf.summary.merge([
-            tf.summary.image('x', self.model.x),
-            tf.summary.image('G_img', self.model.G),
-
-            tf.summary.histogram('z', self.model.z),
-            tf.summary.histogram('z_sample', self.model.z_sample),
-
+        self.scalar_summ = tf.summary.merge([
             tf.summary.scalar('G_loss_wass', -self.model.D_loss_fake),
             tf.summary.scalar('kl_loss', self.model.G_kl_loss),
             tf.summary.scalar('G_loss', self.model.G_loss),
@@ -43,13 +41,29 @@ class WGanClsTrainer(object):
             tf.summary.scalar('kt', self.model.kt),
             tf.summary.scalar('balance_loss', self.model.balance_loss),
         ])
+        self.expensive_summ = tf.summary.merge([
+            tf.summary.histogram('z', self.model.z),
+            tf.summary.histogram('z_sample', self.model.z_sample),
+        ])
+        self.summary_op = tf.summary.merge([self.scalar_summ, self.expensive_summ])
 
         self.writer = tf.summary.FileWriter(self.cfg.LOGS_DIR, self.sess.graph)
+        # The scalars and the histograms/images run on their own periods and are written in batches
+        self.summaries = get_summary_policy(self.cfg.TRAIN.SUMMARY, self.writer)
 
     def train(self):
         self.define_summaries()
+        # The image summaries and the sample grids are written by a background thread
+        self.artifacts = ArtifactWriter(self.writer)
+        profiler = StepProfiler(enabled=self.cfg.TRAIN.PROFILE.FLAG,
+                                trace_period=self.cfg.TRAIN.PROFILE.TRACE_PERIOD,
+                                log_period=self.cfg.TRAIN.PROFILE.LOG_PERIOD,
+                                trace_dir=os.path.join(self.cfg.LOGS_DIR, 'timelines'))
 
         self.saver = tf.train.Saver(max_to_keep=self.cfg.TRAIN.CHECKPOINTS_TO_KEEP)
+        self.checkpoint_saver = self.saver
+        if self.cfg.TRAIN.ASYNC_CHECKPOINT:
+            self.checkpoint_saver = AsyncSaver(max_to_keep=self.cfg.TRAIN.CHECKPOINTS_TO_KEEP)
 
         sample_z = np.random.normal(0, 1, (self.model.sample_num, self.model.z_dim))
         _, sample_cond, _, captions = self.dataset.test.next_batch_test(self.model.sample_num, 0, 1)
@@ -70,14 +84,17 @@ class WGanClsTrainer(object):
             print(" [!] Load failed...")
         sys.stdout.flush()
 
+        summary_ops = {SCALAR: self.scalar_summ, EXPENSIVE: self.expensive_summ}
         for idx in range(start_point + 1, self.cfg.TRAIN.MAX_STEPS):
             epoch_size = self.dataset.train.num_examples // self.model.batch_size
             epoch = idx // epoch_size
 
-            images, wrong_images, embed, _, _ = self.dataset.train.next_batch(self.model.batch_size, 4, embeddings=True,
-                                                                              wrong_img=True)
-            batch_z = np.random.normal(0, 1, (self.model.batch_size, self.model.z_dim))
-            eps = np.random.uniform(0., 1., size=(self.model.batch_size, 1, 1, 1))
+            with profiler.phase('data'):
+                images, wrong_images, embed, _, _ = self.dataset.train.next_batch(self.model.batch_size, 4,
+                                                                                  embeddings=True, wrong_img=True)
+            with profiler.phase('noise'):
+                batch_z = np.random.normal(0, 1, (self.model.batch_size, self.model.z_dim))
+                eps = np.random.uniform(0., 1., size=(self.model.batch_size, 1, 1, 1))
             n_critic = self.cfg.TRAIN.N_CRITIC
             kiter = (idx // n_critic) // 10000
 
@@ -94,27 +111,55 @@ class WGanClsTrainer(object):
                 self.model.iter: idx,
             }
 
-            _, _, err_d = self.sess.run([self.model.D_optim, self.model.kt_optim, self.model.D_loss],
-                                         feed_dict=feed_dict)
-
-            if idx % n_critic == 0:
-                _, err_g = self.sess.run([self.model.G_optim, self.model.G_loss],
-                                         feed_dict=feed_dict)
-
-            summary_period = self.cfg.TRAIN.SUMMARY_PERIOD
-            if np.mod(idx, summary_period) == 0:
-                summary_str = self.sess.run(self.summary_op, feed_dict=feed_dict)
-                self.writer.add_summary(summary_str, idx)
+            # The generated images are written with the histograms
+            expensive = EXPENSIVE in self.summaries.due(idx)
+            if self.cfg.TRAIN.FUSED_STEP:
+                # Update D (and G every n_critic steps) with a single session call. The summaries are
+                # computed from the same forward pass when they are due.
+                step_op = self.model.DG_optim if idx % n_critic == 0 else self.model.D_optim
+                fetches = [step_op, self.model.kt_optim, self.model.D_loss, self.summaries.fetches(idx, summary_ops)]
+                if expensive:
+                    fetches.append(self.model.G)
+
+                with profiler.phase('dg_step'):
+                    results = profiler.run(self.sess, fetches, feed_dict=feed_dict, step=idx)
+                err_d = results[2]
+                with profiler.phase('summaries'):
+                    self.summaries.add(results[3], idx)
+                    if expensive:
+                        self.artifacts.add_images('x', images, idx)
+                        self.artifacts.add_images('G_img', results[4], idx)
+            else:
+                with profiler.phase('d_step'):
+                    _, _, err_d = profiler.run(self.sess, [self.model.D_optim, self.model.kt_optim, self.model.D_loss],
+                                               feed_dict=feed_dict, step=idx)
+
+                if idx % n_critic == 0:
+                    with profiler.phase('g_step'):
+                        _, err_g = profiler.run(self.sess, [self.model.G_optim, self.model.G_loss],
+                                                feed_dict=feed_dict, step=idx)
+
+                fetches = self.summaries.fetches(idx, summary_ops)
+                if fetches:
+                    with profiler.phase('summaries'):
+                        summaries, g_img = self.sess.run([fetches, self.model.G if expensive else []],
+                                                         feed_dict=feed_dict)
+                        self.summaries.add(summaries, idx)
+                        if expensive:
+                            self.artifacts.add_images('x', images, idx)
+                            self.artifacts.add_images('G_img', g_img, idx)
 
             if np.mod(idx, self.cfg.TRAIN.SAMPLE_PERIOD) == 0:
                 try:
-                    samples = self.sess.run(self.model.sampler,
-                                            feed_dict={
-                                                self.model.z_sample: sample_z,
-                                                self.model.cond_sample: sample_cond,
-                                            })
-                    save_images(samples, get_balanced_factorization(samples.shape[0]),
-                                '{}train_{:02d}_{:04d}.png'.format(self.cfg.SAMPLE_DIR, epoch, idx))
+                    with profiler.phase('sampling'):
+                        samples = self.sess.run(self.model.sampler,
+                                                feed_dict={
+                                                    self.model.z_sample: sample_z,
+                                                    self.model.cond_sample: sample_cond,
+                                                })
+                        self.artifacts.save_images(samples, get_balanced_factorization(samples.shape[0]),
+                                                   '{}train_{:02d}_{:04d}.png'.format(self.cfg.SAMPLE_DIR, epoch,
+                                                                                      idx))
 
                 except Exception as e:
                     print("Failed to generate sample image")
@@ -123,5 +168,13 @@ class WGanClsTrainer(object):
                     print(e)
 
             if np.mod(idx, 500) == 2:
-                save(self.saver, self.sess, self.cfg.CHECKPOINT_DIR, idx)
+                with profiler.phase('checkpoint'):
+                    save(self.checkpoint_saver, self.sess, self.cfg.CHECKPOINT_DIR, idx)
+            profiler.end_step(idx)
             sys.stdout.flush()
+
+        # Wait for the pending checkpoints, summaries and artifacts to be written
+        if isinstance(self.checkpoint_saver, AsyncSaver):
+            self.checkpoint_saver.close()
+        self.summaries.close()
+        self.artifacts.close()
@@ -1,6 +1,7 @@
 from models.wgancls.model import WGanCls
 from utils.utils import save_images, get_balanced_factorization, make_gif
 from utils.saver import load
+from utils.cond_cache import ConditionalsCache
 from utils.visualize import *
 from utils.ops import NHWC
 from preprocess.dataset import TextDataset
@@ -17,10 +18,12 @@ class WGanClsVisualizer(object):
         self.samples_dir = self.config.SAMPLE_DIR
 
     def visualize(self):
-        z = tf.placeholder(tf.float32, [self.model.batch_size, self.model.z_dim], name='z')
-        phi = tf.placeholder(tf.float32, [self.model.batch_size] + [self.model.embed_dim], name='cond')
-        gen, _, _ = self.model.generator(z, phi, is_training=False)
-        gen_no_noise, _, _ = self.model.generator(z, phi, reuse=True, is_training=False, cond_noise=False)
+        z = tf.placeholder(tf.float32, [None, self.model.z_dim], name='z')
+        # The conditioning augmentation statistics of each caption are computed once and reused across the z draws
+        cond_cache = ConditionalsCache(self.sess, self.model, None)
+        gen, _, _ = self.model.generator(z, None, is_training=False, cond_stats=cond_cache.cond_stats)
+        gen_no_noise, _, _ = self.model.generator(z, None, reuse=True, is_training=False, cond_noise=False,
+                                                  cond_stats=cond_cache.cond_stats)
 
         saver = tf.train.Saver(tf.global_variables('g_net'))
         could_load, _ = load(saver, self.sess, self.config.CHECKPOINT_DIR)
@@ -40,7 +43,8 @@ class WGanClsVisualizer(object):
             cond = np.squeeze(cond, axis=0)
             caption = captions[0][0]
 
-            samples = gen_noise_interp_img(self.sess, gen_no_noise, cond, self.model.z_dim, self.model.batch_size)
+            samples = gen_noise_interp_img(self.sess, gen_no_noise, cond, self.model.z_dim, self.model.batch_size,
+                                           cond_cache=cond_cache)
             save_cap_batch(samples, caption, '{}/{}_visual/z_interp/z_interp{}.png'.format(self.samples_dir,
                                                                                            self.dataset.name,
                                                                                            idx))
@@ -52,7 +56,7 @@ class WGanClsVisualizer(object):
             cap1, cap2 = caps[0][0], caps[1][0]
 
             samples = gen_cond_interp_img(self.sess, gen_no_noise, cond1, cond2, self.model.z_dim,
-                                          self.model.batch_size)
+                                          self.model.batch_size, cond_cache=cond_cache)
             save_interp_cap_batch(samples, cap1, cap2,
                                   '{}/{}_visual/cond_interp/cond_interp{}.png'.format(self.samples_dir,
                                                                                       self.dataset.name,
@@ -66,7 +70,8 @@ class WGanClsVisualizer(object):
             _, conditions, _, captions = self.dataset.test.next_batch_test(1, dataset_pos, 1)
             conditions = np.squeeze(conditions, axis=0)
             caption = captions[0][0]
-            samples = gen_captioned_img(self.sess, gen, conditions, self.model.z_dim, self.model.batch_size)
+            samples = gen_captioned_img(self.sess, gen, conditions, self.model.z_dim, self.model.batch_size,
+                                        cond_cache=cond_cache)
 
             save_cap_batch(samples, caption, '{}/{}_visual/cap/cap{}.png'.format(self.samples_dir,
                                                                                  self.dataset.name, idx))
@@ -77,7 +82,8 @@ class WGanClsVisualizer(object):
             _, conditions, _, captions = self.dataset.test.next_batch_test(1, special_pos, 1)
             conditions = np.squeeze(conditions, axis=0)
             caption = captions[0][0]
-            samples = gen_captioned_img(self.sess, gen, conditions, self.model.z_dim, self.model.batch_size)
+            samples = gen_captioned_img(self.sess, gen, conditions, self.model.z_dim, self.model.batch_size,
+                                        cond_cache=cond_cache)
 
             save_cap_batch(samples, caption, '{}/{}_visual/special_cap/cap{}.png'.format(self.samples_dir,
                                                                                          self.dataset.name, idx))
@@ -87,7 +93,7 @@ class WGanClsVisualizer(object):
         _, conditions, _, _ = self.dataset.test.next_batch_test(self.model.batch_size, dataset_pos, 1)
         conditions = np.squeeze(conditions)
         samples, neighbours = gen_closest_neighbour_img(self.sess, gen, conditions, self.model.z_dim,
-                                                        self.model.batch_size, self.dataset)
+                                                        self.model.batch_size, self.dataset, cond_cache=cond_cache)
         batch = np.concatenate([samples, neighbours])
         text = 'Generated images and their closest neighbours'
         save_cap_batch(batch, text, '{}/{}_visual/neighb/neighb.png'.format(self.samples_dir,
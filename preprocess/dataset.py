@@ -3,7 +3,8 @@ Parts of this code are taken from: https://github.com/hanzhanggit/StackGAN/blob/
 """
 
 import numpy as np
-from sklearn.externals import joblib
+from preprocess.embedding_store import EmbeddingStore
+from preprocess.sampler import ClassSampler, SAMPLING_MODES
 import pickle
 import random
 import os
@@ -25,7 +26,15 @@ class Dataset(object):
     def __init__(self, images, imsize, embeddings=None,
                  filenames=None, workdir=None,
                  labels=None, aug_flag=True,
-                 class_id=None, class_range=None):
+                 class_id=None, class_range=None, sampling='shuffle', image_cache=None, cache_key=None):
+        """
+        :arg sampling: the order of the training batches: 'shuffle' (uniformly shuffled epochs), 'stratified'
+            (every batch has approximately the class frequencies of the dataset) or 'balanced' (the classes are
+            equally represented in every batch)
+        :arg image_cache: an optional NormalizedImageCache the normalized images are read from, under cache_key
+        """
+        if sampling not in SAMPLING_MODES:
+            raise ValueError('Unknown sampling %s. Use one of %s' % (sampling, SAMPLING_MODES))
         self._images = images
         self._embeddings = embeddings
         self._filenames = filenames
@@ -42,6 +51,10 @@ class Dataset(object):
         self._class_range = class_range
         self._imsize = imsize
         self._perm = None
+        self._sampling = sampling
+        self._sampler = ClassSampler(class_id) if class_id is not None else None
+        self._image_cache = image_cache
+        self._cache_key = cache_key if cache_key is not None else id(images)
 
     @property
     def images(self):
@@ -80,6 +93,16 @@ class Dataset(object):
         captions = [cap for cap in captions if len(cap) > 0]
         return captions
 
+    def normalized_images(self, ids):
+        """Returns the images with the given ids (or slice) scaled to [-1, 1]"""
+        if self._image_cache is not None:
+            normalized = self._image_cache.get(self._cache_key, self._images)
+            if normalized is not None:
+                return normalized[ids]
+
+        images = self._images[ids].astype(np.float32)
+        return images * (2. / 255) - 1.
+
     def transform(self, images):
         if self._aug_flag:
             transformed_images = np.zeros([images.shape[0], self._imsize, self._imsize, 3])
@@ -98,7 +121,7 @@ class Dataset(object):
     def sample_embeddings(self, embeddings, filenames, class_id, sample_num):
         """Returns a mean of the specified number of embeddings (5 available per image)"""
         if len(embeddings.shape) == 2 or embeddings.shape[1] == 1:
-            return np.squeeze(embeddings)
+            return np.reshape(embeddings, (len(embeddings), -1))
         else:
             batch_size, embedding_num, _ = embeddings.shape
             # Take every sample_num captions to compute the mean vector
@@ -117,7 +140,8 @@ class Dataset(object):
                     e_mean = np.mean(e_sample, axis=0)
                     sampled_embeddings.append(e_mean)
             sampled_embeddings_array = np.array(sampled_embeddings)
-            return np.squeeze(sampled_embeddings_array), sampled_captions
+            # Keeps the batch dimension of a batch of a single example
+            return np.reshape(sampled_embeddings_array, (batch_size, -1)), sampled_captions
 
     def next_batch(self, batch_size, window=None, wrong_img=False, embeddings=False, labels=False):
         """Return the next `batch_size` examples from this data set.
@@ -134,9 +158,12 @@ class Dataset(object):
         if self._index_in_epoch > self._num_examples:
             # Finished epoch
             self._epochs_completed += 1
-            # Shuffle the .data
-            self._perm = np.arange(self._num_examples)
-            np.random.shuffle(self._perm)
+            if self._sampling == 'stratified':
+                self._perm = self._sampler.epoch_order('stratified')
+            elif self._sampling == 'shuffle':
+                # Shuffle the .data
+                self._perm = np.arange(self._num_examples)
+                np.random.shuffle(self._perm)
 
             # Start next epoch
             start = 0
@@ -144,21 +171,19 @@ class Dataset(object):
             assert batch_size <= self._num_examples
         end = self._index_in_epoch
 
-        current_ids = self._perm[start:end]
-        sampled_images = self._images[current_ids]
-        sampled_images = sampled_images.astype(np.float32)
-        sampled_images = sampled_images * (2. / 255) - 1.
+        if self._sampling == 'balanced':
+            # The balanced batches are drawn independently, an epoch being num_examples drawn examples
+            current_ids = self._sampler.balanced_batch(batch_size)
+        else:
+            current_ids = self._perm[start:end]
+        sampled_images = self.normalized_images(current_ids)
         sampled_images = self.transform(sampled_images)
         ret_list = [sampled_images]
 
         if wrong_img:
-            fake_ids = np.random.randint(self._num_examples, size=batch_size)
-            collision_flag = (self._class_id[current_ids] == self._class_id[fake_ids])
-            fake_ids[collision_flag] = (fake_ids[collision_flag] + np.random.randint(100, 200)) % self._num_examples
-
-            sampled_wrong_images = self._images[fake_ids, :, :, :]
-            sampled_wrong_images = sampled_wrong_images.astype(np.float32)
-            sampled_wrong_images = sampled_wrong_images * (2. / 255) - 1.
+            # Mismatching images, always from a different class than the one of the matching image
+            fake_ids = self._sampler.mismatch(current_ids)
+            sampled_wrong_images = self.normalized_images(fake_ids)
             sampled_wrong_images = self.transform(sampled_wrong_images)
             ret_list.append(sampled_wrong_images)
         else:
@@ -191,9 +216,7 @@ class Dataset(object):
         else:
             end = start + batch_size
 
-        sampled_images = self._images[start:end]
-        sampled_images = sampled_images.astype(np.float32)
-        sampled_images = sampled_images * (2. / 255) - 1.
+        sampled_images = self.normalized_images(slice(start, end))
         sampled_images = self.transform(sampled_images)
 
         sampled_embeddings = self._embeddings[start:end]
@@ -210,7 +233,7 @@ class Dataset(object):
 
         for i in range(np.minimum(max_captions, embedding_num)):
             batch = sampled_embeddings[:, i, :]
-            sampled_embeddings_batchs.append(np.squeeze(batch))
+            sampled_embeddings_batchs.append(np.reshape(batch, (len(batch), -1)))
 
         return [sampled_images, sampled_embeddings_batchs,
                 self._saveIDs[start:end], sampled_captions]
@@ -227,7 +250,12 @@ class Dataset(object):
 
 
 class TextDataset(object):
-    def __init__(self, workdir, size):
+    def __init__(self, workdir, size, embedding_dtype=None, image_cache=None):
+        """
+        :arg embedding_dtype: load the embeddings from the memory-mapped float16 or int8 store built with
+            preprocess/embedding_store.py instead of the pickle
+        :arg image_cache: an optional NormalizedImageCache shared by the splits of all the resolutions
+        """
         self.size = size
         if size not in FINAL_SIZE_TO_ORIG:
             raise RuntimeError('Size {} not supported'.format(size))
@@ -243,6 +271,8 @@ class TextDataset(object):
         self._dataset_name = os.path.basename(os.path.normpath(workdir))
 
         self.embedding_filename = '/char-CNN-RNN-embeddings.pickle'
+        self.embedding_dtype = embedding_dtype
+        self.image_cache = image_cache
 
     @property
     def train(self) -> Dataset:
@@ -260,16 +290,23 @@ class TextDataset(object):
     def test(self, test):
         self._test = test
 
-    def get_data(self, pickle_path, aug_flag=True) -> Dataset:
+    def get_data(self, pickle_path, aug_flag=True, sampling='shuffle') -> Dataset:
+        from sklearn.externals import joblib
+
         images = joblib.load(pickle_path + self.image_filename)
         images = np.array(images)
         print('Image shape: ', images.shape)
 
-        with open(pickle_path + self.embedding_filename, 'rb') as f:
-            embeddings = pickle.load(f, encoding='bytes')
-            embeddings = np.array(embeddings)
+        if self.embedding_dtype:
+            embeddings = EmbeddingStore(pickle_path, self.embedding_dtype)
             self.embedding_shape = [embeddings.shape[-1]]
-            print('embeddings: ', embeddings.shape)
+            print('embeddings (%s store): ' % self.embedding_dtype, embeddings.shape)
+        else:
+            with open(pickle_path + self.embedding_filename, 'rb') as f:
+                embeddings = pickle.load(f, encoding='bytes')
+                embeddings = np.array(embeddings)
+                self.embedding_shape = [embeddings.shape[-1]]
+                print('embeddings: ', embeddings.shape)
         with open(pickle_path + '/filenames.pickle', 'rb') as f:
             list_filenames = pickle.load(f)
             print('list_filenames: ', len(list_filenames), list_filenames[0])
@@ -282,7 +319,8 @@ class TextDataset(object):
 
         return Dataset(images, self.image_shape[0], embeddings,
                        list_filenames, self.workdir, class_id,
-                       aug_flag, class_id)
+                       aug_flag, class_id, sampling=sampling, image_cache=self.image_cache,
+                       cache_key=(os.path.normpath(pickle_path), self.image_filename))
 
     @property
     def name(self):
@@ -0,0 +1,199 @@
+"""
+Compact, memory-mapped storage of the char-CNN-RNN embeddings.
+
+The embeddings of a split are stored next to char-CNN-RNN-embeddings.pickle either as float16 or as int8 with one
+float32 scale per (example, caption) row. The files are memory mapped, so several processes share the same pages
+and only the rows gathered for a batch are read and dequantized to float32. Build the stores and report the
+quantization error with:
+
+    python preprocess/embedding_store.py --dataset_dir=./data/flowers/ --dtype=int8
+
+Passing the config and the checkpoint of a model also reports the effect on the generated images:
+
+    python preprocess/embedding_store.py --dataset_dir=./data/flowers/ --dtype=int8 --model=wgancls \
+        --cfg=./models/wgancls/cfg/flowers.yml
+"""
+import os
+import pickle
+
+import numpy as np
+
+DTYPES = ['float16', 'int8']
+EMBEDDING_PICKLE = 'char-CNN-RNN-embeddings.pickle'
+
+
+def get_store_path(split_dir, dtype):
+    return os.path.join(split_dir, 'char-CNN-RNN-embeddings.%s.npy' % dtype)
+
+
+def get_scale_path(split_dir):
+    return os.path.join(split_dir, 'char-CNN-RNN-embeddings.int8.scale.npy')
+
+
+def quantize(embeddings, dtype):
+    """Returns the embeddings in the given dtype and, for int8, the per-row scales"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype == 'float16':
+        return embeddings.astype(np.float16), None
+    if dtype == 'int8':
+        scale = np.max(np.abs(embeddings), axis=-1) / 127.
+        scale[scale == 0] = 1.
+        values = np.round(embeddings / scale[..., None])
+        return np.clip(values, -127, 127).astype(np.int8), scale.astype(np.float32)
+    raise ValueError('Unknown embedding dtype %s. Use one of %s' % (dtype, DTYPES))
+
+
+def dequantize(values, scale=None):
+    values = values.astype(np.float32)
+    if scale is not None:
+        values *= scale[..., None]
+    return values
+
+
+def save_embedding_store(embeddings, split_dir, dtype):
+    """Writes the quantized embeddings of a split"""
+    values, scale = quantize(embeddings, dtype)
+    np.save(get_store_path(split_dir, dtype), values)
+    if scale is not None:
+        np.save(get_scale_path(split_dir), scale)
+
+
+def has_embedding_store(split_dir, dtype):
+    return os.path.exists(get_store_path(split_dir, dtype))
+
+
+class EmbeddingStore(object):
+    """
+    Read-only, memory-mapped embeddings of shape (examples, captions, dim). Indexing with up to two indices (the
+    examples and the captions) returns the gathered rows dequantized to float32, like indexing the original array.
+    """
+
+    def __init__(self, split_dir, dtype):
+        if not has_embedding_store(split_dir, dtype):
+            raise RuntimeError('No %s embedding store in %s. Build it with preprocess/embedding_store.py'
+                               % (dtype, split_dir))
+        self.dtype = dtype
+        self._values = np.load(get_store_path(split_dir, dtype), mmap_mode='r')
+        self._scale = np.load(get_scale_path(split_dir), mmap_mode='r') if dtype == 'int8' else None
+
+    @property
+    def shape(self):
+        return self._values.shape
+
+    def __len__(self):
+        return self._values.shape[0]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, tuple) and len(idx) > 2:
+            raise IndexError('Only the examples and the captions can be indexed')
+        scale = None if self._scale is None else self._scale[idx]
+        return dequantize(self._values[idx], scale)
+
+    def __array__(self, dtype=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype)
+
+
+def load_pickled_embeddings(split_dir):
+    with open(os.path.join(split_dir, EMBEDDING_PICKLE), 'rb') as f:
+        return np.array(pickle.load(f, encoding='bytes'), dtype=np.float32)
+
+
+def quantization_error(embeddings, store):
+    """Reports how far the stored embeddings are from the original ones"""
+    stored = store[:]
+    diff = stored - embeddings
+    cosine = np.sum(stored * embeddings, axis=-1) / np.maximum(
+        np.linalg.norm(stored, axis=-1) * np.linalg.norm(embeddings, axis=-1), 1e-12)
+    return {
+        'max_abs_error': float(np.max(np.abs(diff))),
+        'relative_rmse': float(np.sqrt(np.mean(diff ** 2)) / np.sqrt(np.mean(embeddings ** 2))),
+        'min_cosine': float(np.min(cosine)),
+        'original_mb': embeddings.nbytes / 2 ** 20,
+        'stored_mb': (store._values.nbytes + (0 if store._scale is None else store._scale.nbytes)) / 2 ** 20,
+    }
+
+
+def generator_error(model_name, cfg, embeddings, store, num_samples=256, batch_size=64, cfg_stage_i=None, seed=0):
+    """
+    Compares the images generated from the original and the stored embeddings with the same noise. The
+    conditioning augmentation noise is set to 0, so the difference only comes from the embeddings.
+    """
+    import tensorflow as tf
+    from evaluation.shards import build_generator
+    from utils.saver import load
+    from utils.utils import denormalize_images
+
+    rng = np.random.RandomState(seed)
+    examples = rng.randint(embeddings.shape[0], size=num_samples)
+    captions = rng.randint(embeddings.shape[1], size=num_samples)
+
+    diffs = []
+    with tf.Graph().as_default(), tf.Session() as sess:
+        z, cond, gen, checkpoints, cond_noise = build_generator(model_name, cfg, batch_size, cfg_stage_i)
+        for saver, checkpoint_dir in checkpoints:
+            could_load, _ = load(saver, sess, checkpoint_dir)
+            if not could_load:
+                raise RuntimeError('Could not load the checkpoints of the generator from %s' % checkpoint_dir)
+
+        for start in range(0, num_samples - batch_size + 1, batch_size):
+            ex, cap = examples[start:start + batch_size], captions[start:start + batch_size]
+            feed_dict = {z: rng.normal(0, 1, size=(batch_size, z.get_shape().as_list()[1]))}
+            for eps, _ in cond_noise:
+                feed_dict[eps] = np.zeros(eps.get_shape().as_list())
+
+            feed_dict[cond] = embeddings[ex, cap]
+            original = sess.run(gen, feed_dict=feed_dict)
+            feed_dict[cond] = store[ex, cap]
+            stored = sess.run(gen, feed_dict=feed_dict)
+            diffs.append(np.abs(denormalize_images(np.clip(original, -1., 1.)).astype(np.float32) -
+                                denormalize_images(np.clip(stored, -1., 1.)).astype(np.float32)))
+
+    diffs = np.concatenate(diffs)
+    mse = np.mean(diffs ** 2)
+    return {
+        'mean_abs_pixel_diff': float(np.mean(diffs)),
+        'max_abs_pixel_diff': float(np.max(diffs)),
+        'psnr': float('inf') if mse == 0 else float(10 * np.log10(255. ** 2 / mse)),
+    }
+
+
+def main(_):
+    cfg = cfg_stage_i = None
+    if FLAGS.model:
+        from utils.config import config_from_yaml
+        cfg = config_from_yaml(FLAGS.cfg)
+        cfg_stage_i = config_from_yaml(FLAGS.cfg_stage_I) if FLAGS.model == 'stageii' else None
+
+    for split in ['train', 'test']:
+        split_dir = os.path.join(FLAGS.dataset_dir, split)
+        embeddings = load_pickled_embeddings(split_dir)
+        save_embedding_store(embeddings, split_dir, FLAGS.dtype)
+        store = EmbeddingStore(split_dir, FLAGS.dtype)
+
+        print('%s: %s' % (split, get_store_path(split_dir, FLAGS.dtype)))
+        for key, value in quantization_error(embeddings, store).items():
+            print('    %-20s %.6g' % (key, value))
+
+        if FLAGS.model and split == 'test':
+            res = generator_error(FLAGS.model, cfg, embeddings, store, FLAGS.num_samples, FLAGS.batch_size,
+                                  cfg_stage_i)
+            for key, value in res.items():
+                print('    %-20s %.6g' % (key, value))
+
+
+if __name__ == '__main__':
+    import tensorflow as tf
+
+    flags = tf.app.flags
+    flags.DEFINE_string('dataset_dir', './data/flowers/', 'The directory with the train and test splits')
+    flags.DEFINE_string('dtype', 'float16', 'The dtype of the store: float16 or int8 [float16]')
+    flags.DEFINE_string('model', '', 'Optional generator to validate the store with: gancls, wgancls, stagei, stageii')
+    flags.DEFINE_string('cfg', './models/wgancls/cfg/flowers.yml', 'Relative path to the config of the model')
+    flags.DEFINE_string('cfg_stage_I', './models/stackgan/stageI/cfg/flowers.yml',
+                        'Relative path to the config of stage I when validating with stage II')
+    flags.DEFINE_integer('num_samples', 256, 'Number of images compared in the validation [256]')
+    flags.DEFINE_integer('batch_size', 64, 'Batch size of the generator in the validation [64]')
+    FLAGS = flags.FLAGS
+
+    tf.app.run()
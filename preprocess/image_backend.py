@@ -0,0 +1,93 @@
+"""
+Image decoding and resizing backends of the preprocessing.
+
+    scipy: The reference implementation, scipy.misc.imread and bicubic scipy.misc.imresize. The images are decoded to
+        float64 and resized back to uint8. scipy.misc.imread and imresize were removed in scipy 1.2/1.3.
+    pil: Pillow (or a drop-in Pillow-SIMD) decoding and bicubic resizing, uint8 end-to-end. When only a downscaled
+        image is needed, JPEGs are decoded in draft mode, which lets libjpeg decode directly at 1/2, 1/4 or 1/8 of
+        the size, no smaller than the requested size.
+    opencv: OpenCV decoding and bicubic resizing (area interpolation when downscaling), uint8 end-to-end.
+
+The backends resize with different filters and rounding, so their output is not bit-identical to the reference one.
+benchmarks/image_backends.py reports the pixel difference and the throughput of every backend.
+"""
+import numpy as np
+
+BACKENDS = ['scipy', 'pil', 'opencv']
+
+
+class ScipyBackend(object):
+    name = 'scipy'
+
+    def __init__(self):
+        import scipy.misc
+        self.misc = scipy.misc
+
+    def imread(self, path, min_size=None):
+        img = self.misc.imread(path)
+        if len(img.shape) == 0:
+            raise ValueError(path + " got loaded as a dimensionless array!")
+        return img.astype(np.float)
+
+    def resize(self, img, size):
+        return np.array(self.misc.imresize(img, [size, size], 'bicubic'))
+
+
+class PILBackend(object):
+    name = 'pil'
+
+    def __init__(self):
+        from PIL import Image
+        self.Image = Image
+
+    def imread(self, path, min_size=None):
+        img = self.Image.open(path)
+        if min_size is not None and img.format == 'JPEG':
+            img.draft('RGB', (min_size, min_size))
+        if img.mode not in ('RGB', 'RGBA', 'L'):
+            img = img.convert('RGB')
+        return np.asarray(img)
+
+    def resize(self, img, size):
+        img = self.Image.fromarray(np.asarray(img, dtype=np.uint8))
+        return np.asarray(img.resize((size, size), self.Image.BICUBIC))
+
+
+class OpenCVBackend(object):
+    name = 'opencv'
+
+    def __init__(self):
+        import cv2
+        self.cv2 = cv2
+
+    def imread(self, path, min_size=None):
+        img = self.cv2.imread(path, self.cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError('Could not read %s' % path)
+        if img.ndim == 3:
+            code = self.cv2.COLOR_BGRA2RGBA if img.shape[2] == 4 else self.cv2.COLOR_BGR2RGB
+            img = self.cv2.cvtColor(img, code)
+        return img
+
+    def resize(self, img, size):
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        downscale = img.shape[0] > size and img.shape[1] > size
+        interp = self.cv2.INTER_AREA if downscale else self.cv2.INTER_CUBIC
+        return self.cv2.resize(img, (size, size), interpolation=interp)
+
+
+_backends = {}
+
+
+def get_backend(name='scipy'):
+    """Returns the backend with the given name. The backends are created once per process."""
+    if name not in _backends:
+        if name == 'scipy':
+            _backends[name] = ScipyBackend()
+        elif name == 'pil':
+            _backends[name] = PILBackend()
+        elif name == 'opencv':
+            _backends[name] = OpenCVBackend()
+        else:
+            raise ValueError('Unknown image backend %s. Use one of %s' % (name, BACKENDS))
+    return _backends[name]
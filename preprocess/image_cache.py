@@ -0,0 +1,127 @@
+import atexit
+import os
+import re
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+_shared_cache = None
+
+
+class NormalizedImageCache(object):
+    """
+    Least recently used cache of the images of the dataset splits scaled to [-1, 1].
+
+    Every split and resolution is normalized once, in chunks, into a float16 or float32 array kept in RAM or
+    memory-mapped from mmap_dir. The batches are then gathered (or, for contiguous ranges, sliced without a copy)
+    from the normalized array. When adding an entry would exceed the memory budget, the least recently used entries
+    are evicted first. An entry larger than the whole budget is not cached.
+
+    The memory-mapped files of a process are written to their own subdirectory of mmap_dir, which is removed when the
+    process exits. The files left behind by the processes which did not exit cleanly are removed by the next cache.
+    """
+
+    def __init__(self, budget_mb=4096, dtype='float16', mmap_dir=None, chunk_size=256):
+        self.budget = int(budget_mb * 2 ** 20)
+        self.dtype = np.dtype(dtype)
+        self.mmap_dir = mmap_dir
+        self.chunk_size = chunk_size
+        self._entries = OrderedDict()
+        self._num_files = 0
+
+        self._file_dir = None
+        if mmap_dir:
+            if not os.path.exists(mmap_dir):
+                os.makedirs(mmap_dir)
+            remove_stale_files(mmap_dir)
+            self._file_dir = tempfile.mkdtemp(prefix='images_%d_' % os.getpid(), dir=mmap_dir)
+            atexit.register(self.close)
+
+    @property
+    def size(self):
+        """The number of bytes used by the cached entries"""
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def get(self, key, images):
+        """Returns the normalized images of the entry with the given key, building it if needed, or None"""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        nbytes = int(np.prod(images.shape)) * self.dtype.itemsize
+        if nbytes > self.budget:
+            return None
+        while self._entries and self.size + nbytes > self.budget:
+            self._evict()
+
+        self._entries[key] = self._normalize(images)
+        return self._entries[key]
+
+    def _normalize(self, images):
+        if self.mmap_dir:
+            path = os.path.join(self._file_dir, 'images_%d.npy' % self._num_files)
+            self._num_files += 1
+            normalized = np.lib.format.open_memmap(path, mode='w+', dtype=self.dtype, shape=images.shape)
+        else:
+            normalized = np.empty(images.shape, dtype=self.dtype)
+
+        for start in range(0, len(images), self.chunk_size):
+            chunk = images[start:start + self.chunk_size].astype(np.float32)
+            normalized[start:start + self.chunk_size] = chunk * (2. / 255) - 1.
+        return normalized
+
+    def _evict(self):
+        _, entry = self._entries.popitem(last=False)
+        if isinstance(entry, np.memmap):
+            path = entry.filename
+            del entry
+            os.remove(path)
+
+    def clear(self):
+        while self._entries:
+            self._evict()
+
+    def close(self):
+        """Evicts every entry and removes the directory of the memory-mapped files"""
+        self.clear()
+        if self._file_dir is not None:
+            shutil.rmtree(self._file_dir, ignore_errors=True)
+            self._file_dir = None
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_stale_files(mmap_dir):
+    """Removes the memory-mapped files and directories of the caches of processes which are no longer running"""
+    for name in os.listdir(mmap_dir):
+        match = re.match(r'images_(\d+)_', name)
+        if match is None or int(match.group(1)) == os.getpid() or _is_running(int(match.group(1))):
+            continue
+        path = os.path.join(mmap_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def get_image_cache(cache_cfg):
+    """
+    Returns the cache shared by the datasets of the process configured by the IMAGE_CACHE block of a config, or None
+    when the cache is disabled. The cache is created by the first call.
+    """
+    global _shared_cache
+    if cache_cfg is None or not cache_cfg.FLAG:
+        return None
+    if _shared_cache is None:
+        _shared_cache = NormalizedImageCache(cache_cfg.BUDGET_MB, cache_cfg.DTYPE, cache_cfg.MMAP_DIR or None)
+    return _shared_cache
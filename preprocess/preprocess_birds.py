@@ -4,7 +4,7 @@ import numpy as np
 import os
 import pickle
 from preprocess.utils import get_image
-import scipy.misc
+from preprocess.image_backend import get_backend
 import pandas as pd
 from sklearn.externals import joblib
 
@@ -12,6 +12,8 @@ from sklearn.externals import joblib
 IMG_SIZES = [360]
 LOAD_SIZE = 360
 BIRD_DIR = './data/birds'
+# The image decoding and resizing backend: scipy (reference), pil or opencv. See preprocess/image_backend.py
+BACKEND = 'scipy'
 
 
 def load_filenames(data_dir):
@@ -55,12 +57,12 @@ def save_data_list(inpath, outpath, filenames, filename_bbox):
         for idx, key in enumerate(filenames):
             bbox = filename_bbox[key]
             f_name = '%s/CUB_200_2011/images/%s.jpg' % (inpath, key)
-            img = get_image(f_name, LOAD_SIZE, is_crop=True, bbox=bbox)
+            img = get_image(f_name, LOAD_SIZE, is_crop=True, bbox=bbox, backend=BACKEND)
             img = img.astype('uint8')
             img = img.astype('uint8')
 
             if size != LOAD_SIZE:
-                img = scipy.misc.imresize(img, [size, size], 'bicubic')
+                img = get_backend(BACKEND).resize(img, size)
             images[idx, :, :, :] = np.array(img)
 
             cnt += 1
@@ -3,7 +3,7 @@ Parts of this code are taken from: https://github.com/hanzhanggit/StackGAN/blob/
 """
 import os
 from preprocess.utils import get_image
-import scipy.misc
+from preprocess.image_backend import get_backend
 import numpy as np
 from sklearn.externals import joblib
 
@@ -12,6 +12,8 @@ from sklearn.externals import joblib
 IMG_SIZES = [600]
 LOAD_SIZE = 600
 FLOWER_DIR = './data/flowers'
+# The image decoding and resizing backend: scipy (reference), pil or opencv. See preprocess/image_backend.py
+BACKEND = 'scipy'
 
 
 def load_filenames(data_dir):
@@ -32,12 +34,12 @@ def save_data_list(inpath, outpath, filenames):
         images = np.ndarray(shape=(len(filenames), size, size, 3), dtype=np.uint8)
         for idx, key in enumerate(filenames):
             f_name = '%s/%s.jpg' % (inpath, key)
-            img = get_image(f_name, LOAD_SIZE, is_crop=False)
+            img = get_image(f_name, LOAD_SIZE, is_crop=False, backend=BACKEND)
             img = img.astype('uint8')
             img = img.astype('uint8')
 
             if size != LOAD_SIZE:
-                img = scipy.misc.imresize(img, [size, size], 'bicubic')
+                img = get_backend(BACKEND).resize(img, size)
             images[idx, :, :, :] = np.array(img)
 
             cnt += 1
@@ -0,0 +1,61 @@
+import numpy as np
+
+SAMPLING_MODES = ['shuffle', 'stratified', 'balanced']
+
+
+class ClassSampler(object):
+    """
+    Samples the example indices of a dataset using its class ids.
+
+    The indices of every class are precomputed once as a contiguous block of a single array sorted by class, so
+    sampling a batch or the mismatching examples of a batch is vectorized and O(batch):
+        mismatch: For every example, a uniformly random example of a different class. An index is drawn from the
+            complement of the block of the class of the example, so the mismatch is guaranteed.
+        balanced_batch: Every example is drawn from a uniformly random class, so the classes are equally represented
+            regardless of their size.
+        epoch_order: An order of the examples for an epoch. The 'stratified' order spreads the examples of every
+            class evenly over the epoch, so every batch has approximately the class frequencies of the dataset.
+    """
+
+    def __init__(self, class_ids, rng=None):
+        class_ids = np.asarray(class_ids)
+        self.rng = rng if rng is not None else np.random
+
+        self.classes, self.class_idx = np.unique(class_ids, return_inverse=True)
+        self.num_examples = len(class_ids)
+        self.num_classes = len(self.classes)
+        if self.num_classes < 2:
+            raise ValueError('At least two classes are required to sample mismatching examples')
+
+        # The indices sorted by class, and the start and size of the block of every class
+        self.order = np.argsort(self.class_idx, kind='stable')
+        self.counts = np.bincount(self.class_idx, minlength=self.num_classes)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+    def mismatch(self, ids):
+        """Returns, for every given example, a uniformly random example from a different class"""
+        cls = self.class_idx[ids]
+        # Draw a position outside the block of the class and skip over the block
+        pos = (self.rng.random_sample(len(cls)) * (self.num_examples - self.counts[cls])).astype(np.int64)
+        pos += self.counts[cls] * (pos >= self.offsets[cls])
+        return self.order[pos]
+
+    def balanced_batch(self, batch_size):
+        """Returns a batch whose examples are drawn from uniformly random classes"""
+        cls = self.rng.randint(self.num_classes, size=batch_size)
+        pos = (self.rng.random_sample(batch_size) * self.counts[cls]).astype(np.int64)
+        return self.order[self.offsets[cls] + pos]
+
+    def epoch_order(self, mode='shuffle'):
+        """Returns the order of the examples for an epoch"""
+        if mode == 'shuffle':
+            return self.rng.permutation(self.num_examples)
+        if mode == 'stratified':
+            # Shuffle within every class and place the k-th example of a class of n at a random point of [k/n, (k+1)/n)
+            shuffled = self.rng.permutation(self.num_examples)
+            order = shuffled[np.argsort(self.class_idx[shuffled], kind='stable')]
+            cls = self.class_idx[order]
+            rank = np.arange(self.num_examples) - self.offsets[cls]
+            keys = (rank + self.rng.random_sample(self.num_examples)) / self.counts[cls]
+            return order[np.argsort(keys, kind='stable')]
+        raise ValueError('Unknown epoch order %s' % mode)
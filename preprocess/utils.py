@@ -3,15 +3,17 @@ Some codes from
 https://github.com/openai/improved-gan/blob/master/imagenet/utils.py
 """
 import numpy as np
-import scipy.misc
 import os
 import errno
 from preprocess.dataset import TextDataset
+from preprocess.image_backend import get_backend
 
 
-def get_image(image_path, image_size, is_crop=False, bbox=None):
+def get_image(image_path, image_size, is_crop=False, bbox=None, backend='scipy'):
     global index
-    return transform(imread(image_path), image_size, is_crop, bbox)
+    # Without a crop only an image of at least image_size is needed, so the decoder may downscale it
+    min_size = None if is_crop else image_size
+    return transform(imread(image_path, backend, min_size), image_size, is_crop, bbox, backend)
 
 
 def custom_crop(img, bbox):
@@ -36,20 +38,16 @@ def custom_crop(img, bbox):
     return img_cropped
 
 
-def transform(image, image_size, is_crop, bbox):
+def transform(image, image_size, is_crop, bbox, backend='scipy'):
     image = colorize(image)
     if is_crop:
         image = custom_crop(image, bbox)
 
-    transformed_image = scipy.misc.imresize(image, [image_size, image_size], 'bicubic')
-    return np.array(transformed_image)
+    return get_backend(backend).resize(image, image_size)
 
 
-def imread(path):
-    img = scipy.misc.imread(path)
-    if len(img.shape) == 0:
-        raise ValueError(path + " got loaded as a dimensionless array!")
-    return img.astype(np.float)
+def imread(path, backend='scipy', min_size=None):
+    return get_backend(backend).imread(path, min_size)
 
 
 def colorize(img):
@@ -0,0 +1,36 @@
+"""
+Tests of utils.sampling. Run from the root directory of the project with: python -m pytest tests
+"""
+import numpy as np
+
+from utils.sampling import Sampler, Z_STREAM, CAPTION_STREAM, COND_NOISE_STREAM
+
+
+def _overlaps(a, b):
+    """Returns True if a run of 4 consecutive values of a appears in b"""
+    values = set(b.tolist())
+    return any(all(v in values for v in a[i:i + 4]) for i in range(len(a) - 3))
+
+
+def test_neighbouring_z_are_uncorrelated():
+    z = Sampler(0).z(range(8), 256).astype(np.float64)
+    for i in range(len(z) - 1):
+        assert abs(np.corrcoef(z[i], z[i + 1])[0, 1]) < 0.3
+        assert not _overlaps(z[i], z[i + 1])
+        assert not _overlaps(z[i + 1], z[i])
+
+
+def test_neighbouring_streams_do_not_overlap():
+    sampler = Sampler(0)
+    for stream in [Z_STREAM, CAPTION_STREAM, COND_NOISE_STREAM]:
+        draws = [sampler.rng(stream, idx).random(1024) for idx in range(4)]
+        for i in range(len(draws) - 1):
+            assert not _overlaps(draws[i], draws[i + 1])
+            assert not _overlaps(draws[i + 1], draws[i])
+
+
+def test_samples_only_depend_on_the_seed_and_index():
+    sampler = Sampler(3)
+    np.testing.assert_array_equal(sampler.z([5, 6, 7], 100)[1], sampler.z([6], 100)[0])
+    np.testing.assert_array_equal(sampler.cond_noise([2, 9], 128)[1], Sampler(3).cond_noise([9], 128)[0])
+    assert not np.array_equal(sampler.z([5], 100), Sampler(4).z([5], 100))
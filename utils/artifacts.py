@@ -0,0 +1,75 @@
+import io
+import queue
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+from utils.utils import save_images
+
+
+class ArtifactWriter(object):
+    """
+    Writes the sample grids and the image summaries from a background thread. The training loop only pays for the
+    sess.run which produces the images; merging them into a grid, encoding the PNGs and writing the files and the
+    events happens on the worker. At most max_pending artifacts wait to be written, after which the training loop
+    blocks until the worker catches up.
+    """
+
+    def __init__(self, summary_writer: tf.summary.FileWriter = None, max_pending=4):
+        self.summary_writer = summary_writer
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='artifact_writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def save_images(self, images, size, image_path):
+        """Saves the images as a size[0] x size[1] grid. The images are expected to be in [-1, 1]."""
+        self._queue.put((save_images, (np.copy(images), size, image_path)))
+
+    def add_images(self, tag, images, step, max_outputs=3):
+        """Writes the first max_outputs images as an image summary like tf.summary.image. The images are expected
+        to be in [-1, 1]."""
+        if self.summary_writer is None:
+            raise RuntimeError('The artifact writer was created without a summary writer')
+        self._queue.put((self._write_image_summary, (tag, np.copy(images[:max_outputs]), step)))
+
+    def close(self):
+        """Writes the remaining artifacts and stops the background thread"""
+        self._queue.put(None)
+        self._thread.join()
+        if self.summary_writer is not None:
+            self.summary_writer.flush()
+
+    def _write_image_summary(self, tag, images, step):
+        from PIL import Image
+
+        values = []
+        for idx, image in enumerate(images):
+            image = ((np.clip(image, -1., 1.) + 1.0) * 127.5).astype(np.uint8)
+            if image.shape[-1] == 1:
+                image = image[:, :, 0]
+
+            buffer = io.BytesIO()
+            Image.fromarray(image).save(buffer, format='PNG')
+            name = '%s/image' % tag if len(images) == 1 else '%s/image/%d' % (tag, idx)
+            values.append(tf.Summary.Value(tag=name, image=tf.Summary.Image(height=image.shape[0],
+                                                                            width=image.shape[1],
+                                                                            colorspace=images.shape[-1],
+                                                                            encoded_image_string=buffer.getvalue())))
+        self.summary_writer.add_summary(tf.Summary(value=values), step)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            fn, args = item
+            try:
+                fn(*args)
+            except Exception as e:
+                print("Failed to write artifact")
+                print(type(e))
+                print(e.args)
+                print(e)
@@ -0,0 +1,122 @@
+import csv
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from preprocess.dataset import Dataset, TextDataset, FINAL_SIZE_TO_ORIG
+
+
+def synthetic_text_dataset(size, num_examples=64, embed_dim=1024, num_embeddings=10, num_classes=20, seed=0):
+    """
+    Builds a TextDataset with random in-memory data of the same shape and type as the pickled datasets, so the
+    models can be benchmarked without downloading the data. The images are stored at their original size and
+    cropped by the Dataset exactly like the real ones.
+
+    Parameters:
+        size: The size of the images returned by the dataset
+        num_examples: The number of examples of both the train and the test split
+        embed_dim: The dimension of the text embeddings
+        num_embeddings: The number of embeddings per image
+        num_classes: The number of classes the examples are split into
+        seed: The seed of the random data
+    """
+    rng = np.random.RandomState(seed)
+    orig_size = FINAL_SIZE_TO_ORIG[size]
+
+    dataset = TextDataset('./data/synthetic/', size)
+    dataset.embedding_shape = [embed_dim]
+
+    def split():
+        images = rng.randint(0, 256, size=(num_examples, orig_size, orig_size, 3)).astype(np.uint8)
+        embeddings = rng.normal(0, 1, size=(num_examples, num_embeddings, embed_dim)).astype(np.float32)
+        filenames = ['synthetic/image_%05d' % idx for idx in range(num_examples)]
+        class_id = np.arange(num_examples) % num_classes
+        return Dataset(images, size, embeddings, filenames, dataset.workdir, class_id, True, class_id)
+
+    dataset.train = split()
+    dataset.test = split()
+    return dataset
+
+
+class PhaseTimer(object):
+    """Records the wall time spent in each phase of a training step"""
+
+    def __init__(self):
+        self.times = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times.setdefault(name, []).append(time.perf_counter() - start)
+
+    def reset(self):
+        self.times = OrderedDict()
+
+    def summary(self):
+        """Returns the number of calls, the total time and the mean/median/p90 time in ms of each phase"""
+        res = OrderedDict()
+        for name, times in self.times.items():
+            times = np.array(times)
+            res[name] = OrderedDict([
+                ('count', len(times)),
+                ('total_s', float(np.sum(times))),
+                ('mean_ms', float(np.mean(times) * 1000)),
+                ('p50_ms', float(np.percentile(times, 50) * 1000)),
+                ('p90_ms', float(np.percentile(times, 90) * 1000)),
+            ])
+        return res
+
+
+def peak_memory_bytes(run_metadata):
+    """
+    Returns the peak number of bytes in use by the allocators during a session call run with a full trace, as
+    recorded after every op in the step stats of run_metadata. Only the allocators which keep statistics (e.g. the
+    GPU BFC allocator) record their usage. For the others, the largest memory allocated by a single op is returned,
+    which is a lower bound, and the second value is False.
+    """
+    allocator_peak, op_peak = 0, 0
+    for dev_stats in run_metadata.step_stats.dev_stats:
+        for node_stats in dev_stats.node_stats:
+            for memory in node_stats.memory:
+                allocator_peak = max(allocator_peak, memory.allocator_bytes_in_use)
+                op_peak = max(op_peak, memory.peak_bytes)
+    if allocator_peak > 0:
+        return allocator_peak, True
+    return op_peak, False
+
+
+def flatten_result(result):
+    """Flattens the per-phase statistics of a result into columns such as d_step_mean_ms"""
+    row = OrderedDict((key, value) for key, value in result.items() if key != 'phases')
+    for name, stats in result.get('phases', {}).items():
+        for stat, value in stats.items():
+            row['%s_%s' % (name, stat)] = value
+    return row
+
+
+def write_results(results, json_path=None, csv_path=None):
+    """Writes a list of benchmark results as JSON and/or CSV"""
+    if json_path:
+        if os.path.dirname(json_path) and not os.path.exists(os.path.dirname(json_path)):
+            os.makedirs(os.path.dirname(json_path))
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if csv_path:
+        if os.path.dirname(csv_path) and not os.path.exists(os.path.dirname(csv_path)):
+            os.makedirs(os.path.dirname(csv_path))
+        rows = [flatten_result(result) for result in results]
+        columns = []
+        for row in rows:
+            columns += [column for column in row if column not in columns]
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,76 @@
+import numpy as np
+import tensorflow as tf
+
+
+class ConditionalsCache(object):
+    """
+    Caches the (mean, log_sigma) of the conditioning augmentation of the embeddings, so the embedding projection of
+    the generator is run once per unique embedding instead of once per generated sample.
+
+    The graph is built with a model which has a conditionals method (WGanCls, StackGAN and PGGAN). The statistics of
+    the dataset embeddings are keyed by the dataset row and the index of the caption, so a cache should only be used
+    with one split, while arbitrary embeddings (e.g. interpolations) are keyed by their content. Generators built
+    with the mean and log_sigma placeholders of the cache as cond_stats are fed through feed_dict. With a batch_size
+    of None the placeholders accept batches of any size.
+    """
+
+    def __init__(self, sess: tf.Session, model, batch_size, name='cond_cache'):
+        self.sess = sess
+        self.batch_size = batch_size
+        self._cache = {}
+
+        with tf.name_scope(name):
+            self.embed = tf.placeholder(tf.float32, [None, model.embed_dim], name='embed')
+        self.mean_op, self.log_sigma_op = model.conditionals(self.embed)
+
+        dim = self.mean_op.get_shape().as_list()[-1]
+        self.mean = tf.placeholder(tf.float32, [batch_size, dim], name='cond_mean')
+        self.log_sigma = tf.placeholder(tf.float32, [batch_size, dim], name='cond_log_sigma')
+
+    @property
+    def cond_stats(self):
+        """The placeholders to pass to the generator as cond_stats"""
+        return self.mean, self.log_sigma
+
+    def stats(self, embeddings, keys=None):
+        """
+        Returns the mean and log_sigma of the given embeddings. Only the embeddings which are not in the cache are run
+        through the projection, in a single batch.
+
+        Parameters:
+            embeddings: The embeddings of shape [n, embed_dim]
+            keys: Optional hashable keys of the embeddings. By default an embedding is keyed by its content.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if keys is None:
+            keys = [embed.tobytes() for embed in embeddings]
+
+        missing = {}
+        for key, embed in zip(keys, embeddings):
+            if key not in self._cache and key not in missing:
+                missing[key] = embed
+        if missing:
+            means, log_sigmas = self.sess.run([self.mean_op, self.log_sigma_op],
+                                              feed_dict={self.embed: np.stack(list(missing.values()))})
+            for key, mean, log_sigma in zip(missing.keys(), means, log_sigmas):
+                self._cache[key] = (mean, log_sigma)
+
+        means, log_sigmas = zip(*[self._cache[key] for key in keys])
+        return np.stack(means), np.stack(log_sigmas)
+
+    def dataset_stats(self, dataset, rows, caption_ids):
+        """Returns the mean and log_sigma of the embeddings with the given caption indices of the given dataset rows"""
+        embeddings = dataset.embeddings[rows, caption_ids]
+        keys = [(int(row), int(cap)) for row, cap in zip(rows, caption_ids)]
+        return self.stats(embeddings, keys)
+
+    def feed_dict(self, embeddings, keys=None):
+        """The feed dict of the cond_stats of a batch of embeddings"""
+        mean, log_sigma = self.stats(embeddings, keys)
+        return {self.mean: mean, self.log_sigma: log_sigma}
+
+    def clear(self):
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._cache)
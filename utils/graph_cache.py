@@ -0,0 +1,85 @@
+"""
+Cache of built training graphs.
+
+Building a training graph runs the Python code of the model and the tf.gradients of the losses, which takes a
+noticeable time for the large graphs, e.g. the high PGGAN stages with their double-backprop gradient penalty. A
+built graph is exported as a MetaGraph in which the tensors and ops the training loop uses are stored in named
+collections, together with its savers. On the next run with the same parameters the MetaGraph is imported instead.
+
+A cached graph is keyed by the parameters it was built with, the version of TensorFlow and the source files of the
+code building it, so editing the model invalidates it. Only the graph is cached: the variables are still initialized
+or restored from the checkpoints as usual.
+"""
+import hashlib
+import json
+import os
+
+import tensorflow as tf
+
+COLLECTION_PREFIX = 'graph_cache/'
+SAVER_NAMES = 'graph_cache_savers'
+
+
+def graph_key(params, source_files=()):
+    """Returns the key of the graph built with the given JSON serializable params by the code of the source files"""
+    h = hashlib.sha1()
+    h.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    h.update(tf.__version__.encode('utf-8'))
+    for path in sorted(source_files):
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def get_graph_path(cache_dir, name, key):
+    return os.path.join(cache_dir, '%s_%s.meta' % (name, key[:16]))
+
+
+def has_graph(path):
+    return os.path.exists(path)
+
+
+def export_graph(path, tensors, savers):
+    """
+    Exports the default graph to path.
+
+    Parameters:
+        tensors: A dict from a name to a tensor or op of the graph. None values are skipped.
+        savers: A dict from a name to a tf.train.Saver of the graph. None values are skipped.
+    """
+    graph = tf.get_default_graph()
+    for name, value in tensors.items():
+        if value is not None:
+            graph.add_to_collection(COLLECTION_PREFIX + name, value)
+    for name, saver in savers.items():
+        if saver is not None:
+            graph.add_to_collection(tf.GraphKeys.SAVERS, saver)
+            graph.add_to_collection(SAVER_NAMES, name.encode('utf-8'))
+
+    cache_dir = os.path.dirname(path)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    # The MetaGraph needs a saver def, otherwise the import builds a new saver of all the variables
+    saver_def = next((saver.saver_def for saver in savers.values() if saver is not None), None)
+    # Written to a temporary file first, so an interrupted export never leaves an incomplete graph behind
+    tf.train.export_meta_graph(filename=path + '.tmp', saver_def=saver_def, clear_devices=True)
+    os.replace(path + '.tmp', path)
+
+
+def import_graph(path, tensor_names, saver_names):
+    """
+    Imports the graph exported to path into the default graph. Returns a dict from each of the tensor names to its
+    tensor or op and a dict from each of the saver names to its saver. Names which were not exported map to None.
+    """
+    tf.train.import_meta_graph(path, clear_devices=True)
+    graph = tf.get_default_graph()
+
+    tensors = {}
+    for name in tensor_names:
+        values = graph.get_collection(COLLECTION_PREFIX + name)
+        tensors[name] = values[0] if values else None
+
+    exported = dict(zip([name.decode('utf-8') for name in graph.get_collection(SAVER_NAMES)],
+                        graph.get_collection(tf.GraphKeys.SAVERS)))
+    savers = {name: exported.get(name) for name in saver_names}
+    return tensors, savers
@@ -1,7 +1,18 @@
+import os
+from contextlib import contextmanager
+
 import tensorflow as tf
 
 NHWC = 'NHWC'
 NCHW = 'NCHW'
+# Selects the data format of the models per device, see get_data_format
+AUTO = 'auto'
+
+# XLA JIT compilation modes of the training steps
+XLA_OFF = 'off'
+XLA_SCOPED = 'scoped'
+XLA_GLOBAL = 'global'
+XLA_MODES = [XLA_OFF, XLA_SCOPED, XLA_GLOBAL]
 
 
 def batch_norm(x, train, init=None, act=None, name=None, eps=1e-5, decay=0.9, df=NHWC):
@@ -17,16 +28,19 @@ def batch_norm(x, train, init=None, act=None, name=None, eps=1e-5, decay=0.9, df
         name: Name of the layer
     """
 
-    return tf.contrib.layers.batch_norm(x,
-                                        decay=decay,
-                                        epsilon=eps,
-                                        scale=True,
-                                        param_initializers=init,
-                                        is_training=train,
-                                        scope=name,
-                                        fused=True,
-                                        activation_fn=act,
-                                        data_format=df)
+    # The normalization statistics are always computed in float32
+    dtype = x.dtype.base_dtype
+    x = tf.contrib.layers.batch_norm(tf.cast(x, tf.float32),
+                                     decay=decay,
+                                     epsilon=eps,
+                                     scale=True,
+                                     param_initializers=init,
+                                     is_training=train,
+                                     scope=name,
+                                     fused=True,
+                                     activation_fn=act,
+                                     data_format=df)
+    return tf.cast(x, dtype)
 
 
 def batch_renorm(x, train, init=None, act=None, name=None, eps=1e-5, decay=0.9, df=NHWC):
@@ -42,17 +56,19 @@ def batch_renorm(x, train, init=None, act=None, name=None, eps=1e-5, decay=0.9,
         name: Name of the layer
     """
 
-    return tf.contrib.layers.batch_norm(x,
-                                        decay=decay,
-                                        epsilon=eps,
-                                        scale=True,
-                                        param_initializers=init,
-                                        is_training=train,
-                                        scope=name,
-                                        fused=True,
-                                        activation_fn=act,
-                                        renorm=True,
-                                        data_format=df)
+    dtype = x.dtype.base_dtype
+    x = tf.contrib.layers.batch_norm(tf.cast(x, tf.float32),
+                                     decay=decay,
+                                     epsilon=eps,
+                                     scale=True,
+                                     param_initializers=init,
+                                     is_training=train,
+                                     scope=name,
+                                     fused=True,
+                                     activation_fn=act,
+                                     renorm=True,
+                                     data_format=df)
+    return tf.cast(x, dtype)
 
 
 def conv2d(x, f, ks=(4, 4), s=(2, 2), padding='SAME', act=None, init=None, name=None, df=NHWC):
@@ -71,6 +87,80 @@ def conv2d_transpose(x, f, ks=(4, 4), s=(2, 2), padding='SAME', act=None, init=N
                                               weights_initializer=init, scope=name, data_format=df)
 
 
+def _conv_variables(x, f, ks, init, df):
+    """Creates the weights [kh, kw, in, out] and the biases of a conv2d layer with the same names and shapes"""
+    if init is None:
+        init = tf.contrib.layers.variance_scaling_initializer(factor=2.0, mode='FAN_IN', uniform=False)  # He init
+    dtype = x.dtype.base_dtype
+    in_channels = x.get_shape().as_list()[1 if df == NCHW else -1]
+    weights = tf.get_variable('weights', shape=list(ks) + [in_channels, f], dtype=dtype, initializer=init)
+    biases = tf.get_variable('biases', shape=[f], dtype=dtype, initializer=tf.zeros_initializer())
+    return weights, biases
+
+
+def _sum_taps(weights):
+    """
+    Sums the taps of a [kh, kw, in, out] kernel over every 2x2 block of positions, which gives a [kh + 1, kw + 1, in,
+    out] kernel. Every pixel of an input upscaled by 2 is read by the taps of a 2x2 block and every pixel of an output
+    downscaled by 2 averages the outputs of 2x2 shifted kernels.
+    """
+    weights = tf.pad(weights, [[1, 1], [1, 1], [0, 0], [0, 0]])
+    return weights[1:, 1:] + weights[:-1, 1:] + weights[1:, :-1] + weights[:-1, :-1]
+
+
+def upscale_conv2d(x, f, ks=(3, 3), act=None, init=None, name=None, df=NHWC):
+    """
+    Fused nearest neighbour upscale by 2 and conv2d, equivalent to conv2d(upscale(x, 2), f, ks, s=(1, 1)).
+
+    The conv is computed as a stride 2 transposed conv of x with the summed taps of the kernel, so the 4x larger
+    upscaled input is never materialized and a 3x3 kernel needs 16 instead of 36 multiply-adds per input pixel. The
+    variables are the ones of conv2d, so the checkpoints of the two are interchangeable.
+    """
+    if ks[0] % 2 == 0 or ks[1] % 2 == 0:
+        raise ValueError('The fused upscale requires an odd kernel size, got %s' % (ks,))
+    with tf.variable_scope(name, default_name='Conv'):
+        weights, biases = _conv_variables(x, f, ks, init, df)
+        # The transposed conv scatters the input with the kernel as is, while conv2d correlates it, so the kernel is
+        # flipped. The filter of the transposed conv is [kh, kw, out, in].
+        kernel = tf.transpose(tf.reverse(_sum_taps(weights), axis=[0, 1]), [0, 1, 3, 2])
+
+        batch = tf.shape(x)[0]
+        if df == NHWC:
+            _, h, w, _ = x.get_shape().as_list()
+            output_shape, strides = tf.stack([batch, h * 2, w * 2, f]), [1, 2, 2, 1]
+        else:
+            _, _, h, w = x.get_shape().as_list()
+            output_shape, strides = tf.stack([batch, f, h * 2, w * 2]), [1, 1, 2, 2]
+        x = tf.nn.conv2d_transpose(x, kernel, output_shape, strides, padding='SAME', data_format=df)
+        x = tf.nn.bias_add(x, biases, data_format=df)
+        if act is not None:
+            x = act(x)
+        return x
+
+
+def conv2d_downscale(x, f, ks=(3, 3), act=None, init=None, name=None, df=NHWC):
+    """
+    Fused conv2d and average pooling by 2, equivalent to pool(conv2d(x, f, ks, s=(1, 1)), 2) followed by act. The
+    input must have an even height and width.
+
+    The conv is computed with stride 2 and the averaged taps of the kernel, so the full resolution output of the
+    conv is never materialized. The variables are the ones of conv2d, so the checkpoints of the two are
+    interchangeable. The activation is applied after the pooling, so a conv2d with an activation followed by a pool
+    has no fused equivalent.
+    """
+    if ks[0] % 2 == 0 or ks[1] % 2 == 0:
+        raise ValueError('The fused downscale requires an odd kernel size, got %s' % (ks,))
+    with tf.variable_scope(name, default_name='Conv'):
+        weights, biases = _conv_variables(x, f, ks, init, df)
+        kernel = _sum_taps(weights) * 0.25
+        strides = [1, 2, 2, 1] if df == NHWC else [1, 1, 2, 2]
+        x = tf.nn.conv2d(x, kernel, strides, padding='SAME', data_format=df)
+        x = tf.nn.bias_add(x, biases, data_format=df)
+        if act is not None:
+            x = act(x)
+        return x
+
+
 def layer_norm(x, act=None, scope=None, df=NHWC):
     if df == NHWC:
         begin_params_axis = -1
@@ -78,7 +168,10 @@ def layer_norm(x, act=None, scope=None, df=NHWC):
         begin_params_axis = 1
     else:
         raise ValueError('Invalid data format %s' % df)
-    return tf.contrib.layers.layer_norm(x, activation_fn=act, begin_params_axis=begin_params_axis, scope=scope)
+    dtype = x.dtype.base_dtype
+    x = tf.contrib.layers.layer_norm(tf.cast(x, tf.float32), activation_fn=act, begin_params_axis=begin_params_axis,
+                                     scope=scope)
+    return tf.cast(x, dtype)
 
 
 def fc(x, units, act=None, init=None, bias=True, name=None):
@@ -87,6 +180,76 @@ def fc(x, units, act=None, init=None, bias=True, name=None):
     return tf.layers.dense(x, units=units, activation=act, kernel_initializer=init, use_bias=bias, name=name)
 
 
+def float32_variable_getter(getter, name, shape=None, dtype=None, trainable=True, *args, **kwargs):
+    """
+    Custom variable getter for mixed precision training. The trainable variables are always stored in float32
+    (the master weights) and they are cast to the dtype requested by the layer (e.g. float16) when read.
+    """
+    storage_dtype = tf.float32 if trainable else dtype
+    variable = getter(name, shape, dtype=storage_dtype, trainable=trainable, *args, **kwargs)
+    if trainable and dtype is not None and dtype != tf.float32:
+        variable = tf.cast(variable, dtype)
+    return variable
+
+
+def get_compute_dtype(mixed_precision):
+    return tf.float16 if mixed_precision else tf.float32
+
+
+def get_variable_getter(mixed_precision):
+    return float32_variable_getter if mixed_precision else None
+
+
+def check_xla_mode(xla):
+    if xla not in XLA_MODES:
+        raise ValueError('Unknown XLA mode %s. Use one of %s' % (xla, XLA_MODES))
+
+
+@contextmanager
+def jit_scope(xla=XLA_OFF):
+    """
+    In the scoped XLA mode, the ops created in this scope are compiled by XLA into fused clusters. The gradients
+    taken through these ops are compiled as well, so wrapping the forward pass and the losses of D and G covers the
+    whole update except for the optimizer ops. In the other modes this is a no-op.
+    """
+    check_xla_mode(xla)
+    if xla == XLA_SCOPED:
+        with tf.contrib.compiler.jit.experimental_jit_scope(compile_ops=True):
+            yield
+    else:
+        yield
+
+
+CPU_GLOBAL_JIT_FLAG = '--tf_xla_cpu_global_jit'
+
+
+def enable_cpu_global_jit():
+    """
+    Adds the flag which lets the global XLA JIT cluster the ops placed on the CPU to TF_XLA_FLAGS. Without it the
+    global mode does nothing on CPU. The flags are read when the first graph is optimized, so this only takes
+    effect before the first session of the process runs.
+    """
+    flags = os.environ.get('TF_XLA_FLAGS', '')
+    if CPU_GLOBAL_JIT_FLAG not in flags.split():
+        os.environ['TF_XLA_FLAGS'] = (flags + ' ' + CPU_GLOBAL_JIT_FLAG).strip()
+        print('Global XLA JIT on CPU: set TF_XLA_FLAGS=%s. It is ignored if a session has already run in this '
+              'process.' % os.environ['TF_XLA_FLAGS'])
+
+
+def set_xla_jit(config: tf.ConfigProto, xla=XLA_OFF):
+    """
+    Turns on the global XLA JIT compilation of the session config in the global XLA mode, which lets TensorFlow
+    cluster and compile every supported op of the graph. Without a GPU, the TF_XLA_FLAGS flag which the global mode
+    requires on CPU is set as well (see enable_cpu_global_jit).
+    """
+    check_xla_mode(xla)
+    if xla == XLA_GLOBAL:
+        config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+        if not gpu_available():
+            enable_cpu_global_jit()
+    return config
+
+
 def lrelu_act(alpha=0.2):
     return lambda x: tf.nn.leaky_relu(x, alpha)
 
@@ -134,6 +297,76 @@ def to_nhwc(x):
     return tf.transpose(x, [0, 2, 3, 1])
 
 
+_gpu_available = None
+
+
+def gpu_available():
+    """Returns True if TensorFlow can use a GPU. The devices are listed once per process, with allow_growth so
+    that listing them does not reserve the memory of the GPUs."""
+    global _gpu_available
+    if _gpu_available is None:
+        from tensorflow.python.client import device_lib
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        devices = device_lib.list_local_devices(session_config=config)
+        _gpu_available = any(device.device_type == 'GPU' for device in devices)
+    return _gpu_available
+
+
+def get_data_format(data_format=AUTO):
+    """
+    Resolves the DATA_FORMAT of a model config. auto selects NCHW when a GPU is available, since it is the native
+    layout of cuDNN, and NHWC otherwise, since the CPU kernels are faster with it and some only support it.
+    The variables do not depend on the data format, so the checkpoints load in either layout.
+    """
+    if data_format == AUTO:
+        return NCHW if gpu_available() else NHWC
+    if data_format not in (NHWC, NCHW):
+        raise ValueError('Invalid data format %s. Use one of %s' % (data_format, [AUTO, NHWC, NCHW]))
+    return data_format
+
+
+def to_data_format(x, df):
+    """Converts NHWC images, the layout of the datasets, to the data format of a model"""
+    return to_nchw(x) if df == NCHW else x
+
+
+def from_data_format(x, df):
+    """Converts the images of a model in the data format df back to NHWC"""
+    return to_nhwc(x) if df == NCHW else x
+
+
+def channel_axis(df):
+    return 1 if df == NCHW else 3
+
+
+def dense_to_feature_map(x, h, w, c, df=NHWC, units_df=NHWC):
+    """
+    Reshapes the units of a dense layer to a [h, w, c] feature map in the data format df. units_df is the order of
+    the units of the layer, which is fixed by its checkpoints: the small feature map is transposed when it differs
+    from df so that the checkpoints keep their meaning in both data formats.
+    """
+    if units_df == NCHW:
+        x = tf.reshape(x, [-1, c, h, w])
+    else:
+        x = tf.reshape(x, [-1, h, w, c])
+    if units_df != df:
+        x = to_nhwc(x) if df == NHWC else to_nchw(x)
+    return x
+
+
+def concat_cond(x, cond, df=NHWC):
+    """Replicates the vectors cond [batch, dim] at every spatial position of the feature map x and concatenates
+    them to its channels"""
+    if df == NCHW:
+        _, _, h, w = x.get_shape().as_list()
+        cond = tf.tile(tf.expand_dims(tf.expand_dims(cond, 2), 2), [1, 1, h, w])
+    else:
+        _, h, w, _ = x.get_shape().as_list()
+        cond = tf.tile(tf.expand_dims(tf.expand_dims(cond, 1), 1), [1, h, w, 1])
+    return tf.concat([x, cond], axis=channel_axis(df))
+
+
 def df_to_channel(df):
     if df == NHWC:
         return 'channels_last'
@@ -0,0 +1,75 @@
+import tensorflow as tf
+
+# Scale of the critic output when computing the gradient penalty in mixed precision
+GP_LOSS_SCALE = 1024.0
+
+
+def fused_step(d_optimizer, d_grads, g_optimizer, g_grads, global_step=None):
+    """
+    Builds a single training op which updates both D and G from one forward pass.
+
+    All the gradients are evaluated before any variable is modified. The D gradients are applied first and the
+    G gradients are applied once the D update has finished, so one session call (and one feed) replaces the
+    separate D and G calls of the training loop.
+
+    Parameters:
+        d_optimizer: The optimizer of the discriminator
+        d_grads: A list of (gradient, variable) pairs for the discriminator as returned by compute_gradients
+        g_optimizer: The optimizer of the generator
+        g_grads: A list of (gradient, variable) pairs for the generator as returned by compute_gradients
+        global_step: Optional variable to increment with the D update
+    """
+    grads = [grad for grad, _ in d_grads + g_grads if grad is not None]
+    with tf.control_dependencies(grads):
+        d_apply = d_optimizer.apply_gradients(d_grads, global_step=global_step)
+    with tf.control_dependencies([d_apply]):
+        return g_optimizer.apply_gradients(g_grads)
+
+
+def loss_scale_optimizer(optimizer, mixed_precision, init_loss_scale=2 ** 15, incr_every_n_steps=2000):
+    """
+    Wraps the optimizer with dynamic loss scaling when training in mixed precision. The loss is multiplied by the
+    current scale before computing the float16 gradients, which are unscaled before being applied to the float32
+    master weights. Steps with non-finite gradients are skipped and the scale is halved; the scale is doubled after
+    incr_every_n_steps steps without overflows.
+    """
+    if not mixed_precision:
+        return optimizer
+    manager = tf.contrib.mixed_precision.ExponentialUpdateLossScaleManager(init_loss_scale=init_loss_scale,
+                                                                           incr_every_n_steps=incr_every_n_steps,
+                                                                           decr_every_n_nan_or_inf=1,
+                                                                           decr_ratio=0.5)
+    return tf.contrib.mixed_precision.LossScaleOptimizer(optimizer, manager)
+
+
+def input_gradient(x, y, mixed_precision, loss_scale=GP_LOSS_SCALE):
+    """Gradient of y with respect to x, as used by the gradient penalties. In mixed precision the critic output is
+    scaled before backpropagating through the float16 layers so that the intermediate gradients do not underflow."""
+    if not mixed_precision:
+        return tf.gradients(y, [x])[0]
+    return tf.gradients(y * loss_scale, [x])[0] / loss_scale
+
+
+def accumulate_gradients(grads_and_vars, accum_steps, name='grad_accum'):
+    """
+    Creates non-trainable accumulators for the given gradients so that an update can be computed from several
+    micro-batches. The accumulators are created outside the model scopes and are not part of the checkpoints.
+
+    Returns:
+        accum_op: Adds the gradients of the current micro-batch to the accumulators
+        accum_grads: A list of (gradient, variable) pairs with the gradients averaged over accum_steps micro-batches
+        zero_op: A function which builds the op resetting the accumulators. It should be built under a control
+            dependency on the op applying accum_grads.
+    """
+    grads_and_vars = [(grad, var) for grad, var in grads_and_vars if grad is not None]
+    with tf.variable_scope(name):
+        accums = [tf.Variable(tf.zeros(var.shape, dtype=var.dtype.base_dtype), trainable=False, name='accum')
+                  for _, var in grads_and_vars]
+
+    accum_op = tf.group(*[accum.assign_add(grad) for accum, (grad, _) in zip(accums, grads_and_vars)])
+    accum_grads = [(accum / float(accum_steps), var) for accum, (_, var) in zip(accums, grads_and_vars)]
+
+    def zero_op():
+        return tf.group(*[accum.assign(tf.zeros_like(accum)) for accum in accums])
+
+    return accum_op, accum_grads, zero_op
@@ -0,0 +1,117 @@
+import os
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+import tensorflow as tf
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._current = self.name
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler._record(self.name, time.perf_counter() - self.start)
+        self.profiler._current = None
+        return False
+
+
+class StepProfiler(object):
+    """
+    Times the phases of the training steps (loading the data, the D and G updates, the summaries, checkpoints etc.).
+
+    The phases are timed with context managers and the rolling percentiles of every phase over its last window calls
+    are logged every log_period steps. A phase may run several times per step (e.g. once per micro-batch) or only
+    every few steps (e.g. the summaries), so the window counts the calls of the phase rather than steps. Every
+    trace_period steps the session calls made through run are executed with a full trace and their timelines are
+    written to trace_dir in the Chrome trace format (chrome://tracing). When the profiler is disabled the phases and
+    run calls are pass-throughs.
+    """
+
+    def __init__(self, enabled=False, trace_period=0, log_period=100, window=100, trace_dir=None):
+        self.enabled = enabled
+        self.trace_period = trace_period if enabled else 0
+        self.log_period = log_period
+        self.trace_dir = trace_dir
+
+        self._times = OrderedDict()
+        self._window = window
+        self._current = None
+
+        if self.trace_period > 0:
+            if trace_dir is None:
+                raise ValueError('A trace directory is required when tracing')
+            if not os.path.exists(trace_dir):
+                os.makedirs(trace_dir)
+
+    def phase(self, name):
+        """Context manager timing the given phase of the current step"""
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def run(self, sess: tf.Session, fetches, feed_dict=None, step=None):
+        """Runs the fetches, tracing the call when the step is due for a trace"""
+        if self.trace_period <= 0 or step is None or step % self.trace_period != 0:
+            return sess.run(fetches, feed_dict=feed_dict)
+
+        from tensorflow.python.client import timeline
+
+        run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+        res = sess.run(fetches, feed_dict=feed_dict, options=run_options, run_metadata=run_metadata)
+
+        trace = timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format()
+        filename = 'timeline_%d_%s.json' % (step, self._current or 'run')
+        with open(os.path.join(self.trace_dir, filename), 'w') as f:
+            f.write(trace)
+        return res
+
+    def end_step(self, step):
+        """Marks the end of a step and logs the percentiles of the phases when they are due"""
+        if not self.enabled:
+            return
+        if self.log_period > 0 and step % self.log_period == 0:
+            print(self.format_stats(step))
+
+    def stats(self):
+        """Returns the number of calls in the rolling window and the p50, p90 and p99 time in ms of each phase"""
+        res = OrderedDict()
+        for name, times in self._times.items():
+            times = np.array(times) * 1000
+            res[name] = OrderedDict([
+                ('calls', len(times)),
+                ('p50', float(np.percentile(times, 50))),
+                ('p90', float(np.percentile(times, 90))),
+                ('p99', float(np.percentile(times, 99))),
+            ])
+        return res
+
+    def format_stats(self, step):
+        lines = ['Profile at step %d (ms per call, over the last %d calls of each phase):' % (step, self._window)]
+        for name, stats in self.stats().items():
+            lines.append('    %-12s calls: %4d  p50: %9.2f  p90: %9.2f  p99: %9.2f' % (
+                name, stats['calls'], stats['p50'], stats['p90'], stats['p99']))
+        return '\n'.join(lines)
+
+    def _record(self, name, elapsed):
+        if name not in self._times:
+            self._times[name] = deque(maxlen=self._window)
+        self._times[name].append(elapsed)
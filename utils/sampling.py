@@ -0,0 +1,68 @@
+import numpy as np
+
+# Independent random streams of a sample
+Z_STREAM = 0
+CAPTION_STREAM = 1
+COND_NOISE_STREAM = 2
+STAGEII_COND_NOISE_STREAM = 3
+
+# Bumped whenever the samples drawn for a given seed and index change
+SAMPLER_VERSION = 2
+
+
+class Sampler(object):
+    """
+    Seed-addressable sampling of the generator inputs.
+
+    The noise z, the choice of the captions and the conditioning augmentation noise of the sample with a given index
+    are drawn from counter-based Philox streams keyed by (seed, stream). The index of the sample is held by the third
+    word of the counter, which the draws never reach since they only advance the lower words, so the streams of
+    different samples never overlap. A sample therefore only depends on the seed and its index, not on the global
+    random state, the batch it is part of or the process generating it, so a generation job split across workers
+    reproduces the single-process one.
+    """
+
+    def __init__(self, seed=0):
+        self.seed = seed
+
+    def rng(self, stream, index):
+        """Returns the generator of the given stream for the sample with the given index"""
+        bit_gen = np.random.Philox(key=[self.seed, stream], counter=[0, 0, int(index), 0])
+        return np.random.Generator(bit_gen)
+
+    def z(self, indices, z_dim):
+        """The standard normal noise of the samples"""
+        return np.stack([self.rng(Z_STREAM, idx).standard_normal(z_dim) for idx in indices]).astype(np.float32)
+
+    def captions(self, indices, num_examples, num_embeddings, num_captions=4):
+        """
+        The conditioning of the samples. Returns the index of the example of every sample and the indices of the
+        num_captions embeddings of the example which are averaged.
+        """
+        examples = np.empty(len(indices), dtype=np.int64)
+        embedding_ids = np.empty((len(indices), num_captions), dtype=np.int64)
+        for i, idx in enumerate(indices):
+            rng = self.rng(CAPTION_STREAM, idx)
+            examples[i] = rng.integers(num_examples)
+            embedding_ids[i] = rng.choice(num_embeddings, num_captions, replace=False)
+        return examples, embedding_ids
+
+    def cond_noise(self, indices, dim, stream=COND_NOISE_STREAM):
+        """The conditioning augmentation noise of the samples, distributed like tf.truncated_normal"""
+        return np.stack([truncated_normal(self.rng(stream, idx), dim) for idx in indices]).astype(np.float32)
+
+    def embeddings(self, indices, embeddings, num_captions=4):
+        """Returns the mean of the chosen embeddings of every sample together with the chosen examples and embeddings"""
+        examples, embedding_ids = self.captions(indices, embeddings.shape[0], embeddings.shape[1], num_captions)
+        embed = np.mean(embeddings[examples[:, None], embedding_ids], axis=1)
+        return embed, examples, embedding_ids
+
+
+def truncated_normal(rng, size):
+    """Standard normal values redrawn when they are more than two standard deviations away from the mean"""
+    values = rng.standard_normal(size)
+    outside = np.abs(values) > 2.
+    while np.any(outside):
+        values[outside] = rng.standard_normal(np.count_nonzero(outside))
+        outside = np.abs(values) > 2.
+    return values
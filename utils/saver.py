@@ -1,5 +1,8 @@
 import os
 import re
+import queue
+import threading
+import numpy as np
 import tensorflow as tf
 
 
@@ -23,3 +26,99 @@ def load(saver: tf.train.Saver, sess: tf.Session, checkpoint_dir: str):
     else:
         print(" [*] Failed to find checkpoints")
         return False, 0
+
+
+class AsyncSaver(object):
+    """
+    Checkpoint writer which does not block the training loop. The values of the variables are copied to host memory
+    with a single session call and serialized by a background thread which owns a separate graph and session.
+
+    It can be used in place of a tf.train.Saver with the save function above and writes checkpoints with the same
+    names, so they are restored with load. Old checkpoints are rotated by max_to_keep. At most one snapshot waits
+    while another one is written.
+
+    The checkpoint state file is only updated once all the files of a checkpoint have been written, which relies on
+    TensorFlow writing that file atomically. A crash of the process while the background thread is writing may
+    therefore leave an unfinished last checkpoint, which is why TRAIN.ASYNC_CHECKPOINT is off by default.
+    """
+
+    def __init__(self, var_list=None, max_to_keep=5):
+        if var_list is None:
+            var_list = tf.global_variables()
+        self.var_list = list(var_list)
+        self.names = [var.op.name for var in self.var_list]
+        self.max_to_keep = max_to_keep
+
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='async_saver')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def save(self, sess: tf.Session, save_path, global_step=None, write_meta_graph=False):
+        """Takes a snapshot of the variables and queues it to be written. Blocks only while a previous snapshot is
+        waiting to be written."""
+        self._raise_error()
+        values = sess.run(self.var_list)
+        self._queue.put((values, save_path, global_step))
+
+    def wait(self):
+        """Blocks until all the queued checkpoints have been written"""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Writes the remaining checkpoints and stops the background thread"""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError('Failed to write checkpoint') from self._error
+
+    def _build(self, values):
+        self._graph = tf.Graph()
+        with self._graph.as_default(), tf.device('/cpu:0'):
+            self._placeholders = []
+            variables = {}
+            for i, (name, value) in enumerate(zip(self.names, values)):
+                value = np.asarray(value)
+                placeholder = tf.placeholder(tf.as_dtype(value.dtype), shape=value.shape)
+                variables[name] = tf.Variable(placeholder, trainable=False, name='var_%d' % i)
+                self._placeholders.append(placeholder)
+            self._assign = tf.group(*[var.initializer for var in variables.values()])
+            self._saver = tf.train.Saver(variables, max_to_keep=self.max_to_keep)
+        self._sess = tf.Session(graph=self._graph, config=tf.ConfigProto(device_count={'GPU': 0}))
+
+    def _write(self, values, save_path, global_step):
+        if self._error is not None:
+            return
+        try:
+            if not hasattr(self, '_sess'):
+                self._build(values)
+                # Continue the rotation of the checkpoints written by a previous run
+                ckpt = tf.train.get_checkpoint_state(os.path.dirname(save_path))
+                if ckpt:
+                    self._saver.recover_last_checkpoints(list(ckpt.all_model_checkpoint_paths))
+
+            checkpoint_dir = os.path.dirname(save_path)
+            if checkpoint_dir and not os.path.exists(checkpoint_dir):
+                os.makedirs(checkpoint_dir)
+
+            self._sess.run(self._assign, feed_dict=dict(zip(self._placeholders, values)))
+            self._saver.save(self._sess, save_path, global_step=global_step, write_meta_graph=False)
+        except Exception as e:
+            self._error = e
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            self._write(*item)
+            self._queue.task_done()
+
+        if hasattr(self, '_sess'):
+            self._sess.close()
@@ -0,0 +1,82 @@
+"""
+Per-host session profiles found by benchmarks/autotune.py.
+
+A profile holds the thread pool sizes and the thread pinning which gave the highest training throughput of a model
+on a host, together with the batch size they were measured at. The profiles of a host are stored in
+PROFILE_DIR/<hostname>.json, keyed by the name of the model (gancls, wgancls, stagei, stageii or pggan). The entry
+points build their sessions with session_config, which applies the profile of the model when there is one.
+"""
+import json
+import os
+import socket
+
+import tensorflow as tf
+
+PROFILE_DIR = './profiles/'
+
+# OpenMP settings of the thread pinning, used by the MKL builds of TensorFlow
+PINNING_ENV = {
+    'KMP_AFFINITY': 'granularity=fine,compact,1,0',
+    'KMP_BLOCKTIME': '1',
+}
+
+
+def get_profile_path(host=None, profile_dir=PROFILE_DIR):
+    return os.path.join(profile_dir, '%s.json' % (host or socket.gethostname()))
+
+
+def load_profiles(host=None, profile_dir=PROFILE_DIR):
+    """Returns the profiles of all the models of the host"""
+    path = get_profile_path(host, profile_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def get_profile(model_name, host=None, profile_dir=PROFILE_DIR):
+    """Returns the profile of the model on the host, or None if it was never tuned"""
+    return load_profiles(host, profile_dir).get(model_name)
+
+
+def save_profile(model_name, profile, host=None, profile_dir=PROFILE_DIR):
+    """Stores the profile of the model, keeping the profiles of the other models of the host"""
+    if not os.path.exists(profile_dir):
+        os.makedirs(profile_dir)
+    profiles = load_profiles(host, profile_dir)
+    profiles[model_name] = profile
+    with open(get_profile_path(host, profile_dir), 'w') as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+
+
+def pinning_env(intra_op_threads):
+    """The environment variables which pin the intra op threads to the cores"""
+    env = dict(PINNING_ENV)
+    if intra_op_threads > 0:
+        env['OMP_NUM_THREADS'] = str(intra_op_threads)
+    return env
+
+
+def session_config(model_name=None, allow_growth=True, profile_dir=PROFILE_DIR, verbose=True):
+    """
+    Builds the config of the sessions of the model. When the model has a profile on this host, its thread pool sizes
+    are used and, if the profile pins the threads, the OpenMP pinning variables which are not already set are
+    exported. The pinning only takes effect when this is called before the first session of the process is created.
+    """
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = allow_growth
+
+    profile = get_profile(model_name, profile_dir=profile_dir) if model_name else None
+    if profile is None:
+        return config
+
+    config.intra_op_parallelism_threads = profile['intra_op_threads']
+    config.inter_op_parallelism_threads = profile['inter_op_threads']
+    if profile.get('pin_threads'):
+        for name, value in pinning_env(profile['intra_op_threads']).items():
+            os.environ.setdefault(name, value)
+    if verbose:
+        print('Using the session profile of %s: %d intra op threads, %d inter op threads%s' % (
+            model_name, profile['intra_op_threads'], profile['inter_op_threads'],
+            ', pinned' if profile.get('pin_threads') else ''))
+    return config
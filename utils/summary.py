@@ -0,0 +1,120 @@
+import sys
+import time
+from collections import OrderedDict
+
+import tensorflow as tf
+
+SCALAR = 'scalar'
+EXPENSIVE = 'expensive'
+
+
+class SummaryPolicy(object):
+    """
+    Decides which summaries the training steps run and batches their writes to the event file.
+
+    The summaries of a trainer are split into cheap scalars and expensive summaries (histograms and images), and each
+    group runs on its own period. A period is given in steps or, when the number of seconds is positive, in seconds
+    of wall-clock time; a period of 0 disables the group. The evaluated summaries are buffered and written every
+    flush_period steps, so most steps neither run a summary op nor touch the writer.
+
+    Usage in a training step:
+        fetches = policy.fetches(step, {SCALAR: d_scalar_summ, EXPENSIVE: d_expensive_summ})
+        _, err_d, summaries = sess.run([d_optim, d_loss, fetches], feed_dict)
+        policy.add(summaries, step)
+    """
+
+    def __init__(self, writer: tf.summary.FileWriter, scalar_period=10, expensive_period=500, scalar_secs=0.,
+                 expensive_secs=0., flush_period=100):
+        self.writer = writer
+        self.periods = {SCALAR: (scalar_period, scalar_secs), EXPENSIVE: (expensive_period, expensive_secs)}
+        self.flush_period = flush_period
+
+        self._last_time = {SCALAR: None, EXPENSIVE: None}
+        self._due_step = None
+        self._due = ()
+        self._buffer = []
+
+    def due(self, step):
+        """Returns the groups of summaries which are due at the given step. The answer is the same for every call
+        made at the same step, so the D and G updates of a step run the same groups."""
+        if step != self._due_step:
+            now = time.time()
+            due = []
+            for group, (period, secs) in self.periods.items():
+                if secs > 0:
+                    last = self._last_time[group]
+                    if last is None or now - last >= secs:
+                        self._last_time[group] = now
+                        due.append(group)
+                elif period > 0 and step % period == 0:
+                    due.append(group)
+            self._due_step = step
+            self._due = tuple(due)
+        return self._due
+
+    def fetches(self, step, ops):
+        """Returns the summary ops of the due groups, given a dict from the group to its op or None"""
+        return {group: op for group, op in ops.items() if op is not None and group in self.due(step)}
+
+    def add(self, summaries, step):
+        """Buffers the summaries evaluated for the fetches of the step"""
+        for summary_str in summaries.values():
+            self._buffer.append((summary_str, step))
+        if self.flush_period <= 1 or (step % self.flush_period == 0 and self._buffer):
+            self.flush()
+
+    def flush(self):
+        for summary_str, step in self._buffer:
+            self.writer.add_summary(summary_str, step)
+        self._buffer = []
+        self.writer.flush()
+
+    def close(self):
+        self.flush()
+
+
+def get_summary_policy(summary_cfg, writer):
+    """Builds the policy configured by the SUMMARY block of the config of a trainer"""
+    return SummaryPolicy(writer, scalar_period=summary_cfg.SCALAR_PERIOD, expensive_period=summary_cfg.EXPENSIVE_PERIOD,
+                         scalar_secs=summary_cfg.SCALAR_SECS, expensive_secs=summary_cfg.EXPENSIVE_SECS,
+                         flush_period=summary_cfg.FLUSH_PERIOD)
+
+
+class ProgressLine(object):
+    """
+    Rate-limited replacement of the per step progress prints. The values of the steps are accumulated and a single
+    line with their mean and the steps/sec since the previous line is printed at most every period seconds. A period
+    of 0 prints every step.
+    """
+
+    def __init__(self, period=10., stream=None):
+        self.period = period
+        self.stream = stream if stream is not None else sys.stdout
+        self.start_time = time.time()
+
+        self._last_time = self.start_time
+        self._steps = 0
+        self._sums = OrderedDict()
+
+    def update(self, header, **values):
+        """Accumulates the values of a step. header identifies the step, e.g. its epoch and index."""
+        self._steps += 1
+        for name, value in values.items():
+            self._sums[name] = self._sums.get(name, 0.) + float(value)
+
+        now = time.time()
+        if self.period <= 0 or now - self._last_time >= self.period:
+            self._print(header, now)
+
+    def _print(self, header, now):
+        elapsed = now - self._last_time
+        line = '%s time: %4.4f, %.2f steps/s' % (header, now - self.start_time,
+                                                 self._steps / elapsed if elapsed > 0 else float('inf'))
+        for name, total in self._sums.items():
+            line += ', %s: %.8f' % (name, total / self._steps)
+        self.stream.write(line + '\n')
+        self.stream.flush()
+
+        self._last_time = now
+        self._steps = 0
+        self._sums = OrderedDict()
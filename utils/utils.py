@@ -1,22 +1,22 @@
 """
 Some codes are taken from https://github.com/Newmu/dcgan_code
+
+TensorFlow, scipy and moviepy are imported by the functions which use them, so importing this module stays cheap for
+the scripts which only need its numpy helpers.
 """
 import math
 import pprint
-import scipy.misc
 import numpy as np
 import os
-import imageio
-
-import tensorflow as tf
-import tensorflow.contrib.slim as slim
 
 pp = pprint.PrettyPrinter()
-imageio.plugins.ffmpeg.download()
 get_stddev = lambda x, k_h, k_w: 1 / math.sqrt(k_w * k_h * x.get_shape()[-1])
 
 
 def show_all_variables():
+    import tensorflow as tf
+    import tensorflow.contrib.slim as slim
+
     model_vars = tf.trainable_variables()
     slim.model_analyzer.analyze_vars(model_vars, print_info=True)
 
@@ -28,28 +28,24 @@ def save_images(images, size, image_path):
 
 
 def merge(images, size):
-    h, w = images.shape[1], images.shape[2]
-    if images.shape[3] in (3, 4):
-        c = images.shape[3]
-        img = np.zeros((h * size[0], w * size[1], c))
-        for idx, image in enumerate(images):
-            i = idx % size[1]
-            j = idx // size[1]
-            img[j * h:j * h + h, i * w:i * w + w, :] = image
-        return img
-    elif images.shape[3] == 1:
-        img = np.zeros((h * size[0], w * size[1]))
-        for idx, image in enumerate(images):
-            i = idx % size[1]
-            j = idx // size[1]
-            img[j * h:j * h + h, i * w:i * w + w] = image[:, :, 0]
-        return img
-    else:
+    """Places the images on a size[0] x size[1] grid. The empty cells of the grid are left black."""
+    n, h, w, c = images.shape
+    if c not in (1, 3, 4):
         raise ValueError('in merge(x,size) x parameter '
                          'must have dimensions: HxW or HxWx3 or HxWx4')
+    cells = size[0] * size[1]
+    if n < cells:
+        images = np.concatenate([images, np.zeros((cells - n, h, w, c), dtype=images.dtype)], axis=0)
+    img = images[:cells].reshape(size[0], size[1], h, w, c).transpose(0, 2, 1, 3, 4).reshape(size[0] * h,
+                                                                                            size[1] * w, c)
+    if c == 1:
+        return img[:, :, 0]
+    return img
 
 
 def imsave(images, size, path):
+    import scipy.misc
+
     image = np.squeeze(merge(images, size))
     return scipy.misc.imsave(path, image)
 
@@ -58,8 +54,19 @@ def inverse_transform(images):
     return (images + 1.) / 2.
 
 
+def import_moviepy():
+    """Imports moviepy. Its ffmpeg binary is only downloaded, by imageio, when a gif is made and it is missing."""
+    import imageio
+    try:
+        import moviepy.editor as mpy
+    except imageio.core.NeedDownloadError:
+        imageio.plugins.ffmpeg.download()
+        import moviepy.editor as mpy
+    return mpy
+
+
 def make_gif(images, fname, duration=2, true_image=False):
-    import moviepy.editor as mpy
+    mpy = import_moviepy()
 
     def make_frame(t):
         try:
@@ -109,6 +116,8 @@ def save_captions(directory: str, captions):
 
 
 def load_inception_data(full_path, alphabetic=False):
+    import scipy.misc
+
     print(full_path)
     if not os.path.exists(full_path):
         raise RuntimeError('Path %s does not exits' % full_path)
@@ -130,6 +139,8 @@ def load_inception_data(full_path, alphabetic=False):
 
 
 def prep_incep_img(img):
+    import scipy.misc
+
     # print('img', img.shape, img.max(), img.min())
     # img = Image.fromarray(img, 'RGB')
     if len(img.shape) == 2:
@@ -147,6 +158,8 @@ def denormalize_images(images):
 
 
 def initialize_uninitialized(sess, verbose=True):
+    import tensorflow as tf
+
     global_vars = tf.global_variables()
     is_not_initialized = sess.run([tf.is_variable_initialized(var) for var in global_vars])
     not_initialized_vars = [v for (v, f) in zip(global_vars, is_not_initialized) if not f]
@@ -159,6 +172,8 @@ def initialize_uninitialized(sess, verbose=True):
 
 
 def resize_imgs(imgs, size, interp='bicubic'):
+    import scipy.misc
+
     res = []
     for img in imgs:
         res.append(scipy.misc.imresize(img, size, interp))
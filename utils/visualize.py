@@ -1,7 +1,4 @@
 import numpy as np
-import scipy
-from scipy import misc
-from PIL import Image, ImageDraw, ImageFont
 
 from preprocess.dataset import TextDataset
 from utils.utils import denormalize_images, resize_imgs
@@ -56,6 +53,8 @@ def interp_z(sess, gen_op, cond_sample, z1, z2, z='z:0', cond='cond:0', method='
 
 def write_caption(img, caption, font_size, vert_pos, split=50):
     """Writes a caption on the top row of the provided image. Blank space should be left on the top row."""
+    from PIL import Image, ImageDraw, ImageFont
+
     img_txt = Image.fromarray(img)
     # get a font
     try:
@@ -90,6 +89,9 @@ def preporcess_caption(cap: str):
 
 def save_cap_batch(img_batch, caption, path, rows=None, split=50):
     """Creates a super image of generated images with the caption of the images written on a top blank row."""
+    from PIL import Image
+    from scipy import misc
+
     img_shape = img_batch[0].shape
     font_size = img_shape[0] // 3 - 2
     super_img = prepare_img_for_captioning(img_batch, bottom=False, rows=rows)
@@ -135,6 +137,9 @@ def prepare_img_for_captioning(img_batch, bottom, rows=None):
 def save_interp_cap_batch(img_batch, cap1, cap2, path, rows=None):
     """Creates a super image of interpolated captions."""
     """Creates a super image of generated images with the caption of the images written on a top blank row."""
+    from PIL import Image
+    from scipy import misc
+
     img_shape = img_batch[0].shape
     font_size = img_shape[0] // 3 - 2
     super_img = prepare_img_for_captioning(img_batch, bottom=True, rows=rows)
@@ -150,7 +155,14 @@ def save_interp_cap_batch(img_batch, cap1, cap2, path, rows=None):
     misc.imsave(path, super_img)
 
 
-def gen_noise_interp_img(sess, gen_op, cond, z_dim, batch_size):
+def cond_feed(cond, cond_cache=None):
+    """Feeds the conditions directly or, for generators built on a ConditionalsCache, their cached statistics"""
+    if cond_cache is None:
+        return {'cond:0': cond}
+    return cond_cache.feed_dict(cond)
+
+
+def gen_noise_interp_img(sess, gen_op, cond, z_dim, batch_size, cond_cache=None):
     """Generates a batch of images interpolated in the noise space"""
     z = np.random.standard_normal(size=(2, z_dim))
     sample_z = get_interpolated_batch(z[0], z[1], batch_size=batch_size, method='slerp')
@@ -159,33 +171,33 @@ def gen_noise_interp_img(sess, gen_op, cond, z_dim, batch_size):
 
     samples = sess.run(gen_op, feed_dict={
         'z:0': sample_z,
-        'cond:0': cond,
+        **cond_feed(cond, cond_cache),
     })
 
     return samples
 
 
-def gen_cond_interp_img(sess, gen_op, cond1, cond2, z_dim, batch_size):
+def gen_cond_interp_img(sess, gen_op, cond1, cond2, z_dim, batch_size, cond_cache=None):
     """Generates a batch of images interpolated in the condition space"""
     sample_z = np.random.standard_normal(size=(batch_size, z_dim))
     cond = get_interpolated_batch(cond1, cond2, batch_size=batch_size, method='lerp')
 
     samples = sess.run(gen_op, feed_dict={
         'z:0': sample_z,
-        'cond:0': cond,
+        **cond_feed(cond, cond_cache),
     })
 
     return samples
 
 
-def gen_captioned_img(sess, gen_op, cond, z_dim, batch_size):
+def gen_captioned_img(sess, gen_op, cond, z_dim, batch_size, cond_cache=None):
     """Generates a batch of images with the same caption"""
     sample_z = np.random.standard_normal(size=(batch_size, z_dim))
     cond = np.tile(np.expand_dims(cond, 0), reps=(batch_size, 1))
 
     samples = sess.run(gen_op, feed_dict={
         'z:0': sample_z,
-        'cond:0': cond,
+        **cond_feed(cond, cond_cache),
     })
 
     return samples
@@ -215,13 +227,13 @@ def closest_images_of_batch(fake_imgs, dataset: TextDataset):
     return np.array(closest_batch)
 
 
-def gen_closest_neighbour_img(sess, gen_op, cond, z_dim, batch_size, dataset):
+def gen_closest_neighbour_img(sess, gen_op, cond, z_dim, batch_size, dataset, cond_cache=None):
     """Generates a batch of images and appends to it their closest neighbours"""
     sample_z = np.random.standard_normal(size=(batch_size, z_dim))
 
     samples = sess.run(gen_op, feed_dict={
         'z:0': sample_z,
-        'cond:0': cond,
+        **cond_feed(cond, cond_cache),
     })
     samples = samples[:8]
     samples = np.clip(samples, -1., 1.)
@@ -251,6 +263,8 @@ def gen_multiple_stage_img(sess, gen_ops, cond, z_dim, batch_size, size=128):
 
 def gen_pggan_sample(samples, size=128, interp='bicubic'):
     """Same image at multiple PGGAN scales"""
+    import scipy.misc
+
     stages = len(samples)
     batch_size = len(samples[0])
     new_samples = np.empty(shape=(stages, batch_size, size, size, 3))